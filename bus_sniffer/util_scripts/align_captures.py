@@ -0,0 +1,261 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   align_captures.py
+#
+#   Find the offsets between captures of the same program, such as repeated
+#   runs of a loader, so that they can be trimmed to the same cycles.
+#
+#   Each cycle of a capture is reduced to one symbol: its bus status and queue
+#   status, 32 values in all. Each symbol is given a fixed random phase, and
+#   the two symbol sequences are cross-correlated with an FFT. Cycles that
+#   match add 1 to the correlation at their offset, while cycles that don't
+#   add a random phase that averages out, so the highest peaks are the offsets
+#   with the most matching cycles. The best few are checked by counting the
+#   matching cycles directly.
+#
+#   The first capture is the reference, and every other capture is aligned to
+#   it. With --block N, the reference is then split into blocks of N cycles,
+#   and each block is aligned again within --drift cycles of the overall
+#   offset, to show where the captures drift apart (for instance, by a
+#   different number of wait states or DMA refresh cycles).
+#
+#   The offsets are printed along with the time range of the cycles the
+#   captures share, as arguments for trim.py, and can be written to a CSV with
+#   --out and to a JSON report with the block offsets with --report. An offset
+#   of N means cycle C of the reference is cycle C + N of the other capture.
+#   Since most cycles are passive, unrelated captures still match on many
+#   cycles; the fraction expected by chance is printed for comparison.
+#
+#   The captures are cycle CSVs (see export_cycles.py), or decoded traces.
+#   The FFT uses 16 bytes per cycle of both captures; --length limits the
+#   number of cycles read from each.
+#
+#   Command Line Arguments:
+#   reference capture [capture ...] [--length N] [--block N] [--drift N]
+#   [--min-overlap N] [--out CSV] [--report JSON]
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from collections import namedtuple
+
+import decode_stream
+from bus_core import arrays
+from progress import Progress
+
+SYMBOL_COLUMNS = ['Time(s)', 'QS0', 'QS1', 'S0', 'S1', 'S2']
+
+# Number of distinct symbols: 8 bus states times 4 queue states.
+SYMBOLS = 32
+
+# The highest correlation peaks checked by counting matches.
+CANDIDATES = 8
+
+# Offsets where the captures share fewer cycles than this aren't considered.
+MIN_OVERLAP = 10000
+
+# Default search range around the overall offset for each block.
+DRIFT = 1000
+
+# Fixed, so that the same captures always align the same way.
+PHASE_SEED = 8088
+
+Capture = namedtuple('Capture', ['path', 'symbols', 'times'])
+
+# 'offset' is the best offset, 'matches' the number of matching cycles at it,
+# and 'overlap' the number of cycles the captures share there.
+Alignment = namedtuple('Alignment', ['offset', 'matches', 'overlap'])
+
+PHASES = np.exp(2j * np.pi * np.random.default_rng(PHASE_SEED).random(SYMBOLS))
+
+def read_capture(path, length=None, chunk_size=decode_stream.CHUNK_SIZE):
+    """ Read the symbol and time of each cycle of a capture, up to 'length' cycles. """
+    symbols = []
+    times = []
+    total = 0
+    progress = Progress('Read', path=path, unit='cycles')
+    with open(path, 'rb') as file:
+        chunks = pd.read_csv(progress.follow(file), comment=';', chunksize=chunk_size,
+                             usecols=lambda c: c.strip() in SYMBOL_COLUMNS)
+        for chunk in chunks:
+            chunk.columns = chunk.columns.str.strip()
+            if length is not None:
+                chunk = chunk.iloc[:length - total]
+            symbols.append((arrays.bus_status(chunk) * 4 + arrays.queue_ops(chunk)).astype(np.uint8))
+            times.append(chunk['Time(s)'].to_numpy(dtype=np.float64))
+            total += len(chunk)
+            progress.update(len(chunk))
+            if length is not None and total >= length:
+                break
+    progress.finish()
+    if not symbols:
+        return Capture(path, np.empty(0, dtype=np.uint8), np.empty(0))
+    return Capture(path, np.concatenate(symbols), np.concatenate(times))
+
+def overlap(len_a, len_b, offset):
+    """ Return the first cycle of 'a' shared with 'b' at 'offset', and the number shared. """
+    start = max(0, -offset)
+    return start, max(0, min(len_a, len_b - offset) - start)
+
+def count_matches(a, b, offset):
+    start, shared = overlap(len(a), len(b), offset)
+    return int(np.count_nonzero(a[start:start + shared] == b[start + offset:start + offset + shared]))
+
+def chance(a, b):
+    """ Return the fraction of cycles expected to match at a random offset. """
+    freq_a = np.bincount(a, minlength=SYMBOLS) / max(len(a), 1)
+    freq_b = np.bincount(b, minlength=SYMBOLS) / max(len(b), 1)
+    return float(freq_a @ freq_b)
+
+def align(a, b, min_overlap=MIN_OVERLAP, lags=None):
+    """ Return the offset of 'b' relative to 'a' with the most matching cycles,
+    out of the offsets in the range 'lags' if given. Returns None if no offset
+    leaves 'min_overlap' cycles shared.
+    """
+    size = 1 << (len(a) + len(b) - 1).bit_length()
+    correlation = np.fft.ifft(np.conj(np.fft.fft(PHASES[a], size)) * np.fft.fft(PHASES[b], size)).real
+
+    # Index k of the correlation is offset k, or k - size for negative offsets.
+    offsets = np.arange(size)
+    offsets[offsets >= len(b)] -= size
+    valid = offsets > -len(a)
+    if lags is not None:
+        valid &= (offsets >= lags[0]) & (offsets <= lags[1])
+    shared = np.minimum(len(a), len(b) - offsets) - np.maximum(0, -offsets)
+    valid &= shared >= min(min_overlap, len(a), len(b))
+    if not valid.any():
+        return None
+
+    # Compare by the fraction of shared cycles that match, so that offsets
+    # sharing only a few cycles don't lose out.
+    score = np.where(valid, correlation / np.maximum(shared, 1), -np.inf)
+    candidates = np.argpartition(score, -CANDIDATES)[-CANDIDATES:] if len(score) > CANDIDATES else np.arange(len(score))
+    best = None
+    for k in candidates[np.isfinite(score[candidates])]:
+        offset = int(offsets[k])
+        alignment = Alignment(offset, count_matches(a, b, offset), int(shared[k]))
+        if best is None or alignment.matches * best.overlap > best.matches * alignment.overlap:
+            best = alignment
+    return best
+
+def align_blocks(a, b, offset, block, drift):
+    """ Align each block of 'block' cycles of 'a' within 'drift' cycles of 'offset'.
+    Returns a list of (first cycle, alignment) tuples; the alignment is None if
+    the block couldn't be aligned.
+    """
+    blocks = []
+    progress = Progress('Blocks', (len(a) + block - 1) // block, unit='blocks')
+    for first in range(0, len(a), block):
+        piece = a[first:first + block]
+        # The cycles of 'b' the block can match within the drift.
+        lo = max(0, first + offset - drift)
+        hi = min(len(b), first + offset + len(piece) + drift)
+        alignment = None
+        if hi > lo:
+            found = align(piece, b[lo:hi], len(piece) // 2, (first + offset - drift - lo, first + offset + drift - lo))
+            if found is not None:
+                alignment = found._replace(offset=found.offset + lo - first)
+        blocks.append((first, alignment))
+        progress.update(1)
+    progress.finish()
+    return blocks
+
+def aligned_path(path):
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.aligned{ext}'
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the offsets between captures of the same program.")
+    parser.add_argument('reference')
+    parser.add_argument('captures', nargs='+')
+    parser.add_argument('--length', type=int, default=None, help="Read at most this many cycles from each capture.")
+    parser.add_argument('--block', type=int, default=None, help="Also align each block of this many cycles.")
+    parser.add_argument('--drift', type=int, default=DRIFT,
+                        help="Search this many cycles around the overall offset for each block.")
+    parser.add_argument('--min-overlap', type=int, default=MIN_OVERLAP,
+                        help="Ignore offsets where the captures share fewer cycles.")
+    parser.add_argument('--out', default=None, help="Write the offsets to this CSV.")
+    parser.add_argument('--report', default=None, help="Write the offsets and block offsets to this JSON file.")
+    args = parser.parse_args()
+
+    reference = read_capture(args.reference, args.length)
+    print(f"{args.reference}: {len(reference.symbols)} cycles")
+
+    results = []
+    for path in args.captures:
+        capture = read_capture(path, args.length)
+        alignment = align(reference.symbols, capture.symbols, args.min_overlap)
+        if alignment is None:
+            print(f"{path}: can't be aligned, the captures are too short")
+            results.append({'capture': path, 'offset': None})
+            continue
+
+        start, shared = overlap(len(reference.symbols), len(capture.symbols), alignment.offset)
+        other = start + alignment.offset
+        result = {
+            'capture': path,
+            'offset': alignment.offset,
+            'match': alignment.matches / alignment.overlap,
+            'overlap': shared,
+            'chance': chance(reference.symbols, capture.symbols),
+            'reference_start_time': reference.times[start].item(),
+            'reference_end_time': reference.times[start + shared - 1].item(),
+            'start_time': capture.times[other].item(),
+            'end_time': capture.times[other + shared - 1].item(),
+        }
+        print(f"{path}: offset {alignment.offset:+} cycles, {result['match']:.2%} of {shared} shared cycles match "
+              f"({result['chance']:.2%} by chance)")
+        print(f"  trim.py {result['reference_start_time']!r} {result['reference_end_time']!r} {args.reference} "
+              f"{aligned_path(args.reference)}")
+        print(f"  trim.py {result['start_time']!r} {result['end_time']!r} {path} {aligned_path(path)}")
+
+        if args.block:
+            blocks = align_blocks(reference.symbols, capture.symbols, alignment.offset, args.block, args.drift)
+            result['blocks'] = [{
+                'first': first,
+                'offset': None if block is None else block.offset,
+                'drift': None if block is None else block.offset - alignment.offset,
+                'match': None if block is None else block.matches / block.overlap,
+            } for first, block in blocks]
+            drifts = [block['drift'] for block in result['blocks'] if block['drift'] is not None]
+            if drifts:
+                print(f"  {len(drifts)} of {len(blocks)} blocks aligned, drift {min(drifts):+} to {max(drifts):+} cycles")
+        results.append(result)
+
+    if args.out:
+        columns = ['capture', 'offset', 'match', 'overlap', 'chance', 'reference_start_time', 'reference_end_time',
+                   'start_time', 'end_time']
+        pd.DataFrame(results, columns=columns).to_csv(args.out, index=False)
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump({'reference': args.reference, 'captures': results}, file, indent=2)
+
+    if any(result['offset'] is None for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   analyzers.py
+#
+#   Analyzer plugins run during the decode pass.
+#
+#   An analyzer answers one question about a trace, such as which IO ports
+#   were accessed or when interrupts were acknowledged. Instead of re-reading
+#   the decoded CSV, it subscribes to events raised by the decoder as it goes,
+#   so any number of analyzers share a single pass over the trace.
+#
+#   An analyzer subscribes to an event by defining a method for it:
+#
+#   on_bus_cycle(n, cycle)
+#       A bus cycle ended. 'n' is its ALE cycle and 'cycle' a BusCycle.
+#   on_interrupt_ack(n, vector)
+#       An interrupt was acknowledged. 'n' is the second INTA bus cycle, which
+#       read the interrupt vector.
+#   on_instruction(n, inst, end)
+#       An instruction retired. 'n' is the cycle its first byte was read from
+#       the queue and 'inst' is its list of bytes, prefixes included. 'end' is
+#       the cycle the next instruction's first byte was read.
+#   on_queue_flush(n)
+#       The prefetch queue was flushed. 'n' is the cycle with QOP 'E'.
+#   on_scanline(n, frame, line) / on_frame(n, frame)
+#       HSYNC / VSYNC fell, starting a new scanline / frame. Needs HS and VS.
+#
+#   After the decode, results() returns a list of dicts or a DataFrame, which
+#   is written to <output>.<name>, in the same format as the decoded output. An
+#   analyzer in another module is loaded by giving 'module:Class' instead of a
+#   built-in name.
+
+import importlib
+import json
+import os
+
+import numpy as np
+
+from array import array
+from collections import deque, namedtuple
+
+import trace_io
+from bus_core import BusStatus, TState, INSTR_PREFIXES
+from disasm_cache import DisasmCache
+from formatting import categorical
+from stages import with_dependencies
+
+# The stage that raises each event.
+EVENT_STAGES = {
+    'bus_cycle': 'bus',
+    'interrupt_ack': 'bus',
+    'instruction': 'fetch',
+    'queue_flush': 'queue',
+    'scanline': 'raster',
+    'frame': 'raster',
+}
+
+# A complete bus cycle. 'status' is a BusStatus value, 'segment' a Segment
+# value, 'data' the byte transferred or None, 'waits' the number of wait
+# states, and 'inst' the IDX of the instruction executing when it started.
+BusCycle = namedtuple('BusCycle', ['n', 'status', 'address', 'segment', 'data', 'waits', 'inst'])
+
+class Analyzer:
+    """ Base class for analyzers. Subclasses define on_<event> methods, and
+    may list extra decode stages they need in 'stages'.
+    """
+    name = None
+    stages = ()
+
+    def results(self):
+        return None
+
+class Analyzers:
+    """ Dispatches decoder events to a list of analyzers. Only events on cycles
+    'start' through 'end' are passed on.
+    """
+    def __init__(self, analyzers, start=0, end=None):
+        self.analyzers = list(analyzers)
+        self.start = start
+        self.end = end
+        self.handlers = {event: [getattr(a, 'on_' + event) for a in self.analyzers if hasattr(a, 'on_' + event)]
+                         for event in EVENT_STAGES}
+
+        # The bus cycle in progress: its ALE cycle, status and address, then its
+        # segment and instruction, data byte and wait states.
+        self.bus = None
+        self.bus_seg = None
+        self.bus_inst = None
+        self.bus_data = None
+        self.bus_waits = 0
+        self.prev_inta = False
+
+        # Scanline and frame boundaries not yet reached by the bus pass.
+        self.boundaries = deque()
+
+    def __bool__(self):
+        return bool(self.analyzers)
+
+    def wants(self, event):
+        return bool(self.handlers[event])
+
+    def stages(self):
+        """ Return the decode stages needed to raise the subscribed events. """
+        needed = [EVENT_STAGES[event] for event, handlers in self.handlers.items() if handlers]
+        for analyzer in self.analyzers:
+            needed.extend(analyzer.stages)
+        return with_dependencies(needed)
+
+    def emit(self, event, n, *args):
+        if n < self.start or (self.end is not None and n > self.end):
+            return
+        for handler in self.handlers[event]:
+            handler(n, *args)
+
+    def cycle(self, n, ale, t_state, d, seg, state):
+        """ Track bus cycles. Called for each cycle after BusDecoder.cycle(),
+        with the cycle's segment status.
+        """
+        if self.boundaries:
+            self.raster_until(n)
+
+        if ale:
+            self.bus = (n, state.busl, state.al)
+            self.bus_seg = None
+            self.bus_data = None
+            self.bus_waits = 0
+            return
+        if self.bus is None:
+            return
+
+        if t_state == TState.T2:
+            # The segment is valid from T2. By now the ALE cycle's instruction
+            # fetch step has run, so 'idx' is that cycle's IDX.
+            self.bus_seg = seg
+            self.bus_inst = state.idx
+        elif t_state == TState.TW:
+            self.bus_waits += 1
+        if d is not None:
+            self.bus_data = d
+        if t_state == TState.T4:
+            start, status, address = self.bus
+            self.bus = None
+            self.emit('bus_cycle', start, BusCycle(start, status, address, self.bus_seg, self.bus_data,
+                                                   self.bus_waits, self.bus_inst))
+
+            # The CPU runs two INTA bus cycles for an interrupt. The vector is
+            # read by the second.
+            if status == BusStatus.INTA:
+                if self.prev_inta:
+                    self.emit('interrupt_ack', start, self.bus_data)
+                self.prev_inta = not self.prev_inta
+            else:
+                self.prev_inta = False
+
+    def raster(self, n, hs, vs, prev_hs, prev_vs, frame, r_y):
+        """ Queue the scanline and frame boundaries in a chunk starting at cycle
+        'n'. prev_hs and prev_vs are the sync levels before the chunk, or None.
+        """
+        hs_fall = (hs == 0) & (np.concatenate(([prev_hs == 1], hs[:-1] == 1)))
+        vs_fall = (vs == 0) & (np.concatenate(([prev_vs == 1], vs[:-1] == 1)))
+        # On a cycle starting both, the new frame comes first.
+        for i in np.flatnonzero(hs_fall | vs_fall).tolist():
+            if vs_fall[i]:
+                self.boundaries.append((n + i, 'frame', (frame[i].item(),)))
+            if hs_fall[i]:
+                self.boundaries.append((n + i, 'scanline', (frame[i].item(), r_y[i].item())))
+
+    def raster_until(self, n):
+        """ Raise the queued boundaries up to and including cycle 'n'. """
+        while self.boundaries and self.boundaries[0][0] <= n:
+            cycle, event, args = self.boundaries.popleft()
+            self.emit(event, cycle, *args)
+
+    def write_results(self, output_csv):
+        """ Write each analyzer's results next to the decoded output. """
+        import pandas as pd
+
+        base, ext = os.path.splitext(output_csv)
+        if trace_io.trace_format(output_csv) == 'csv':
+            ext = '.csv'
+        for analyzer in self.analyzers:
+            results = analyzer.results()
+            if results is None:
+                continue
+            if len(results) == 0:
+                print(f"No {analyzer.name} results")
+                continue
+            path = f'{base}.{analyzer.name}{ext}'
+            trace_io.write_trace(pd.DataFrame(results), path)
+            print(f"Wrote {len(results)} {analyzer.name} results to {path}")
+
+class IoAnalyzer(Analyzer):
+    """ Every IO port read and write, described from ports.json. """
+    name = 'io'
+
+    def __init__(self, ports_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ports.json')):
+        try:
+            with open(ports_file, 'r') as file:
+                self.ports = json.load(file)
+        except (OSError, ValueError):
+            self.ports = {}
+        self.rows = []
+
+    def on_bus_cycle(self, n, cycle):
+        if cycle.status == BusStatus.IOR or cycle.status == BusStatus.IOW:
+            port = cycle.address & 0xFFFF
+            op = 'R' if cycle.status == BusStatus.IOR else 'W'
+            desc = self.ports.get(f'{port:04X}{op.lower()}', '')
+            self.rows.append({'N': n, 'PORT': f'{port:04X}', 'OP': op,
+                              'DATA': f'{cycle.data:02X}' if cycle.data is not None else None, 'DESC': desc})
+
+    def results(self):
+        return self.rows
+
+class InterruptAnalyzer(Analyzer):
+    """ Every interrupt acknowledge, with the cycles since the previous one. """
+    name = 'interrupts'
+
+    def __init__(self):
+        self.rows = []
+        self.last = None
+
+    def on_interrupt_ack(self, n, vector):
+        delta = n - self.last if self.last is not None else None
+        self.last = n
+        self.rows.append((n, vector, delta))
+
+    def results(self):
+        import pandas as pd
+
+        # The first interrupt has no DELTA, and a vector may not have been read,
+        # so both are nullable integer columns.
+        n, vector, delta = zip(*self.rows) if self.rows else ((), (), ())
+        return pd.DataFrame({'N': np.array(n, dtype=np.int64), 'VECTOR': pd.array(vector, dtype='UInt8'),
+                             'DELTA': pd.array(delta, dtype='Int64')})
+
+class VramAnalyzer(Analyzer):
+    """ Number of CPU writes to CGA video memory on each scanline. """
+    name = 'vram'
+
+    VRAM_START = 0xB8000
+    VRAM_END = 0xBFFFF
+
+    def __init__(self):
+        self.rows = []
+        self.line = {'N': 0, 'FRAME': 0, 'LINE': 0, 'WRITES': 0}
+
+    def on_scanline(self, n, frame, line):
+        if self.line['WRITES']:
+            self.rows.append(self.line)
+        self.line = {'N': n, 'FRAME': frame, 'LINE': line, 'WRITES': 0}
+
+    def on_bus_cycle(self, n, cycle):
+        if cycle.status == BusStatus.MEMW and self.VRAM_START <= cycle.address <= self.VRAM_END:
+            self.line['WRITES'] += 1
+
+    def results(self):
+        if self.line['WRITES']:
+            self.rows.append(self.line)
+        return self.rows
+
+class BusCycleTable(Analyzer):
+    """ One record per bus cycle, instead of one row per clock. Uses the same
+    column names as the decoded trace, so it is formatted and read the same way.
+    """
+    name = 'cycles'
+    stages = ('fetch',)
+
+    def __init__(self):
+        self.cycles = []
+
+    def on_bus_cycle(self, n, cycle):
+        self.cycles.append(cycle)
+
+    def results(self):
+        import pandas as pd
+
+        cycles = BusCycle(*zip(*self.cycles)) if self.cycles else BusCycle(*[()] * len(BusCycle._fields))
+        segment = [seg if seg is not None else -1 for seg in cycles.segment]
+        return pd.DataFrame({
+            'N': np.array(cycles.n, dtype=np.int64),
+            'BUSL': categorical(np.array(cycles.status, dtype=np.int8), 'BUSL'),
+            'AL': pd.array(cycles.address, dtype='Int32'),
+            'SEG': categorical(np.array(segment, dtype=np.int8), 'SEG'),
+            'D': pd.array(cycles.data, dtype='UInt8'),
+            'WAITS': np.array(cycles.waits, dtype=np.int64),
+            'IDX': np.array(cycles.inst, dtype=np.int64),
+        })
+
+class InstructionTable(Analyzer):
+    """ One record per retired instruction or interrupt: its start cycle, length
+    in cycles, bytes, disassembly, prefix count, and the number of bus cycles of
+    each type started during it.
+
+    An interrupt record runs from the first INTA bus cycle to the first byte of
+    the handler, and ends the instruction it interrupted.
+    """
+    name = 'instructions'
+
+    # Bus cycle types counted, and the statuses counted as each.
+    BUS_COUNTS = {
+        'CODE': [BusStatus.CODE],
+        'MEMR': [BusStatus.MEMR],
+        'MEMW': [BusStatus.MEMW],
+        'IO': [BusStatus.IOR, BusStatus.IOW],
+    }
+
+    def __init__(self):
+        self.instructions = []
+        self.interrupts = []
+        # ALE cycle and status of every bus cycle
+        self.bus_n = array('q')
+        self.bus_status = array('b')
+        self.first_inta = None
+
+    def on_bus_cycle(self, n, cycle):
+        self.bus_n.append(n)
+        self.bus_status.append(cycle.status)
+        if cycle.status == BusStatus.INTA and self.first_inta is None:
+            self.first_inta = n
+
+    def on_interrupt_ack(self, n, vector):
+        self.interrupts.append((self.first_inta if self.first_inta is not None else n, vector))
+        self.first_inta = None
+
+    def on_instruction(self, n, inst, end):
+        self.instructions.append((n, bytes(inst), end))
+
+    def records(self):
+        """ Yield (start, end, inst, vector), splitting instructions at interrupts. """
+        interrupts = deque(self.interrupts)
+        for start, inst, end in self.instructions:
+            # Interrupts acknowledged before this instruction started were
+            # already handled, or precede the first instruction.
+            while interrupts and interrupts[0][0] < start:
+                interrupts.popleft()
+            if interrupts and interrupts[0][0] < end:
+                int_start, vector = interrupts.popleft()
+                yield start, int_start, inst, None
+                yield int_start, end, b'', vector
+            else:
+                yield start, end, inst, None
+
+    def results(self):
+        import pandas as pd
+
+        cache = DisasmCache.load()
+        rows = {col: [] for col in ['N', 'CYCLES', 'INST', 'DISASM', 'PREFIXES', 'VECTOR']}
+        for start, end, inst, vector in self.records():
+            rows['N'].append(start)
+            rows['CYCLES'].append(end - start)
+            rows['INST'].append(inst)
+            rows['DISASM'].append(cache.lookup(inst.hex()) if inst else 'INT')
+            rows['PREFIXES'].append(next((i for i, byte in enumerate(inst) if byte not in INSTR_PREFIXES), len(inst)))
+            rows['VECTOR'].append(vector)
+        cache.save()
+
+        df = pd.DataFrame(rows)
+        df['VECTOR'] = pd.array(rows['VECTOR'], dtype='UInt8')
+        if len(df) == 0:
+            return df
+
+        # Count the bus cycles starting between each record's start and the next.
+        starts = df['N'].to_numpy()
+        bus_n = np.frombuffer(self.bus_n, dtype=np.int64)
+        bus_status = np.frombuffer(self.bus_status, dtype=np.int8)
+        record = np.searchsorted(starts, bus_n, side='right') - 1
+        ends = starts + df['CYCLES'].to_numpy()
+        inside = (record >= 0) & (bus_n < ends[np.maximum(record, 0)])
+        for col, statuses in self.BUS_COUNTS.items():
+            counted = inside & np.isin(bus_status, statuses)
+            df[col] = np.bincount(record[counted], minlength=len(df))
+        return df
+
+BUILTIN_ANALYZERS = {cls.name: cls for cls in (IoAnalyzer, InterruptAnalyzer, VramAnalyzer, BusCycleTable,
+                                               InstructionTable)}
+
+def load_analyzer(spec):
+    """ Create an analyzer from a built-in name or 'module:Class'. """
+    if spec in BUILTIN_ANALYZERS:
+        return BUILTIN_ANALYZERS[spec]()
+    if ':' not in spec:
+        raise ValueError(f"Unknown analyzer '{spec}'. Built-in analyzers: {', '.join(BUILTIN_ANALYZERS)}")
+    module_name, class_name = spec.split(':', 1)
+    analyzer = getattr(importlib.import_module(module_name), class_name)()
+    if analyzer.name is None:
+        analyzer.name = class_name.lower()
+    return analyzer
@@ -0,0 +1,110 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   anomalies.py
+#
+#   Collects the anomalies found while decoding, such as queue overflows and
+#   instructions that can't be disassembled.
+#
+#   A glitchy capture can have hundreds of thousands of them, so instead of
+#   printing each one they are counted by kind, and only the first few of each
+#   kind are kept as examples. The summary is printed at the end of a decode
+#   and written to <output>.anomalies.json.
+#
+#   The decoder can also flag the cycles with anomalies in an ANOM column, a
+#   bitmask of the ANOMALY_FLAGS of each anomaly on that cycle.
+
+import json
+import os
+
+# Bit set in the ANOM column for each kind of anomaly.
+ANOMALY_FLAGS = {
+    'queue_overflow': 1,
+    'queue_underflow': 2,
+    'bad_instruction': 4,
+}
+
+# Number of examples kept for each kind.
+MAX_EXAMPLES = 10
+
+class Anomalies:
+    """ Counts anomalies on cycles 'start' through 'end' by kind, keeping the
+    first 'max_examples' of each.
+    """
+    def __init__(self, start=0, end=None, max_examples=MAX_EXAMPLES):
+        self.start = start
+        self.end = end
+        self.max_examples = max_examples
+        self.counts = {}
+        self.examples = {}
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, kind, n, detail=None):
+        """ Record an anomaly of 'kind' on cycle 'n'. Returns False if 'n' is outside
+        the collected range.
+        """
+        if n < self.start or (self.end is not None and n > self.end):
+            return False
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        examples = self.examples.setdefault(kind, [])
+        if len(examples) < self.max_examples:
+            examples.append({'n': n, 'detail': detail} if detail is not None else {'n': n})
+        return True
+
+    def merge(self, other):
+        """ Add the anomalies collected by another collector, such as a worker's. """
+        for kind, count in other.counts.items():
+            self.counts[kind] = self.counts.get(kind, 0) + count
+            examples = sorted(self.examples.get(kind, []) + other.examples[kind], key=lambda example: example['n'])
+            self.examples[kind] = examples[:self.max_examples]
+
+    def summary(self):
+        return {
+            'total': len(self),
+            'counts': dict(sorted(self.counts.items())),
+            'examples': {kind: self.examples[kind] for kind in sorted(self.examples)},
+        }
+
+    def report(self):
+        """ Print one line per kind of anomaly. """
+        if not self.counts:
+            print("No anomalies.")
+            return
+        for kind, count in sorted(self.counts.items()):
+            first = self.examples[kind][0]['n']
+            print(f"{count} {kind.replace('_', ' ')} anomalies, first at cycle {first}")
+
+    def write(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+            file.write('\n')
+
+    def finish(self, output_path):
+        """ Report the anomalies at the end of a decode to 'output_path', and write
+        the summary next to it if there were any.
+        """
+        self.report()
+        if self.counts:
+            path = os.path.splitext(output_path)[0] + '.anomalies.json'
+            self.write(path)
+            print(f"Wrote anomaly summary to {path}")
@@ -0,0 +1,211 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   batch.py
+#
+#   Run the marty_tools.py pipeline on a batch of captures in parallel.
+#
+#   Each capture is processed by its own 'marty_tools.py pipeline' process, up
+#   to --workers at a time. A capture that crashes or runs out of memory fails
+#   on its own without stopping the others. Its output is logged to
+#   <out>/logs/<name>.log.
+#
+#   The pipeline options are given as one string. In it, {name} is replaced
+#   with the capture's file name without its extension, and {out} with the
+#   output directory. The default is '--decoded {out}/{name}.csv'. For example:
+#
+#   batch.py captures/ --out results --pipeline "--export --img {out}/{name}.png"
+#
+#   With --max-memory-gb, each worker's address space is limited to that size,
+#   so one huge capture can't push the whole machine into swap. The limit uses
+#   setrlimit, which isn't available on Windows. Each pipeline runs its decode
+#   stages on a single worker unless the pipeline options give --jobs. The
+#   workers share the disassembly cache, which merges what each saves (see
+#   disasm_cache.py).
+#
+#   A line is appended to <out>/batch_manifest.jsonl as each capture finishes.
+#   It records the capture's size and modification time, the pipeline options,
+#   the outcome and the time taken. Running the same batch again skips the
+#   captures the manifest lists as done with the same options, so a batch
+#   interrupted by a crash or Ctrl-C resumes where it left off. --redo runs
+#   them all again.
+#
+#   Command Line Arguments:
+#   inputs... --out DIR [--pipeline OPTIONS] [--pattern GLOB] [--workers N]
+#   [--max-memory-gb N] [--redo]
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST = 'batch_manifest.jsonl'
+DEFAULT_PIPELINE = '--decoded {out}/{name}.csv'
+
+def find_captures(inputs, pattern):
+    """ Return the captures named by 'inputs': files, directories (searched
+    for 'pattern') or glob patterns.
+    """
+    captures = []
+    for item in inputs:
+        if os.path.isdir(item):
+            captures += sorted(glob.glob(os.path.join(item, pattern)))
+        elif os.path.isfile(item):
+            captures.append(item)
+        else:
+            captures += sorted(glob.glob(item))
+    return list(dict.fromkeys(os.path.abspath(path) for path in captures))
+
+def capture_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def capture_identity(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def read_manifest(path):
+    """ Return the last manifest record of each capture. """
+    records = {}
+    if os.path.exists(path):
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash.
+                    continue
+                records[record['capture']] = record
+    return records
+
+def is_done(record, capture, pipeline):
+    return (record is not None and record['status'] == 'ok' and record['pipeline'] == pipeline
+            and record['identity'] == capture_identity(capture))
+
+def memory_limit(max_bytes):
+    """ Return a function that limits the address space of a new process, or None. """
+    if not max_bytes:
+        return None
+    import resource
+    def limit():
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+    return limit
+
+def pipeline_args(capture, pipeline, out_dir):
+    """ Return the command line running the pipeline on a capture. """
+    options = [arg.format(name=capture_name(capture), out=out_dir) for arg in shlex.split(pipeline)]
+    if '--jobs' not in options:
+        options += ['--jobs', '1']
+    return [sys.executable, os.path.join(SCRIPT_DIR, 'marty_tools.py'), 'pipeline', capture] + options
+
+def run_capture(capture, pipeline, out_dir, max_bytes, procs):
+    """ Run the pipeline on one capture, returning its manifest record. """
+    log_path = os.path.join(out_dir, 'logs', capture_name(capture) + '.log')
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        proc = subprocess.Popen(pipeline_args(capture, pipeline, out_dir), stdout=log, stderr=subprocess.STDOUT,
+                                preexec_fn=memory_limit(max_bytes))
+        procs.add(proc)
+        try:
+            proc.wait()
+        finally:
+            procs.discard(proc)
+
+    status = 'ok' if proc.returncode == 0 else 'failed'
+    if status == 'failed' and max_bytes:
+        with open(log_path, 'r', errors='replace') as log:
+            if 'MemoryError' in log.read():
+                status = 'out of memory'
+    return {'capture': capture, 'identity': capture_identity(capture), 'pipeline': pipeline, 'status': status,
+            'returncode': proc.returncode, 'seconds': round(time.perf_counter() - start, 2), 'log': log_path,
+            'finished': datetime.datetime.now().isoformat(timespec='seconds')}
+
+def run_batch(captures, pipeline, out_dir, workers, max_bytes=None, redo=False):
+    """ Run the pipeline on every capture not already done, returning the number that failed. """
+    os.makedirs(os.path.join(out_dir, 'logs'), exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    done = read_manifest(manifest_path)
+    pending = [capture for capture in captures if redo or not is_done(done.get(capture), capture, pipeline)]
+    if len(pending) < len(captures):
+        print(f"Skipping {len(captures) - len(pending)} captures already done.")
+    print(f"Processing {len(pending)} captures on {workers} workers...")
+
+    failed = 0
+    procs = set()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        with open(manifest_path, 'a') as manifest:
+            futures = {pool.submit(run_capture, capture, pipeline, out_dir, max_bytes, procs): capture
+                       for capture in pending}
+            for count, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                manifest.write(json.dumps(record) + '\n')
+                manifest.flush()
+                if record['status'] != 'ok':
+                    failed += 1
+                print(f"[{count}/{len(pending)}] {capture_name(record['capture'])}: {record['status']} "
+                      f"in {record['seconds']:.1f}s")
+    except KeyboardInterrupt:
+        print("\nInterrupted. Run the same command again to resume.")
+        pool.shutdown(wait=False, cancel_futures=True)
+        for proc in list(procs):
+            proc.terminate()
+        raise SystemExit(130)
+    pool.shutdown()
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the marty_tools.py pipeline on a batch of captures in parallel.")
+    parser.add_argument('inputs', nargs='+', help="Capture files, directories or glob patterns.")
+    parser.add_argument('--out', required=True, help="Output directory for the manifest and logs, as {out}.")
+    parser.add_argument('--pipeline', default=DEFAULT_PIPELINE,
+                        help=f"marty_tools.py pipeline options, with {{name}} and {{out}} (default '{DEFAULT_PIPELINE}')")
+    parser.add_argument('--pattern', default='*.csv', help="Captures to take from a directory (default *.csv).")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of captures to process at once.")
+    parser.add_argument('--max-memory-gb', type=float, default=None, help="Limit each worker's memory to N GB.")
+    parser.add_argument('--redo', action='store_true', help="Process captures the manifest lists as done again.")
+    args = parser.parse_args()
+
+    captures = find_captures(args.inputs, args.pattern)
+    if not captures:
+        parser.error("no captures found")
+    names = [capture_name(capture) for capture in captures]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates and '{name}' in args.pipeline:
+        parser.error(f"more than one capture is named {', '.join(duplicates)}")
+    if args.max_memory_gb and sys.platform == 'win32':
+        parser.error("--max-memory-gb isn't supported on Windows")
+
+    out_dir = os.path.abspath(args.out)
+    max_bytes = int(args.max_memory_gb * 1024 ** 3) if args.max_memory_gb else None
+    failed = run_batch(captures, args.pipeline, out_dir, args.workers, max_bytes, args.redo)
+    print(f"Done. {failed} of {len(captures)} captures failed." if failed else f"Done. Manifest: {os.path.join(out_dir, MANIFEST)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
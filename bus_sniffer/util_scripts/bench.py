@@ -0,0 +1,297 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   bench.py
+#
+#   Benchmark suite for the decoders and converters.
+#
+#   Times decode.py, decode_marty2.py, excelify.py and csv_to_img.py on
+#   synthetic traces of 10k, 1M and 10M cycles (see synth_trace.py), each run
+#   in its own process. The traces are generated once and kept in the bench
+#   directory, named by the generator's hash so they're rebuilt when it
+#   changes.
+#
+#   Each run's results are appended to bench_history.jsonl, with the git
+#   commit and host. Each time is compared to the median of the last few runs
+#   on the same host, and the suite fails (exit status 1) if any tool got
+#   slower than the threshold, failed, or reported decode anomalies.
+#
+#   Tools whose dependencies aren't installed (openpyxl, PIL) are skipped, as
+#   is excelify.py beyond the row limit of an Excel sheet.
+#
+#   Command Line Arguments:
+#   [--sizes 10k,1m,10m] [--tools decode,decode_marty2,excelify,csv_to_img]
+#   [--repeat N] [--dir DIR] [--history FILE] [--threshold PCT] [--no-record]
+
+import argparse
+import datetime
+import hashlib
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+import synth_trace
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), 'marty_bench')
+DEFAULT_HISTORY = os.path.join(SCRIPT_DIR, 'bench_history.jsonl')
+
+SIZES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+DEFAULT_SIZES = '10k,1m'
+
+# A run is a regression if it's this much slower than the median of the last
+# HISTORY_RUNS runs, and at least MIN_REGRESSION seconds slower.
+THRESHOLD = 20
+HISTORY_RUNS = 5
+MIN_REGRESSION = 0.25
+
+# A tool reads one of the generated inputs: 'cycles' (a cycle CSV), 'marty' (a
+# MartyPC log) or 'decoded' (the cycle CSV decoded by decode.py).
+Tool = namedtuple('Tool', ['name', 'script', 'input', 'args', 'requires', 'max_cycles'])
+
+# The stage cache would turn every run after the first into a copy, so it's bypassed.
+TOOLS = [
+    Tool('decode', 'decode.py', 'cycles', ['--checkpoint-interval', '0', '--no-cache'], [], None),
+    Tool('decode_marty2', 'decode_marty2.py', 'marty', [], [], None),
+    Tool('excelify', 'excelify.py', 'decoded', ['--no-cache'], ['openpyxl'], 1000000),
+    Tool('csv_to_img', 'csv_to_img.py', 'decoded', ['--no-cache'], ['PIL'], None),
+]
+TOOLS_BY_NAME = {tool.name: tool for tool in TOOLS}
+OUTPUT_EXTENSIONS = {'decode': '.csv', 'decode_marty2': '.csv', 'excelify': '.xlsx', 'csv_to_img': '.png'}
+
+def parse_size(text):
+    text = text.strip().lower()
+    return SIZES[text] if text in SIZES else int(text)
+
+def size_name(cycles):
+    for name, value in SIZES.items():
+        if value == cycles:
+            return name
+    return str(cycles)
+
+def generator_hash():
+    """ Return a short hash of the generator's source, to name the generated traces. """
+    with open(synth_trace.__file__, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()[:10]
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+def prepare_inputs(bench_dir, cycles, kinds):
+    """ Generate the inputs of 'kinds' for a size, if they aren't cached. Returns their paths. """
+    base = os.path.join(bench_dir, f'synth_{size_name(cycles)}_{generator_hash()}')
+    paths = {'cycles': base + '.csv', 'marty': base + '.marty.csv', 'decoded': base + '.decoded.csv'}
+    needed = set(kinds)
+    if 'decoded' in needed:
+        needed.add('cycles')
+
+    trace = None
+    for kind in ('cycles', 'marty'):
+        if kind in needed and not os.path.exists(paths[kind]):
+            if trace is None:
+                print(f"Generating a {size_name(cycles)} cycle trace...")
+                trace = synth_trace.generate(cycles)
+            synth_trace.write_trace(trace, paths[kind] + '.tmp', marty=kind == 'marty')
+            os.replace(paths[kind] + '.tmp', paths[kind])
+
+    if 'decoded' in needed and not os.path.exists(paths['decoded']):
+        print(f"Decoding the {size_name(cycles)} cycle trace...")
+        result = subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, 'decode.py'), paths['cycles'],
+                                 paths['decoded'] + '.tmp.csv', '--checkpoint-interval', '0', '--no-cache'], stdout=subprocess.DEVNULL)
+        if result.returncode != 0:
+            raise RuntimeError(f"Couldn't decode {paths['cycles']}")
+        os.replace(paths['decoded'] + '.tmp.csv', paths['decoded'])
+    return paths
+
+def run_process(args, log_path):
+    """ Run a command, returning (exit status, seconds, peak RSS in MB or None). """
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(args, cwd=SCRIPT_DIR, stdout=log, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(proc.pid, 0)
+            seconds = time.perf_counter() - start
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in KB on Linux and bytes on macOS.
+            rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        else:
+            proc.wait()
+            seconds = time.perf_counter() - start
+            rss = None
+    return proc.returncode, seconds, rss
+
+def anomaly_count(output):
+    """ Return the anomalies decode.py reported for an output, or None. """
+    path = os.path.splitext(output)[0] + '.anomalies.json'
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return json.load(file)['total']
+
+def run_tool(tool, cycles, paths, bench_dir, repeat):
+    """ Run a tool 'repeat' times on the input for 'cycles', returning its result dict. """
+    missing = [module for module in tool.requires if importlib.util.find_spec(module) is None]
+    if missing:
+        return {'status': f"skipped (no {', '.join(missing)})"}
+    if tool.max_cycles is not None and cycles > tool.max_cycles:
+        return {'status': f"skipped (over {tool.max_cycles} cycles)"}
+
+    output = os.path.join(bench_dir, f'out_{tool.name}_{size_name(cycles)}{OUTPUT_EXTENSIONS[tool.name]}')
+    log_path = os.path.join(bench_dir, f'out_{tool.name}_{size_name(cycles)}.log')
+    args = [sys.executable, os.path.join(SCRIPT_DIR, tool.script), paths[tool.input], output] + tool.args
+
+    times = []
+    rss = None
+    for _ in range(repeat):
+        status, seconds, run_rss = run_process(args, log_path)
+        if status != 0:
+            return {'status': f"failed (exit {status}, see {log_path})"}
+        times.append(seconds)
+        if run_rss is not None:
+            rss = max(rss or 0, run_rss)
+
+    result = {'status': 'ok', 'seconds': round(min(times), 3), 'cycles_per_sec': int(cycles / min(times))}
+    if rss is not None:
+        result['peak_rss_mb'] = round(rss, 1)
+    if tool.name in ('decode', 'decode_marty2'):
+        anomalies = anomaly_count(output)
+        if anomalies is not None:
+            result['anomalies'] = anomalies
+    return result
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+def baseline(history, host, key):
+    """ Return the median time of the last HISTORY_RUNS successful runs of 'key' on 'host', or None. """
+    times = [record['results'][key]['seconds'] for record in history
+             if record.get('host') == host and record['results'].get(key, {}).get('status') == 'ok']
+    return statistics.median(times[-HISTORY_RUNS:]) if times else None
+
+def compare(results, history, host, threshold):
+    """ Add each result's baseline and change, and return the keys that regressed or failed. """
+    problems = []
+    for key, result in results.items():
+        if result['status'].startswith('failed'):
+            problems.append(key)
+            continue
+        if result['status'] != 'ok':
+            continue
+        if result.get('anomalies'):
+            problems.append(key)
+        base = baseline(history, host, key)
+        if base is None:
+            continue
+        result['baseline'] = base
+        result['change_pct'] = round((result['seconds'] / base - 1) * 100, 1)
+        if result['change_pct'] > threshold and result['seconds'] - base > MIN_REGRESSION:
+            result['regression'] = True
+            problems.append(key)
+    return problems
+
+def print_results(results):
+    print(f"{'Benchmark':<24}{'Seconds':>10}{'Cycles/s':>12}{'RSS MB':>9}{'Baseline':>10}{'Change':>9}")
+    for key, result in results.items():
+        if result['status'] != 'ok':
+            print(f"{key:<24}  {result['status']}")
+            continue
+        rss = result.get('peak_rss_mb')
+        line = f"{key:<24}{result['seconds']:>10.2f}{result['cycles_per_sec']:>12}{rss if rss is not None else '':>9}"
+        if 'baseline' in result:
+            line += f"{result['baseline']:>10.2f}{result['change_pct']:>+8.1f}%"
+        if result.get('regression'):
+            line += '  REGRESSION'
+        if result.get('anomalies'):
+            line += f"  {result['anomalies']} anomalies"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the decoders on synthetic traces and check for regressions.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f"Comma separated trace sizes in cycles, or {', '.join(SIZES)} (default {DEFAULT_SIZES})")
+    parser.add_argument('--tools', default=','.join(TOOLS_BY_NAME),
+                        help=f"Comma separated tools to run (default {','.join(TOOLS_BY_NAME)})")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs of each benchmark; the fastest is kept")
+    parser.add_argument('--dir', default=DEFAULT_DIR, help=f"Directory for generated traces and outputs (default {DEFAULT_DIR})")
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help="Results history file")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help=f"Percent slowdown from the recent median that fails the run (default {THRESHOLD})")
+    parser.add_argument('--no-record', action='store_true', help="Don't add this run to the history")
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    names = [name.strip() for name in args.tools.split(',')]
+    unknown = [name for name in names if name not in TOOLS_BY_NAME]
+    if unknown:
+        parser.error(f"Unknown tools: {', '.join(unknown)}. Tools: {', '.join(TOOLS_BY_NAME)}")
+    tools = [TOOLS_BY_NAME[name] for name in names]
+    os.makedirs(args.dir, exist_ok=True)
+
+    results = {}
+    for cycles in sizes:
+        paths = prepare_inputs(args.dir, cycles, {tool.input for tool in tools})
+        for tool in tools:
+            key = f'{tool.name}/{size_name(cycles)}'
+            print(f"Running {key}...")
+            results[key] = run_tool(tool, cycles, paths, args.dir, args.repeat)
+
+    history = read_history(args.history)
+    host = platform.node()
+    problems = compare(results, history, host, args.threshold)
+    print_results(results)
+
+    if not args.no_record:
+        record = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'host': host,
+            'python': platform.python_version(),
+            'results': {key: {k: v for k, v in result.items() if k not in ('baseline', 'change_pct', 'regression')}
+                        for key, result in results.items()},
+        }
+        with open(args.history, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+        print(f"Added results to {args.history}")
+
+    if problems:
+        print(f"{len(problems)} benchmarks regressed or failed: {', '.join(problems)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
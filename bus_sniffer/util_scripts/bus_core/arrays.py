@@ -0,0 +1,135 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   arrays.py
+#
+#   Array engine for the 8088 bus.
+#
+#   These columns don't depend on the sequential state machines, or only on a
+#   little state carried from the previous chunk, so they are computed for a
+#   whole chunk of cycles at once with numpy. Requires numpy and pandas.
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Number of hdots per CPU cycle
+CLOCK_DIVISOR = 3
+
+ADDRESS_COLS = ['AD0', 'AD1', 'AD2', 'AD3', 'AD4', 'AD5', 'AD6', 'AD7', 'A8', 'A9', 'A10', 'A11', 'A12', 'A13', 'A14', 'A15', 'A16', 'A17', 'A18', 'A19']
+
+def address_values(df):
+    """ Return the 20-bit address bus value of each cycle from the AD0-A19 columns. """
+    bits = df[ADDRESS_COLS].to_numpy(dtype=np.int64)
+    return bits @ (1 << np.arange(len(ADDRESS_COLS), dtype=np.int64))
+
+# Bus fields packed into integers, as emulators log them: the 20-bit address
+# bus, the bus status (S2*4 + S1*2 + S0) and the queue status (QS1*2 + QS0) of
+# each cycle. They can be decoded without the per-bit columns of a capture.
+PackedBus = namedtuple('PackedBus', ['addr', 'b', 'qop'])
+
+def expand_bits(values, names):
+    """ Return a dict of bit columns, bit i of 'values' as column names[i]. """
+    values = np.asarray(values)
+    return {name: ((values >> i) & 1).astype(np.int8) for i, name in enumerate(names)}
+
+def bus_status(df):
+    """ Return the bus status (S2*4 + S1*2 + S0) of each cycle. """
+    return (df['S2'] * 4 + df['S1'] * 2 + df['S0']).to_numpy()
+
+def queue_ops(df):
+    """ Return the queue status (QS1*2 + QS0) of each cycle. """
+    return (df['QS1'] * 2 + df['QS0']).to_numpy()
+
+def segments(df):
+    """ Return the segment status (A17*2 + A16) of each cycle. """
+    return (df['A17'] * 2 + df['A16']).to_numpy()
+
+def address_segments(addr):
+    """ Return the segment status (A17*2 + A16) of each cycle from its address bus value. """
+    return (addr >> 16) & 3
+
+def timing_columns(t, clk, s):
+    """ Compute the ns_d, CLK_change and d_accum columns for a chunk, carrying state 's'. """
+
+    # Time delta in nanoseconds
+    prev_t = np.empty_like(t)
+    prev_t[1:] = t[:-1]
+    prev_t[0] = t[0] if s.prev_time is None else s.prev_time
+    ns_d = ((t - prev_t) * 1e9).astype(int)
+
+    # Accumulate time deltas, resetting on the cycle after a clock change.
+    clk_change = np.empty(len(clk), dtype=bool)
+    clk_change[1:] = clk[1:] != clk[:-1]
+    clk_change[0] = True if s.prev_clk is None else bool(clk[0] != s.prev_clk)
+
+    group_start = np.empty(len(clk), dtype=bool)
+    group_start[1:] = clk_change[:-1]
+    group_start[0] = s.prev_clk_change
+    group = np.cumsum(group_start)
+    d_accum = pd.Series(ns_d).groupby(group).cumsum().to_numpy().copy()
+    d_accum[group == 0] += s.d_accum
+
+    s.prev_time = float(t[-1])
+    s.prev_clk = clk[-1].item()
+    s.prev_clk_change = bool(clk_change[-1])
+    s.d_accum = int(d_accum[-1])
+
+    return ns_d, clk_change, d_accum
+
+def raster_columns(hs, vs, s):
+    """ Compute the FRAME, R_X and R_Y columns for a chunk, carrying state 's'.
+
+    A falling edge of VSYNC starts a new frame, and a falling edge of HSYNC starts
+    a new scanline. R_X advances by CLOCK_DIVISOR hdots per cycle.
+    """
+    n = len(hs)
+    index = np.arange(n)
+
+    prev_hs = np.empty(n, dtype=np.int64)
+    prev_hs[1:] = hs[:-1]
+    prev_hs[0] = -1 if s.prev_hs is None else s.prev_hs
+    prev_vs = np.empty(n, dtype=np.int64)
+    prev_vs[1:] = vs[:-1]
+    prev_vs[0] = -1 if s.prev_vs is None else s.prev_vs
+
+    vs_fall = (prev_vs == 1) & (vs == 0)
+    hs_fall = (prev_hs == 1) & (hs == 0)
+
+    frame = s.frame + np.cumsum(vs_fall)
+
+    # Scanlines counted since the last new frame. A new frame and a new scanline
+    # on the same cycle leaves R_Y at 1.
+    lines = np.cumsum(hs_fall)
+    last_vs = np.maximum.accumulate(np.where(vs_fall, index, -1))
+    r_y = np.where(last_vs >= 0, lines - (lines[last_vs] - hs_fall[last_vs]), s.r_y + lines)
+
+    last_hs = np.maximum.accumulate(np.where(hs_fall, index, -1))
+    r_x = np.where(last_hs >= 0, (index - last_hs) * CLOCK_DIVISOR, s.r_x + index * CLOCK_DIVISOR)
+
+    s.frame = frame[-1].item()
+    s.r_y = r_y[-1].item()
+    s.r_x = r_x[-1].item() + CLOCK_DIVISOR
+    s.prev_hs = hs[-1].item()
+    s.prev_vs = vs[-1].item()
+
+    return frame, r_x, r_y
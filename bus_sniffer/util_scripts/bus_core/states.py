@@ -0,0 +1,54 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   states.py
+#
+#   Bus, queue, segment and T-state constants for the 8088.
+
+class BusStatus:
+    INTA, IOR, IOW, HALT, CODE, MEMR, MEMW, PASV = range(8)
+
+class QueueOp:
+    Idle, First, Empty, Subs = range(4)
+
+class Segment:
+    ES, SS, CS, DS = range(4)
+
+class TState:
+    TI, T1, T2, T3, TW, T4 = range(6)
+
+# Names indexed by S2*4 + S1*2 + S0
+BUS_STATES = ['INTA', 'IOR', 'IOW', 'HALT', 'CODE', 'MEMR', 'MEMW', 'PASV']
+
+# Names indexed by QS1*2 + QS0
+QUEUE_STATES = ['.', 'F', 'E', 'S']
+
+# Names indexed by A17*2 + A16 (S4, S3)
+SEG_STATES = ['ES', 'SS', 'CS', 'DS']
+
+# Names indexed by TState
+T_STATES = ['TI', 'T1', 'T2', 'T3', 'Tw', 'T4']
+
+# Instruction prefix bytes. A prefix is fetched as its own instruction, but
+# belongs to the instruction that follows it.
+INSTR_PREFIXES = frozenset([0x26, 0x2E, 0x36, 0x3E, 0xF0, 0xF1, 0xF2, 0xF3])
+
+QUEUE_SIZE = 4
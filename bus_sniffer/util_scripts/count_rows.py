@@ -20,11 +20,14 @@
 #    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 #   count_rows.py
-#   Displays the number of rows in the supplied csv file.
+#   Displays the number of rows in the supplied csv file, and records it in
+#   <csv>.rows for the progress estimates of later runs (see progress.py).
 
 import pandas as pd
 import sys
 
+from progress import Progress, save_row_count
+
 def count_rows(csv_filename, chunksize=10000):
     """
     Count the number of rows in a csv file.
@@ -34,9 +37,13 @@ def count_rows(csv_filename, chunksize=10000):
     :return: The total number of rows in the csv file.
     """
     row_count = 0
+    progress = Progress('Count', path=csv_filename)
     # Use the 'chunksize' parameter to read the file in chunks
-    for chunk in pd.read_csv(csv_filename, chunksize=chunksize):
-        row_count += len(chunk)
+    with open(csv_filename, 'rb') as file:
+        for chunk in pd.read_csv(progress.follow(file), chunksize=chunksize):
+            row_count += len(chunk)
+            progress.update(len(chunk))
+    progress.finish()
     return row_count
 
 if __name__ == '__main__':
@@ -46,4 +53,6 @@ if __name__ == '__main__':
 
     csv_file = sys.argv[1]
     num_rows = count_rows(csv_file)
-    print(f"The number of rows in {csv_file} is: {num_rows}")
\ No newline at end of file
+    print(f"The number of rows in {csv_file} is: {num_rows}")
+    # Kept for the progress reports of later runs on this file.
+    save_row_count(csv_file, num_rows)
\ No newline at end of file
@@ -27,6 +27,14 @@ from enum import Enum
 
 from PIL import Image, ImageDraw, ImageFont
 
+import stage_cache
+import trace_io
+from lazy_trace import LazyTrace
+
+# Columns used to draw the image. Decoded columns missing from the input are
+# decoded on demand.
+IMAGE_COLUMNS = ['HS', 'VS', 'BUSL', 'AL', 'D', 'QOP', 'INTR', 'DEN']
+
 class Colors(Enum):
     BLACK = 0
     WHITE = 1
@@ -52,15 +60,22 @@ PALETTE = [
 ]
 
 def count_scanlines(csv_file):
-    df = pd.read_csv(csv_file)
+    df = trace_io.read_trace(csv_file, ['HS'])
     if 'HS' not in df.columns:
         print("'HS' column not found in the CSV file.")
         return None
-    hs_column = df['HS']
+    return scanline_count(df['HS'])
+
+def scanline_count(hs_column):
     transitions = sum((hs_column.shift(1) == 1) & (hs_column == 0))
     return transitions
 
-def create_image_from_csv(csv_file, font, N):
+def create_image_from_csv(csv_file, font, N, cache=stage_cache.NO_CACHE):
+    # Load the CSV file, decoding only the columns we need if it hasn't been decoded.
+    return create_image(LazyTrace.read(csv_file, IMAGE_COLUMNS, cache), font, N)
+
+def create_image(trace, font, N):
+    """ Draw the images of a LazyTrace with N scanlines. """
 
     # Create a new indexed image with the palette
     t_img = Image.new('P', (304, N))
@@ -72,11 +87,10 @@ def create_image_from_csv(csv_file, font, N):
     f_img = Image.new('P', (304, N))
     f_img.putpalette([val for sublist in PALETTE for val in sublist])
 
-    # Load the CSV file into a DataFrame
-    df = pd.read_csv(csv_file)
-    if 'HS' not in df.columns or 'VS' not in df.columns:
+    if 'HS' not in trace.columns or 'VS' not in trace.columns:
         print("'HS' or 'VS' column not found in the CSV file.")
         return None
+    df = trace.select(IMAGE_COLUMNS)
     
     x, y = 0, 0
     emitting = False
@@ -122,7 +136,7 @@ def create_image_from_csv(csv_file, font, N):
         if in_inta and color_inta:
             if row["BUSL"] == "CODE":
                 # Interrupt is fetching first byte of ISR. Record the address.
-                isr_addr = row["AL"][-2:]
+                isr_addr = format(row["AL"] & 0xFF, '02X')
             b_color_index = Colors.YELLOW.value
             if row['QOP'] == 'F':
                 in_inta = False
@@ -130,8 +144,8 @@ def create_image_from_csv(csv_file, font, N):
         elif row['INTR'] == 1 and (df['INTR'].shift(1).iloc[_] == 0):
             b_color_index = Colors.RED.value
         elif row['BUSL'] == "IOW" and pd.notnull(row['D']):
-            d_val = int(row['D'].replace("'", ""), 16)  # Remove "'" and interpret as hexadecimal
-            al_val = int(row['AL'].replace("'", ""), 16)
+            d_val = row['D']
+            al_val = row['AL']
             if al_val == 0x3D4:
                 # CRTC register select writes
                 if d_val == 7:
@@ -142,7 +156,7 @@ def create_image_from_csv(csv_file, font, N):
                 # Timer channel 0 writes
                 b_color_index = Colors.BLUE.value
         elif row['BUSL'] == "IOR" and pd.notnull(row['D']):
-            al_val = int(row['AL'].replace("'", ""), 16)
+            al_val = row['AL']
             if al_val == 0x3DA:
                 # CGA status register read
                 b_color_index = Colors.WHITE.value
@@ -193,25 +207,19 @@ def draw_text(img, font, x, y, text):
     draw = ImageDraw.Draw(img)
     draw.text((x, y), text, font=font, fill="white")
 
-def main():
-    if len(sys.argv) < 3:
-        print("Usage: python csv_to_img.py input_csv_pat output_png_path input_font_path")
-        sys.exit(1)
-
-    csv_file_path = sys.argv[1]
-    png_file_path = sys.argv[2]
-
-    if sys.argv == 4:
-        font_file_path = sys.argv[3]
-        font = ImageFont.load(font_file_path)
-    else:
-        font = None
-
-    N = count_scanlines(csv_file_path)
+def write_images(trace, png_file_path, font=None):
+    """ Draw the images of a LazyTrace and save them next to 'png_file_path'. """
+    if 'HS' not in trace.columns:
+        print("'HS' column not found in the CSV file.")
+        return
+    N = scanline_count(trace['HS'])
     if N:
         print(f"Detected {N} scanlines. Converting...")
 
-        t_img, b_img, f_img = create_image_from_csv(csv_file_path, font, N)
+        images = create_image(trace, font, N)
+        if images is None:
+            return
+        t_img, b_img, f_img = images
 
         t_fn = append_path(png_file_path, "a")
         b_fn = append_path(png_file_path, "b")
@@ -223,5 +231,31 @@ def main():
 
         print(f"Images saved to {t_fn}, {b_fn}, {f_fn}")
 
+def main():
+    use_cache = '--no-cache' not in sys.argv
+    argv = [arg for arg in sys.argv if arg != '--no-cache']
+    if len(argv) < 3:
+        print("Usage: python csv_to_img.py input_csv_pat output_png_path [input_font_path] [--no-cache]")
+        sys.exit(1)
+
+    csv_file_path = argv[1]
+    png_file_path = argv[2]
+
+    if len(argv) == 4:
+        font_file_path = argv[3]
+        font = ImageFont.load(font_file_path)
+    else:
+        font_file_path = None
+        font = None
+
+    # The images are cached as a stage, and so are the columns decoded for them,
+    # so a change to the drawing code doesn't decode the trace again.
+    cache = stage_cache.open_cache(use_cache)
+    ext = os.path.splitext(png_file_path)[1]
+    cache.run('csv_to_img', png_file_path,
+              lambda: write_images(LazyTrace.read(csv_file_path, IMAGE_COLUMNS, cache), png_file_path, font),
+              [csv_file_path, font_file_path], modules=[sys.modules[__name__]],
+              side_outputs=[part + ext for part in 'abc'])
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -31,557 +31,152 @@
 #   CLK,READY,QS0,QS1,S0,S1,S2
 #   
 #   Command Line Arguments:
-#   input_csv output_csv
+#   input_csv output_csv [--chunk-size N] [--checkpoint-interval N] 
+#   [--start CYCLE] [--end CYCLE] [--jobs N] [--columns COL,COL,...]
+#   [--analyze NAME,NAME,...] [--flag-anomalies] [--markers FILE [--window N]]
+#   [--profile REPORT_JSON [--trace-memory] [--profile-dir DIR]] [--no-cache]
+#
+#   The file is decoded in a single streaming pass by decode_stream.py, so 
+#   captures larger than memory can be decoded. The decoding logic itself is
+#   in the shared bus_core package.
+#
+#   A full decode saves the decoder state every N cycles to <input_csv>.ckpt.
+#   Decoding a range with --start/--end then resumes from the nearest saved 
+#   state instead of re-decoding from cycle 0.
+#
+#   With --jobs N, a full decode is split at queue flushes into N segments that
+#   are decoded in parallel by decode_parallel.py. No checkpoints are saved.
+#
+#   With --columns, only the decode stages needed for the listed columns are
+#   run (see stages.py). For example, 'csv_to_img.py' only needs
+#   --columns AL,BUSL,D,QOP, which skips queue reconstruction and disassembly.
+#
+#   With --analyze, the listed analyzers (see analyzers.py) run during the 
+#   decode and write their results to <output>.<name>.csv. Built-in analyzers
+#   are 'io', 'interrupts', 'vram', 'cycles' and 'instructions'. Others are
+#   given as 'module:Class'. 'cycles' writes a table with one record per bus
+#   cycle instead of one row per clock: start cycle, type, address, segment,
+#   data, wait states and instruction index. 'instructions' writes one record
+#   per instruction or interrupt: start cycle, length, bytes, disassembly,
+#   prefix count and the number of CODE/MEMR/MEMW/IO bus cycles it ran.
+#
+#   Anomalies such as queue overflows are counted rather than printed one by
+#   one. A summary is printed at the end and written to
+#   <output>.anomalies.json. With --flag-anomalies, the cycles they occur on are
+#   also flagged in an ANOM column (see anomalies.py).
+#
+#   With --markers, only the cycles within N of each marker in a PulseView
+#   session file (.pvs) or marker list are decoded, in a single pass over the
+#   input (see decode_windows.py and markers.py).
+#
+#   With --profile, each stage of the decode is timed and a JSON report is
+#   written with its wall time, rows per second and memory use (see
+#   profiling.py). --trace-memory adds tracemalloc peaks and the top allocation
+#   sites, and --profile-dir dumps a cProfile file per stage. Profiling always
+#   uses the single-process decode.
+#
+#   The output and the files written next to it are kept in the stage cache
+#   (see stage_cache.py). Decoding the same input again with the same options
+#   and code copies them back instead. --no-cache decodes regardless, and
+#   profiled runs are never cached.
+#
+#   If output_csv ends in .parquet or .arrow, the trace is written as Parquet
+#   or Arrow instead of CSV (see trace_io.py; requires pyarrow).
 
-import pandas as pd
+import argparse
+import os
 import sys
 
-from enum import Enum, auto
-from iced_x86 import Decoder, Formatter, FormatterSyntax
-
-CLOCK_DIVISOR = 3
-
-BUS_MAPPING = {
-    0: 'INTA',
-    1: 'IOR',
-    2: 'IOW',
-    3: 'HALT',
-    4: 'CODE',
-    5: 'MEMR',
-    6: 'MEMW',
-    7: 'PASV'
-}
-
-Q_MAPPING = {
-    '00': '.',
-    '01': 'F',
-    '10': 'E',
-    '11': 'S'
-}
-
-SEG_MAPPING = {
-    '00': 'ES',
-    '01': 'SS',
-    '10': 'CS',
-    '11': 'DS'
-}
-
-ADDRESS_COLS = ['AD0', 'AD1', 'AD2', 'AD3', 'AD4', 'AD5', 'AD6', 'AD7', 'A8', 'A9', 'A10', 'A11', 'A12', 'A13', 'A14', 'A15', 'A16', 'A17', 'A18', 'A19']
-DATA_COLS = ['AD0', 'AD1', 'AD2', 'AD3', 'AD4', 'AD5', 'AD6', 'AD7']
-
-INSTR_PREFIXES = {0x26, 0x2E, 0x36, 0x3E, 0xF0, 0xF1, 0xF2, 0xF3}
-
-class State(Enum):
-    TI = auto()
-    T1 = auto()
-    T2 = auto()
-    T3 = auto()
-    Tw = auto()
-    T4 = auto()
-
-def decode_address(row):
-    # Construct binary representation by joining values of AD columns
-    binary_str = ''.join(map(str, [int(row[col]) for col in reversed(ADDRESS_COLS)]))
-
-    # Convert the binary string to an integer
-    address_value = int(binary_str, 2)
-
-    # Convert the integer to hexadecimal and pad to 5 digits
-    return "'" + format(address_value, '05X')
-
-def decode_data(row):
-    # Construct binary representation by joining values of AD columns
-    binary_str = ''.join(map(str, [int(row[col]) for col in reversed(DATA_COLS)]))
-    # Convert the binary string to an integer
-    data_value = int(binary_str, 2)
-
-    # Convert the integer to hexadecimal and pad to 5 digits
-    return "'" + format(data_value, '02X')
-
-def decode_status(row):
-    # Convert 3-bit value to decimal
-    return row['S2']*4 + row['S1']*2 + row['S0']
-
-def add_ale_column(df):
-    condition = (df['B'].shift(1) == 7) & (df['B'] != 7)
-    df['ALE'] = '.'
-    df.loc[condition, 'ALE'] = 'A'
-    return df
-
-def add_ale_and_al_columns(df):
-    # Condition for ALE
-    condition = (df['B'].shift(1) == 7) & (df['B'] != 7)
-    
-    # Default columns
-    df['ALE'] = '.'
-    df['AL'] = None
-    
-    # Set ALE where condition is true
-    df.loc[condition, 'ALE'] = 'A'
-    
-    # Now, for AL column
-    last_latched_address = None
-    for index, row in df.iterrows():
-        if row['ALE'] == 'A':
-            last_latched_address = row['ADDR']
-        
-        df.at[index, 'AL'] = last_latched_address
-
-    return df
-    
-def add_t_and_d_column(df):
-    state = State.TI
-    next_state = None 
-    do_wait_state = False
-    
-    df['PREV_R'] = df['READY'].shift(1)
-    
-    for index, row in df.iterrows():
-        
-        data_bus_valid = False
-    
-        if next_state is not None:
-            state = next_state
-            next_state = None
-        elif row['ALE'] == 'A':
-            state = State.T1
-        elif state == State.T1:
-            state = State.T2
-        elif state == State.T2:
-            if row['READY'] == 1:
-                data_bus_valid = True
-            state = State.T3
-        elif state == State.T3:
-            if row['PREV_R'] == 0 or row['READY'] == 0:
-                state = State.Tw
-            else:
-                state = State.T4
-        elif state == State.Tw:
-            if row['PREV_R'] == 1:
-                data_bus_valid = True
-                state = State.T4
-            else:
-                state = State.Tw
-        elif state == State.T4:
-            state = State.TI
-
-        if data_bus_valid:
-            df.at[index, 'D'] = decode_data(row)
-
-        # Set the T column for the current row
-        df.at[index, 'T'] = state.name
-
-    # Drop the temporary next_QOP column after use 
-    df = df.drop(columns=['PREV_R'])
-        
-    return df
-    
-def add_qop_column(df):
-    # Apply the mapping for the QOP column
-    df['QOP'] = df.apply(lambda row: Q_MAPPING[f"{int(row['QS1'])}{int(row['QS0'])}"], axis=1)
-    
-    return df    
-    
-def add_seg_column(df):
-    
-    for index, row in df.iterrows():
-        # If 'ALE' signal is low, we can decode the segment status from S3-S4 (A16-A17)
-        if row['ALE'] != 'A' and row['T'] != 'TI':
-            # Apply the mapping for the SEG column.
-            df.at[index, 'SEG'] = SEG_MAPPING[f"{int(row['A17'])}{int(row['A16'])}"]
-
-    return df            
-
-def add_busl_column(df):
-    # Initialize a variable to hold the latched value of 'BUS'
-    latched_value = ""
-    # Loop through each row in the DataFrame
-    for index, row in df.iterrows():
-        # If 'ALE' is 'A', update the latched value
-        if row['ALE'] == 'A':
-            latched_value = row['BUS']
-        elif row['T'] == 'TI':
-            latched_value = 'PASV'
-            
-        # Assign the latched value to the 'BUSL' column
-        df.at[index, 'BUSL'] = latched_value
-
-    return df    
-    
-def add_time_delta(df):
-    """Add time delta in nanoseconds to the DataFrame."""
-
-    df['ns_d'] = df['Time(s)'].diff().fillna(0) * 1e9
-    df.at[0, 'ns_d'] = 0
-    df['ns_d'] = df['ns_d'].astype(int)
-
-    return df
-
-def calculate_d_accum(df):
-    # Create a column that indicates a change in the 'CLK' value
-    df['CLK_change'] = df['CLK'].diff() != 0
-
-    # Shift the CLK_change by one row so that accumulation continues until the row where the change occurs
-    df['group'] = df['CLK_change'].shift(fill_value=False).cumsum()
-
-    # Create an accumulator which resets based on the shifted 'group' values
-    df['d_accum'] = df.groupby(df['group'])['ns_d'].cumsum()
-
-    # Drop the 'group' column as it was just an intermediate step
-    df.drop('group', axis=1, inplace=True)
-
-    return df
-
-def filter_clock_signal(df):
-    # Define the expected half-cycle time and its half value for noise detection
-    expected_time = 105  # in ns
-    noise_threshold = expected_time / 2
-
-    # Identify rows where CLK_change is TRUE
-    transitions = df[df['CLK'].diff() != 0]
-
-    # Determine rows that are considered noise
-    mask = transitions['d_accum'] < noise_threshold
-
-    # Mark these transitions as noise
-    noisy_transitions = transitions[mask]
-    
-    df['noise'] = False
-    df.loc[noisy_transitions.index, 'noise'] = True
-
-    return df
-
-def remove_noisy_rows_and_recalculate(df):
-    # 1. Remove rows with noise
-    df_cleaned = df[df['noise'] == False].copy()
-
-    # 2. Recalculate 'ns_d' column
-    df_cleaned['ns_d'] = (df_cleaned['Time(s)'] - df_cleaned['Time(s)'].shift(fill_value=0)) * 1e9  # converting to nanoseconds
-
-    # 3. Recalculate 'd_accum' column using the previous `calculate_d_accum` function
-    df_cleaned = calculate_d_accum(df_cleaned)
-    
-    return df_cleaned
-
-def insert_column_after(df, col_after, new_col, new_col_data):
-    # Get the index of the column after which the new column will be inserted
-    col_after_index = df.columns.get_loc(col_after)
-    
-    # Insert the new column after the specified existing column
-    df.insert(col_after_index + 1, new_col, new_col_data)
-
-    return df
-
-def partial_reorder_columns(df, order_list):
-    # Filter out the columns from the DataFrame that are not in the order_list
-    other_columns = [col for col in df.columns if col not in order_list]
-    
-    # Combine the ordered columns with the other columns
-    new_order = order_list + other_columns
-    
-    # Reorder the DataFrame
-    df = df[new_order]
-    
-    return df
-
-def update_queue(df):
-    df['Q0'] = None
-    df['Q1'] = None
-    df['Q2'] = None
-    df['Q3'] = None
-    df['QL'] = 0  # Queue Length, initialize to 0
-
-    # Shift the QOP column up by one row for the next row value
-    df['next_QOP'] = df['QOP'].shift(-1)
-
-    for index, row in df.iterrows():
-        if index > 0:  # Copy the Q and QL values from the previous row
-            for col in ['Q0', 'Q1', 'Q2', 'Q3', 'QL']:
-                df.at[index, col] = df.at[index - 1, col]
-
-        if pd.notna(row['D']) and row['BUSL'] == 'CODE':
-            ql = df.at[index, 'QL']
-            if ql < 4:  # If queue is not full
-                df.at[index, f'Q{ql}'] = row['D']  # Add the value to the first empty Q column
-                df.at[index, 'QL'] += 1  # Increase the queue length
-            else:
-                print(f"Queue overflow at index {index}")
-
-        # Use next_QOP for the queue operation
-        if row['next_QOP'] in ['F', 'S']:
-            if df.at[index, 'Q0'] is None:
-                print(f"Queue underflow at index {index}")
-            else:        
-                # Store the value from Q0 and shift the values from Q1, Q2, Q3
-                df.at[index, 'QB'] = df.at[index, 'Q0']
-                
-                df.at[index, 'Q0'] = df.at[index, 'Q1']
-                df.at[index, 'Q1'] = df.at[index, 'Q2']
-                df.at[index, 'Q2'] = df.at[index, 'Q3']
-                df.at[index, 'Q3'] = None
-            # Decrease the queue length if it is not already 0
-            if df.at[index, 'QL'] > 0:
-                df.at[index, 'QL'] -= 1 
-        elif row['next_QOP'] == 'E':
-            # Empty all Q columns and set QL to 0
-            df.at[index, 'Q0'] = None
-            df.at[index, 'Q1'] = None
-            df.at[index, 'Q2'] = None
-            df.at[index, 'Q3'] = None
-            df.at[index, 'QL'] = 0
-
-    # Drop the temporary next_QOP column after use 
-    df = df.drop(columns=['next_QOP'])
-
-    return df
-
-def update_video(df):
-
-    df['FRAME'] = 0
-    df['R_X'] = 0
-    df['R_Y'] = 0
-
-    cur_frame = 0
-    cur_r_y = 0 
-    cur_r_x = 0
-
-    # Iterate over the DataFrame rows
-    for index, row in df.iterrows():
-        if index > 0:  # Skip the first row to avoid index error
-
-            prev_hs = df.at[index - 1, 'HS']
-            prev_vs = df.at[index - 1, 'VS']
-
-            current_hs = row['HS']                            
-            current_vs = row['VS']
-
-            if prev_vs == 1 and current_vs == 0:                
-                # VSYNC is transitioning from high to low, so we have a new frame.
-                # Increment the frame counter, and reset the current scanline counter.
-                cur_r_y = 0
-                cur_frame += 1  # Increment the current frame value
-
-            if prev_hs == 1 and current_hs == 0:
-                # HSYNC is transitioning from high to low, so we have a new scanline.
-                # Increment the scanline counter and reset the x counter.
-                cur_r_x = 0
-                cur_r_y += 1
-
-        df.at[index, 'FRAME'] = cur_frame
-        df.at[index, 'R_Y'] = cur_r_y
-        df.at[index, 'R_X'] = cur_r_x
-
-        # Scan to next pixel.
-        cur_r_x += CLOCK_DIVISOR
-
-    return df
-
-def fetch(df):
-    """ fetch instruction bytes from the queue and assemble instruction bytes
-    
-    This function creates the following columns:
-    IS    - Instruction status. This is used to track whether we have read in a prefix or 
-            a non-prefix 'first' instruction byte. 
-    INST  - Instruction; this is a hexadecimal representation of all the instruction bytes
-            read from the queue thus far.
-    INSTF - Instruction, final. This is the complete hexadecimal representation of the 
-            instruction; this is processed the disassembly phase.
-    IDX   - Instruction index. The assembly of the instruction is delayed until the end
-            of the instruction where the complete instruction representation is guaranteed,
-            therefore the index of the beginning of the instruction is cached here, so that
-            the disassembly of the instruction can be placed at the index. 
+import analyzers
+import decode_dag
+import decode_parallel
+import decode_stream
+import decode_windows
+import markers
+import profiling
+import stage_cache
+import trace_io
+
+from disasm_cache import DisasmCache
+from stages import ALL_STAGES
+
+def decode_frame(df, stages=ALL_STAGES, jobs=None, report=False, packed=None):
+    """ Decode a cycle trace that has been fully loaded into a DataFrame. Independent
+    stages run concurrently on up to 'jobs' workers. The bus is decoded from
+    'packed' (a bus_core.arrays.PackedBus) if given, instead of the per-bit columns.
     """
-
-    # Ensure the 'IS', 'INST', and 'IDX' columns exist
-    if 'IS' not in df.columns:
-        df['IS'] = ''
-    if 'INST' not in df.columns:
-        df['INST'] = ''
-    if 'INSTF' not in df.columns:
-        df['INSTF'] = ''        
-    if 'IDX' not in df.columns:
-        df['IDX'] = 0
-        
-    # Set some null, default values.
-    current_IS = ''
-    current_INST = ''
-    current_IDX = 0        
-
-    for index, row in df.iterrows():
-        
-        # Replicate the IS, INST and IDX columns, ongoing.
-        df.at[index, 'IS'] = current_IS
-        df.at[index, 'INST'] = current_INST
-        df.at[index, 'IDX'] = current_IDX
-    
-        # Was a byte read from the queue?
-        value = str(row['QB']).strip("'")
-        
-        # If so, process it...
-        if value: 
-            if pd.isna(row['QB']):
-                #df.at[index, 'C'] = "NA??"
-                continue        
-            try:
-                int_value = int(value, 16)
-            except ValueError:
-                print(f"Error converting '{value}' to an integer at index {index}")
-                continue
-
-            new_inst = False
-            
-            if df.at[index + 1, 'QOP'] == 'F':
-                # We've read a 'F' "First Instruction Byte" from the queue.
-                
-                # Is this byte an instruction prefix?
-                if int_value in INSTR_PREFIXES:
-                    # If so, enter the 'P' instruction state.
-                    df.at[index, 'IS'] = 'P'
-                    # If we've read a prefix, we're starting a new instruction.
-                    new_inst = True                    
-                else:                    
-                    # Not a prefix, and 'F' first instruction byte.                  
-                    if df.at[index, 'IS'] == 'P':
-                        # We were in 'read prefix' state, so we don't need to start a 
-                        # new instruction - we did so when the prefix was read. Just 
-                        # move to 'I' state.
-                        df.at[index, 'IS'] = 'I'
-                    else:
-                        # We weren't in a prefix state, so this represents the start
-                        # of a new, non-prefixed instruction.
-                        df.at[index, 'IS'] = 'I'
-                        new_inst = True            
-                
-            if new_inst:
-                df.at[index, 'INSTF'] = "'" + df.at[index, 'INST'].strip("'")
-                df.at[index, 'INST'] = ''
-                df.at[index, 'IDX'] = index
-            
-            old_inst = df.at[index, 'INST'].strip("'")
-            df.at[index, 'INST'] = f"'{old_inst}{value}"
-                
-        current_IS = df.at[index, 'IS']
-        current_IDX = df.at[index, 'IDX']
-        current_INST = df.at[index, 'INST']
-
-    return df    
-
-def disassemble(df):
-
-    bitness = 16  # 16-bit for 8088
-
-    for index, row in df.iterrows():
-        inst_hex = row['INSTF'].strip("'")
-        if inst_hex and not pd.isna(inst_hex):
-            try:
-                inst_bytes = bytes.fromhex(inst_hex)
-
-                decoder = Decoder(bitness, inst_bytes)
-                for instr in decoder:
-                    # Create a formatter and get the disassembled instruction
-                    formatter = Formatter(FormatterSyntax.NASM)
-                    disassembled = formatter.format(instr)
-                    
-                    # Get the instruction start index
-                    instr_idx = int(df.at[index - 1, 'IDX'])
-                    
-                    # Assign the disassembled instruction to a new column in the DataFrame
-                    df.at[instr_idx + 1, 'DISASM'] = disassembled
-            except Exception as e:
-                print(f"Error disassembling instruction at index {index}: {e}")
-                continue
-
+    cache = DisasmCache.load()
+    df = decode_dag.decode_frame(df, stages, jobs, cache, report, packed=packed)
+    cache.save()
     return df
-    
-def add_index(df):
-
-    for index, row in df.iterrows():
-        df.at[index, 'N'] = index
-        
-    return df
-
-def main(input_csv, output_csv):
-    # Read the input CSV file
-    df = pd.read_csv(input_csv, comment=';')
-
-    # Trim whitespace from column names
-    df.columns = df.columns.str.strip()
-    
-    print("Decoding address lines...")
-    df['ADDR'] = df.apply(decode_address, axis=1)
-    
-
-    # Add time delta to DataFrame
-    df = add_time_delta(df)
-
-    # fix up clock signal
-    df = calculate_d_accum(df)
-
-    # Filter clock signal
-    #df = filter_clock_signal(df)
-    
-    # Remove noise and recalculate deltas
-    #df = remove_noisy_rows_and_recalculate(df)
-    
-    # Filter clock signal again
-    #df = filter_clock_signal(df)    
 
-    # Add a new column 'B' that contains the decimal value calculated from columns 'S2', 'S1', and 'S0'
-    print("Decoding bus status...")
-    df['B'] = df.apply(decode_status, axis=1)
-
-    # Add ALE signal using value of B (ALE is active when changing from PASV to any other bus state)
-    # When ALE is detected, update the value of AL.
-
-    #df = add_ale_column(df)
-    print("Calculating ALE and latching addresses...")
-    df = add_ale_and_al_columns(df)
-
-    # Generate the 'BUS' column using the bus value to string mapping defined above.
-    df['BUS'] = df['B'].map(BUS_MAPPING)
-
-    print("Adding T-states and decoding data bus...")
-    df = add_t_and_d_column(df)
-
-    print("Decoding segment status...")
-    df = add_seg_column(df)
-
-    print("Decoding queue operations...")
-    df = add_qop_column(df)
-
-    print("Latching bus status...")
-    df = add_busl_column(df)
-
-    print("Calculating queue contents...")
-    df = update_queue(df)
-
-    print("Fetching instructions...")
-    df = fetch(df)
-    
-    print("Disassembling instructions...")
-    df = disassemble(df)
-    
-    if 'VS' in df.columns and 'HS' in df.columns:
-        # If both columns are present, call the add_frame function
-        print("Calculating frames and scanlines...")        
-        df = update_video(df)
-
-    # Reorder our new columns.
-    print("Adding index...")
-    df = add_index(df)
-    
-    df = partial_reorder_columns(df, ['N', 'ALE', 'AL', 'SEG', 'BUSL', 'READY', 'T', 'D', 'QOP', 'QB','IS', 'INST', 'INSTF', 'DISASM', 'QL', 'Q0', 'Q1', 'Q2', 'Q3'])
-
-    # Write the updated DataFrame to the output CSV file
-    df.to_csv(output_csv, index=False)
+def main(input_csv, output_csv, chunk_size=decode_stream.CHUNK_SIZE, 
+         checkpoint_interval=decode_stream.CHECKPOINT_INTERVAL, start=0, end=None, jobs=1, columns=None, analyze=None, flag_anomalies=False,
+         marker_file=None, window=decode_windows.RADIUS, profile=None, trace_memory=False, profile_dir=None, use_cache=True):
+    plugins = [analyzers.load_analyzer(name) for name in analyze or []]
+    profiler = profiling.NULL_PROFILER
+    if profile:
+        profiler = profiling.StageProfiler(trace_memory, profile_dir)
+        profiler.info.update({'input': input_csv, 'input_bytes': os.path.getsize(input_csv), 'chunk_size': chunk_size})
+
+    def decode():
+        if marker_file:
+            decode_windows.decode_windows(input_csv, output_csv, markers.read_markers(marker_file), window, chunk_size=chunk_size,
+                                          columns=columns, analyzers=plugins, flags=flag_anomalies, profiler=profiler)
+        # Analyzers see events in trace order, and Parquet and Arrow files are written
+        # frame by frame, so both need the single-process decode.
+        elif (jobs > 1 and start == 0 and end is None and not plugins and not profiler
+              and trace_io.trace_format(output_csv) == 'csv'):
+            decode_parallel.decode_csv(input_csv, output_csv, jobs, chunk_size, columns=columns, flags=flag_anomalies)
+        else:
+            # Decode the input in chunks, writing each decoded chunk as we go.
+            decode_stream.decode_csv(input_csv, output_csv, chunk_size, checkpoint_interval, start, end, columns, plugins,
+                                     flag_anomalies, profiler)
+
+    cache = stage_cache.open_cache(use_cache and not profile)
+    params = {'start': start, 'end': end, 'columns': columns, 'analyze': analyze, 'flags': flag_anomalies,
+              'window': window if marker_file else None, 'format': trace_io.trace_format(output_csv)}
+    modules = [sys.modules[__name__]] + [sys.modules[type(plugin).__module__] for plugin in plugins]
+    cache.run('decode', output_csv, decode, [input_csv, marker_file], params, modules)
+
+    if profile:
+        profiler.print_summary()
+        profiler.write(profile)
 
 if __name__ == '__main__':
-    # Ensure correct number of command line arguments
-    if len(sys.argv) != 3:
-        print("Usage: python decode01.py input_csv output_csv")
-        sys.exit(1)
-
-    input_csv = sys.argv[1]
-    output_csv = sys.argv[2]
-
-    main(input_csv, output_csv)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Decode a cycle CSV into a cycle trace log.")
+    parser.add_argument('input_csv')
+    parser.add_argument('output_csv')
+    parser.add_argument('--chunk-size', type=int, default=decode_stream.CHUNK_SIZE,
+                        help="Number of cycles to read at a time.")
+    parser.add_argument('--checkpoint-interval', type=int, default=decode_stream.CHECKPOINT_INTERVAL,
+                        help="Save decoder state every N cycles during a full decode (0 to disable).")
+    parser.add_argument('--start', type=int, default=0, help="First cycle to decode.")
+    parser.add_argument('--end', type=int, default=None, help="Last cycle to decode.")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Decode a full file on N processes in parallel.")
+    parser.add_argument('--columns', type=lambda value: value.split(','), default=None,
+                        help="Comma-separated decoded columns to produce. Only the stages they need are run.")
+    parser.add_argument('--analyze', type=lambda value: value.split(','), default=None,
+                        help="Comma-separated analyzers to run during the decode (see analyzers.py).")
+    parser.add_argument('--flag-anomalies', action='store_true',
+                        help="Add an ANOM column flagging the cycles with anomalies.")
+    parser.add_argument('--markers', default=None,
+                        help="Decode only the cycles around the markers in a .pvs file or marker list.")
+    parser.add_argument('--window', type=int, default=decode_windows.RADIUS,
+                        help="Number of cycles to decode on each side of a marker.")
+    parser.add_argument('--profile', default=None, metavar='REPORT_JSON',
+                        help="Time each decode stage and write a JSON report.")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="With --profile, also trace memory allocations with tracemalloc.")
+    parser.add_argument('--profile-dir', default=None,
+                        help="With --profile, also write a cProfile dump for each stage to this directory.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Decode even if the stage cache has this output already.")
+    args = parser.parse_args()
+    if args.markers and (args.start or args.end is not None):
+        parser.error("--markers can't be combined with --start or --end")
+
+    main(args.input_csv, args.output_csv, args.chunk_size, args.checkpoint_interval, args.start, args.end, args.jobs, args.columns,
+         args.analyze, args.flag_anomalies, args.markers, args.window, args.profile, args.trace_memory, args.profile_dir,
+         not args.no_cache)
\ No newline at end of file
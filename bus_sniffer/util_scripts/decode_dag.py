@@ -0,0 +1,150 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   decode_dag.py
+#
+#   Decode a whole trace held in memory, running independent stages
+#   concurrently.
+#
+#   The stages in stages.py form a dependency graph: address formatting,
+#   clock timing, raster position and bus status don't depend on each other,
+#   and only the per-cycle bus core pass needs the bus status first. Each
+#   stage becomes a scheduler task. The bus core pass, which is pure Python
+#   and the longest stage, runs in the calling thread, and the array stages run
+#   on threads alongside it. Running the core pass in a worker process instead
+#   cost more in pickling its inputs and columns than the array stages take.
+
+import numpy as np
+
+from functools import partial
+
+import scheduler
+from bus_core import arrays
+from decode_stream import DecoderState, StreamDecoder, order_columns
+from anomalies import Anomalies
+from disasm_cache import DisasmCache
+from formatting import categorical
+from progress import Progress
+from scheduler import Task
+from stages import ALL_STAGES, STAGES, stage_outputs
+
+# Traces shorter than this aren't worth starting a thread pool for.
+MIN_CONCURRENT_ROWS = 100000
+
+def address_stage(addr, inputs):
+    return {'ADDR': addr.astype(np.int32)}
+
+def timing_stage(t, clk, s, inputs):
+    ns_d, clk_change, d_accum = arrays.timing_columns(t, clk, s)
+    return {'ns_d': ns_d, 'CLK_change': clk_change, 'd_accum': d_accum}
+
+def raster_stage(hs, vs, s, inputs):
+    frame, r_x, r_y = arrays.raster_columns(hs, vs, s)
+    return {'FRAME': frame, 'R_X': r_x, 'R_Y': r_y}
+
+def status_stage(b, qop, inputs):
+    return {'B': b, 'BUS': categorical(b, 'BUS'), 'QOP': categorical(qop, 'QOP'), 'qop': qop}
+
+def core_stage(addr, ready, seg, stages, cache_path, inputs):
+    """ Run the per-cycle stages over the whole trace. Returns the decoded columns,
+    the instructions that weren't already in the disassembly cache, and the
+    anomalies found.
+    """
+    status = inputs['status']
+    cache = DisasmCache.load(cache_path) if 'disasm' in stages else None
+    decoder = StreamDecoder(cache=cache, stages=stages, anomalies=Anomalies())
+    decoder.decode_rows(addr, status['B'], status['qop'], ready, seg)
+    decoder.complete_last()
+    columns = decoder.take_columns(len(addr))
+    columns['new_entries'] = cache.new_entries if cache is not None else {}
+    columns['anomalies'] = decoder.anomalies
+    return columns
+
+def frame_tasks(df, stages, s, cache_path, packed=None):
+    """ Return the scheduler tasks to decode 'stages' of the frame 'df'. If
+    'packed' (an arrays.PackedBus) is given, the bus is decoded from it instead
+    of the per-bit address and status columns.
+    """
+    tasks = []
+    addr = None
+    if packed is not None:
+        addr = packed.addr
+    elif 'address' in stages or 'bus' in stages:
+        addr = arrays.address_values(df)
+
+    if 'address' in stages:
+        tasks.append(Task('address', partial(address_stage, addr)))
+    if 'timing' in stages:
+        t = df['Time(s)'].to_numpy(dtype=np.float64)
+        tasks.append(Task('timing', partial(timing_stage, t, df['CLK'].to_numpy(), s)))
+    if 'raster' in stages and 'HS' in df.columns and 'VS' in df.columns:
+        tasks.append(Task('raster', partial(raster_stage, df['HS'].to_numpy(), df['VS'].to_numpy(), s)))
+    if 'status' in stages:
+        if packed is not None:
+            b, qop = packed.b, packed.qop
+        else:
+            b, qop = arrays.bus_status(df), arrays.queue_ops(df)
+        tasks.append(Task('status', partial(status_stage, b, qop)))
+
+    # The per-cycle stages share one pass over the trace.
+    core = [stage.name for stage in STAGES if stage.kind == 'python' and stage.name in stages]
+    if core:
+        ready = df['READY'].to_numpy()
+        seg = arrays.address_segments(addr) if packed is not None else arrays.segments(df)
+        func = partial(core_stage, addr, ready, seg, frozenset(core), cache_path)
+        tasks.append(Task('+'.join(core), func, after=['status'], kind='main'))
+
+    return tasks
+
+def decode_frame(df, stages=ALL_STAGES, jobs=None, cache=None, report=False, anomalies=None, packed=None):
+    """ Decode 'stages' of a trace that has been fully loaded into a DataFrame,
+    on up to 'jobs' threads. The bus is decoded from 'packed' (an
+    arrays.PackedBus) if given.
+
+    Anomalies found are added to 'anomalies', or printed if it isn't given.
+    """
+    df.columns = df.columns.str.strip()
+    if len(df) < MIN_CONCURRENT_ROWS:
+        jobs = 1
+
+    cache_path = cache.path if cache is not None else None
+    tasks = frame_tasks(df, stages, DecoderState(), cache_path, packed)
+    progress = Progress(f"Decode {len(df):,} cycles", len(tasks), unit='stages')
+    schedule = scheduler.run_tasks(tasks, jobs, progress)
+    progress.finish()
+    if report:
+        schedule.report()
+
+    df['N'] = np.arange(len(df))
+    outputs = stage_outputs(stages)
+    for columns in schedule.results.values():
+        for col in outputs:
+            if col in columns:
+                df[col] = columns[col]
+        if cache is not None and 'new_entries' in columns:
+            cache.merge(columns['new_entries'])
+        if 'anomalies' in columns:
+            if anomalies is not None:
+                anomalies.merge(columns['anomalies'])
+            else:
+                columns['anomalies'].report()
+
+    return order_columns(df)
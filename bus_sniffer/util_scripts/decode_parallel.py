@@ -0,0 +1,251 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   decode_parallel.py
+#
+#   Multi-process decoder for cycle CSV files.
+#
+#   The decoder's state machines resynchronize on their own shortly after a
+#   queue flush: the queue is empty, the next 'F' queue status begins a new
+#   instruction, and every bus cycle after that is latched afresh. Nothing
+#   else empties the queue; during a long run of passive bus cycles it is
+#   usually full. A pre-scan finds these resync points and picks one near each
+#   of N evenly spaced positions, splitting the capture into N segments. Each
+#   segment is decoded in its own process, starting a short way before the
+#   flush with a fresh decoder state.
+#
+#   Clock timing and raster position never resynchronize, so the pre-scan
+#   computes their exact values at each segment start and seeds the workers
+#   with them.
+#
+#   Each worker reports the state it reached at its segment start and at its
+#   segment end. The seams are checked in order, and if a segment started from
+#   a different state than the previous segment ended with, it is decoded again
+#   from the previous segment's end state. The output is then identical to a
+#   single-process decode.
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import decode_stream
+from bus_core import QueueOp, arrays
+from decode_stream import DecoderState, StreamDecoder
+from anomalies import Anomalies
+from disasm_cache import DisasmCache
+from formatting import format_columns
+from progress import Progress
+from stages import ALL_STAGES, stages_for
+
+# Segments aren't split closer together than this many cycles.
+MIN_SEGMENT = 100000
+
+# Number of cycles a worker decodes before a flush to warm up the decoder.
+WARMUP = 64
+
+SCAN_COLUMNS = ['Time(s)', 'CLK', 'READY', 'QS0', 'QS1', 'S0', 'S1', 'S2', 'HS', 'VS']
+
+def find_resync_points(qop):
+    """ Return the queue flushes followed by an 'F' queue status, and for each,
+    the cycle after that 'F'. From that cycle on, a fresh decoder started
+    before the flush is in the same state as one that decoded every cycle.
+    """
+    flushes = np.flatnonzero(qop == QueueOp.Empty)
+    fetches = np.flatnonzero(qop == QueueOp.First)
+    f = np.searchsorted(fetches, flushes, side='right')
+    flushes, f = flushes[f < len(fetches)], f[f < len(fetches)]
+    # Of several flushes before the same 'F', keep the last.
+    last = np.flatnonzero(np.diff(f, append=len(fetches)) != 0)
+    return flushes[last], fetches[f[last]] + 1
+
+def seed_state(n, i, cols, timing, raster):
+    """ Return a fresh decoder state starting at cycle 'n', with the clock timing
+    and raster position of the cycle before it (row i - 1 of the scanned chunk).
+    """
+    s = DecoderState()
+    s.n = n
+    prev = i - 1
+
+    s.prev_time = float(cols['Time(s)'][prev])
+    s.prev_clk = cols['CLK'][prev].item()
+    s.prev_b = cols['B'][prev].item()
+    s.prev_ready = cols['READY'][prev].item()
+
+    ns_d, clk_change, d_accum = timing
+    s.prev_clk_change = bool(clk_change[prev])
+    s.d_accum = int(d_accum[prev])
+
+    if raster is not None:
+        frame, r_x, r_y = raster
+        s.frame = frame[prev].item()
+        s.r_x = r_x[prev].item() + arrays.CLOCK_DIVISOR
+        s.r_y = r_y[prev].item()
+        s.prev_hs = cols['HS'][prev].item()
+        s.prev_vs = cols['VS'][prev].item()
+
+    return s.save()
+
+def scan(input_csv, chunk_size=decode_stream.CHUNK_SIZE, min_segment=MIN_SEGMENT):
+    """ Scan the input for resync points.
+
+    Returns the number of cycles, and a list of (split, seed) tuples at least
+    'min_segment' cycles apart. 'split' is the first cycle of a possible segment
+    and 'seed' the state a worker decoding it should start from.
+    """
+    s = DecoderState()
+    have_video = None
+    candidates = []
+    last_split = 0
+    total = 0
+
+    progress = Progress('Scan', path=input_csv, unit='cycles')
+    with open(input_csv, 'rb') as file:
+        chunks = pd.read_csv(progress.follow(file), comment=';', chunksize=chunk_size,
+                             usecols=lambda c: c.strip() in SCAN_COLUMNS)
+        for chunk in chunks:
+            chunk.columns = chunk.columns.str.strip()
+            if have_video is None:
+                have_video = 'HS' in chunk.columns and 'VS' in chunk.columns
+
+            cols = {name: chunk[name].to_numpy() for name in chunk.columns}
+            cols['B'] = cols['S2'] * 4 + cols['S1'] * 2 + cols['S0']
+            qop = cols['QS1'] * 2 + cols['QS0']
+
+            timing = arrays.timing_columns(cols['Time(s)'], cols['CLK'], s)
+            raster = arrays.raster_columns(cols['HS'], cols['VS'], s) if have_video else None
+
+            for flush, resync in zip(*find_resync_points(qop)):
+                warm = flush - WARMUP
+                if warm < 1:
+                    continue
+                split = total + resync.item()
+                if split - last_split < min_segment:
+                    continue
+                candidates.append((split, seed_state(total + warm, warm, cols, timing, raster)))
+                last_split = split
+
+            total += len(chunk)
+            progress.update(len(chunk))
+    progress.finish()
+
+    return total, candidates
+
+def choose_segments(total, candidates, jobs):
+    """ Pick the resync points nearest to 'jobs' evenly spaced positions.
+
+    Returns a list of (start, end, seed) tuples covering the whole input; 'end' is
+    None for the last segment, and 'seed' is None for a fresh decoder state.
+    """
+    splits = []
+    for k in range(1, jobs):
+        target = total * k // jobs
+        for split, seed in candidates:
+            if split >= target and (not splits or split > splits[-1][0]):
+                splits.append((split, seed))
+                break
+
+    segments = []
+    start, seed = 0, None
+    for split, next_seed in splits:
+        segments.append((start, split - 1, seed))
+        start, seed = split, next_seed
+    segments.append((start, None, seed))
+    return segments
+
+def decode_segment(input_csv, part_csv, seed, start, end, chunk_size, header, stages=ALL_STAGES, flags=False):
+    """ Decode cycles 'start' through 'end' into 'part_csv', starting from 'seed'.
+
+    Returns the decoder states at cycle 'start' and cycle 'end' + 1, any
+    instructions disassembled that weren't already in the disassembly cache,
+    and the anomalies found.
+    """
+    cache = DisasmCache.load()
+    # The warm-up cycles are expected to underflow the queue, so only anomalies
+    # in the segment itself are collected.
+    anomalies = Anomalies(start, end)
+    decoder = StreamDecoder(DecoderState.load(seed) if seed else None, cache, stages, anomalies=anomalies, flags=flags)
+    snapshots = {}
+    if decoder.state.n == start:
+        snapshots[start] = decoder.state.save()
+
+    stops = [start] if end is None else [start, end + 1]
+    def next_stop(n):
+        return next((stop for stop in stops if stop > n), None)
+
+    def save_snapshot(state):
+        snapshots[state.n] = state.save()
+
+    with open(part_csv, 'w', newline='') as outfile:
+        for rows in decode_stream.iter_decoded(input_csv, decoder, chunk_size, start, end, next_stop, save_snapshot):
+            format_columns(rows).to_csv(outfile, index=False, header=header)
+            header = False
+
+    end_state = None if end is None else snapshots.get(end + 1)
+    return snapshots.get(start), end_state, cache.new_entries, anomalies
+
+def decode_csv(input_csv, output_csv, jobs, chunk_size=decode_stream.CHUNK_SIZE, min_segment=MIN_SEGMENT, columns=None,
+               flags=False):
+    """ Decode the input on 'jobs' worker processes, producing only 'columns' if given.
+    Cycles with anomalies are flagged in an ANOM column if 'flags' is set.
+    """
+    stages = stages_for(columns) if columns else ALL_STAGES
+    total, candidates = scan(input_csv, chunk_size, min_segment)
+    segments = choose_segments(total, candidates, jobs)
+    print(f"Decoding {total} cycles in {len(segments)} segments...")
+
+    parts = [f'{output_csv}.part{k}' for k in range(len(segments))]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(decode_segment, input_csv, parts[k], seed, start, end, chunk_size, k == 0, stages, flags)
+                   for k, (start, end, seed) in enumerate(segments)]
+        progress = Progress('Decode', len(futures), unit='segments')
+        for future in as_completed(futures):
+            progress.update(1)
+        progress.finish()
+        results = [future.result() for future in futures]
+
+    # Check that each segment started from the state the previous one ended with.
+    for k in range(1, len(segments)):
+        start, end, seed = segments[k]
+        prev_end = results[k - 1][1]
+        if results[k][0] != prev_end:
+            print(f"State mismatch at cycle {start}, decoding segment {k} again...")
+            results[k] = decode_segment(input_csv, parts[k], prev_end, start, end, chunk_size, False, stages, flags)
+
+    # Workers don't write the disassembly cache themselves, to avoid racing each other.
+    cache = DisasmCache.load()
+    anomalies = Anomalies()
+    for _, _, new_entries, segment_anomalies in results:
+        cache.merge(new_entries)
+        anomalies.merge(segment_anomalies)
+    cache.save()
+
+    with open(output_csv, 'wb') as outfile:
+        for part in parts:
+            with open(part, 'rb') as infile:
+                shutil.copyfileobj(infile, outfile)
+            os.remove(part)
+
+    print(f"Decoded {total} cycles.")
+    anomalies.finish(output_csv)
@@ -0,0 +1,548 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   decode_stream.py
+#
+#   Single-pass streaming decoder for cycle CSV files.
+#
+#   The input is read in chunks and every per-cycle state machine (bus status
+#   latch, T-state, segment, prefetch queue, instruction assembly and raster
+#   position) is advanced together, row by row, in one pass. State is carried
+#   across chunk boundaries in a DecoderState object, and decoded rows are
+#   written out as soon as nothing later in the trace can change them, so
+#   memory use is bounded by the chunk size rather than the capture size.
+#
+#   The state machines themselves are in the shared bus_core package; this
+#   module reads the CSV, feeds the core and formats its results as columns.
+#
+#   While decoding a whole file, the decoder state is saved every N cycles to a
+#   sidecar file next to the input (<input_csv>.ckpt). Decoding a range of 
+#   cycles later resumes from the nearest saved state instead of cycle 0.
+#
+#   Analyzer plugins (see analyzers.py) can be run during the same pass.
+#
+#   A StageProfiler (see profiling.py) can time each stage of the decode.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from bus_core import BusDecoder, CoreState, QueueOp, TState
+from bus_core import arrays
+from analyzers import Analyzers
+from anomalies import ANOMALY_FLAGS, Anomalies
+from disasm_cache import DisasmCache
+import trace_io
+from formatting import CATEGORIES, HEX_COLUMNS, categorical
+from profiling import NULL_PROFILER
+from progress import Progress
+from stages import ALL_STAGES, STAGES, stage_outputs, stages_for
+
+CHUNK_SIZE = 100000
+CHECKPOINT_INTERVAL = 1000000
+# Version of the saved decoder state. Checkpoints in another format are ignored.
+CHECKPOINT_FORMAT = 2
+
+# If no instruction boundary has been seen for this many cycles, rows are
+# written out anyway and a late disassembly for them is dropped.
+MAX_PENDING = 1000000
+
+# Decoded columns placed in front of the input columns, as decode.main does.
+LEADING_COLUMNS = ['N', 'ALE', 'AL', 'SEG', 'BUSL', 'READY', 'T', 'D', 'QOP', 'QB', 'IS', 'INST', 'INSTF', 'DISASM', 'QL', 'Q0', 'Q1', 'Q2', 'Q3']
+# Decoded columns placed after the input columns, in the order decode.main creates them.
+TRAILING_COLUMNS = ['ADDR', 'ns_d', 'CLK_change', 'd_accum', 'B', 'BUS', 'IDX', 'ANOM']
+VIDEO_COLUMNS = ['FRAME', 'R_X', 'R_Y']
+
+# Columns produced by the per-row loop.
+DERIVED_COLUMNS = ['ALE', 'AL', 'SEG', 'BUSL', 'T', 'D', 'QB', 'IS', 'INST', 'INSTF', 'DISASM',
+                   'QL', 'Q0', 'Q1', 'Q2', 'Q3', 'IDX']
+
+# Instruction status codes, as stored in the IS column
+INST_STATUS_CODES = {'': -1, 'P': 0, 'I': 1}
+
+def derived_column(col, values):
+    """ Convert a list of decoded values to the column's type (see formatting.py). """
+    if col in CATEGORIES:
+        return categorical(np.array(values, dtype=np.int8), col)
+    if col in HEX_COLUMNS:
+        return pd.array(values, dtype=HEX_COLUMNS[col][1])
+    if col in ('QL', 'IDX'):
+        return np.array(values, dtype=np.int64)
+    if col == 'ANOM':
+        return np.array(values, dtype=np.uint8)
+    return values
+
+class DecoderState(CoreState):
+    """ Complete state of the decoder between two cycles: the bus core state,
+    plus the clock timing and raster position carried between chunks.
+
+    A fresh DecoderState matches the state of a decode starting at cycle 0.
+    """
+    def __init__(self):
+        super().__init__()
+
+        # Index of the next cycle to be decoded.
+        self.n = 0
+
+        # Clock timing
+        self.prev_time = None
+        self.prev_clk = None
+        self.prev_clk_change = False
+        self.d_accum = 0
+
+        # Raster position
+        self.frame = 0
+        self.r_x = 0
+        self.r_y = 0
+        self.prev_hs = None
+        self.prev_vs = None
+
+class StreamDecoder:
+    """ Decodes a cycle trace chunk by chunk.
+
+    Rows are held back until nothing later in the trace can change them: the
+    last decoded row needs the next row's queue status, and the row after an
+    instruction's first cycle receives its disassembly when it ends.
+
+    Only the columns of the given stages (see stages.py) are decoded. Events
+    are passed to 'analyzers' (an analyzers.Analyzers) as they are decoded.
+
+    Anomalies are counted in 'anomalies'. If 'flags' is set, the cycles they
+    occur on are also flagged in an ANOM column. Each stage is timed by
+    'profiler', if given.
+    """
+    def __init__(self, state=None, cache=None, stages=ALL_STAGES, analyzers=None, anomalies=None, flags=False,
+                 profiler=NULL_PROFILER):
+        self.state = state if state is not None else DecoderState()
+        self.profiler = profiler
+        self.stages = frozenset(stages)
+        # The per-cycle stages share one pass, profiled together.
+        self.core_name = '+'.join(stage.name for stage in STAGES if stage.kind == 'python' and stage.name in self.stages)
+        self.analyzers = analyzers if analyzers else None
+        self.engine = BusDecoder(self.state)
+        self.cache = cache if cache is not None else DisasmCache(None)
+        self.have_video = None
+
+        # Rows decoded but not yet returned, and their derived columns.
+        self.rows = None
+        outputs = stage_outputs(self.stages)
+        self.derived = {col: [] for col in DERIVED_COLUMNS if col in outputs}
+        if flags:
+            self.derived['ANOM'] = []
+        # Cycle index of the first row in self.rows
+        self.base = self.state.n
+        self.anomalies = anomalies if anomalies is not None else Anomalies()
+
+        # The current instruction, updated only when it changes.
+        self.inst_bytes = bytes(self.state.inst)
+
+    def prepare_chunk(self, chunk):
+        """ Compute the columns that don't depend on sequential state. """
+        s = self.state
+        chunk.columns = chunk.columns.str.strip()
+
+        stages = self.stages
+
+        if self.have_video is None:
+            self.have_video = 'VS' in chunk.columns and 'HS' in chunk.columns
+
+        chunk['N'] = np.arange(s.n, s.n + len(chunk))
+        profiler = self.profiler
+        rows = len(chunk)
+
+        addr = None
+        if 'address' in stages or 'bus' in stages:
+            with profiler.stage('address', rows, chunk):
+                addr = arrays.address_values(chunk)
+                if 'address' in stages:
+                    chunk['ADDR'] = addr.astype(np.int32)
+
+        if 'timing' in stages:
+            with profiler.stage('timing', rows, chunk):
+                ns_d, clk_change, d_accum = arrays.timing_columns(chunk['Time(s)'].to_numpy(dtype=np.float64), chunk['CLK'].to_numpy(), s)
+                chunk['ns_d'] = ns_d
+                chunk['CLK_change'] = clk_change
+                chunk['d_accum'] = d_accum
+
+        if 'raster' in stages and self.have_video:
+            with profiler.stage('raster', rows, chunk):
+                hs = chunk['HS'].to_numpy()
+                vs = chunk['VS'].to_numpy()
+                prev_hs, prev_vs = s.prev_hs, s.prev_vs
+                frame, r_x, r_y = arrays.raster_columns(hs, vs, s)
+                if self.analyzers:
+                    self.analyzers.raster(s.n, hs, vs, prev_hs, prev_vs, frame, r_y)
+                chunk['FRAME'] = frame
+                chunk['R_X'] = r_x
+                chunk['R_Y'] = r_y
+
+        b = qop = None
+        if 'status' in stages:
+            with profiler.stage('status', rows, chunk):
+                b = arrays.bus_status(chunk)
+                qop = arrays.queue_ops(chunk)
+                chunk['B'] = b
+                chunk['BUS'] = categorical(b, 'BUS')
+                chunk['QOP'] = categorical(qop, 'QOP')
+
+        return chunk, addr, b, qop
+
+    def finish_row(self, r, next_qop):
+        """ Complete pending row r, given the queue status of row r + 1. """
+        s = self.state
+        pos = r - self.base
+        out = self.derived
+
+        qb, finished, error = self.engine.complete(r, next_qop)
+        if error is not None:
+            self.anomaly(str(error).replace(' ', '_'), r, pos)
+
+        analyzers = self.analyzers
+        if analyzers:
+            if next_qop == QueueOp.Empty:
+                analyzers.emit('queue_flush', r + 1)
+            if finished is not None and finished[1]:
+                analyzers.emit('instruction', finished[0], finished[1], r)
+
+        queue = s.queue.items
+        out['QL'][pos] = len(queue)
+        for i in range(4):
+            out[f'Q{i}'][pos] = queue[i] if i < len(queue) else None
+        out['QB'][pos] = qb
+
+        if 'fetch' not in self.stages:
+            return
+
+        inst_final = None
+        if finished is not None:
+            idx, inst = finished
+            inst_final = bytes(inst)
+            if inst_final and 'disasm' in self.stages:
+                # The disassembly goes on the cycle after the first byte of
+                # the instruction was read from the queue.
+                target = idx + 1 - self.base
+                if target >= 0:
+                    inst_hex = inst_final.hex().upper()
+                    disassembled = self.cache.lookup(inst_hex)
+                    out['DISASM'][target] = disassembled
+                    if disassembled is None or disassembled == '(bad)':
+                        self.anomaly('bad_instruction', idx, target, self.cache.errors.get(inst_hex, inst_hex))
+        if qb is not None:
+            self.inst_bytes = bytes(s.inst)
+
+        out['IS'][pos] = INST_STATUS_CODES[s.inst_status]
+        out['INST'][pos] = self.inst_bytes
+        out['INSTF'][pos] = inst_final
+        out['IDX'][pos] = s.idx
+
+    def anomaly(self, kind, n, pos, detail=None):
+        """ Record an anomaly on cycle 'n', flagging pending row 'pos'. """
+        if self.anomalies.add(kind, n, detail) and 'ANOM' in self.derived:
+            self.derived['ANOM'][pos] |= ANOMALY_FLAGS[kind]
+
+    def decode_rows(self, addr, b, qop, ready, seg):
+        """ Run the sequential stages over arrays of cycles: address bus, bus
+        status, queue status, READY and segment status.
+        """
+        s = self.state
+        out = self.derived
+
+        n = len(b)
+        for col, values in out.items():
+            values.extend([-1 if col in CATEGORIES else 0 if col == 'ANOM' else None] * n)
+        finish_rows = 'queue' in self.stages
+
+        b_col = b.tolist()
+        qop_col = qop.tolist()
+        ready_col = ready.tolist()
+        seg_col = seg.tolist()
+        addr_col = addr.tolist()
+
+        cycle = self.engine.cycle
+        analyzers = self.analyzers
+        ale_out = out['ALE']
+        al_out = out['AL']
+        t_out = out['T']
+        d_out = out['D']
+        seg_out = out['SEG']
+        busl_out = out['BUSL']
+
+        pos = s.n - self.base
+        for i in range(n):
+            r = s.n
+
+            # Complete the previous row now that its next queue status is known.
+            if r > 0 and finish_rows:
+                self.finish_row(r - 1, qop_col[i])
+
+            ale, t_state, d = cycle(b_col[i], addr_col[i], ready_col[i])
+            if analyzers:
+                analyzers.cycle(r, ale, t_state, d, seg_col[i], s)
+
+            ale_out[pos] = 1 if ale else 0
+            al_out[pos] = s.al
+            t_out[pos] = t_state
+            d_out[pos] = d
+            if not ale and t_state != TState.TI:
+                seg_out[pos] = seg_col[i]
+            busl_out[pos] = s.busl if s.busl is not None else -1
+
+            s.n += 1
+            pos += 1
+
+    def take_rows(self, count):
+        """ Remove the first 'count' pending rows and return them as a DataFrame. """
+        if count <= 0:
+            return None
+
+        with self.profiler.stage('output', count):
+            rows = self.rows.iloc[:count].copy()
+            self.rows = self.rows.iloc[count:]
+            for col, values in self.take_columns(count).items():
+                rows[col] = values
+
+            return order_columns(rows)
+
+    def take_columns(self, count):
+        """ Remove the derived columns of the first 'count' pending rows and return them. """
+        columns = {}
+        for col, values in self.derived.items():
+            columns[col] = derived_column(col, values[:count])
+            del values[:count]
+
+        self.base += count
+        return columns
+
+    def decode_chunk(self, chunk):
+        chunk, addr, b, qop = self.prepare_chunk(chunk.reset_index(drop=True))
+
+        if self.rows is None:
+            self.rows = chunk
+        else:
+            self.rows = pd.concat([self.rows, chunk], ignore_index=True)
+
+        if 'bus' in self.stages:
+            with self.profiler.stage(self.core_name, len(chunk)):
+                self.decode_rows(addr, b, qop, chunk['READY'].to_numpy(), arrays.segments(chunk))
+        else:
+            self.state.n += len(chunk)
+            if self.analyzers:
+                self.analyzers.raster_until(self.state.n - 1)
+
+        # The last row is still waiting on the next queue status, and rows after
+        # the start of the current instruction may still receive its disassembly.
+        n = self.state.n
+        if 'disasm' in self.stages:
+            ready = min(n - 1, self.state.idx + 1)
+            if n - 1 - ready > MAX_PENDING:
+                ready = n - 1
+        elif 'queue' in self.stages:
+            ready = n - 1
+        else:
+            ready = n
+        return self.take_rows(ready - self.base)
+
+    def complete_last(self):
+        """ Complete the final row at the end of the trace. """
+        if self.state.n > 0 and 'queue' in self.stages:
+            self.finish_row(self.state.n - 1, None)
+            self.state.last_d = None
+            self.state.last_busl = None
+
+    def finish(self):
+        """ Complete the final row and return everything still pending. """
+        self.complete_last()
+        if self.rows is None:
+            return None
+        return self.take_rows(len(self.rows))
+
+def order_columns(df):
+    leading = [col for col in LEADING_COLUMNS if col in df.columns]
+    trailing = [col for col in TRAILING_COLUMNS + VIDEO_COLUMNS if col in df.columns]
+    input_columns = [col for col in df.columns if col not in leading and col not in trailing]
+    return df[leading + input_columns + trailing]
+
+def checkpoint_path(input_csv):
+    return input_csv + '.ckpt'
+
+def input_identity(input_csv):
+    # Checkpoints are only valid for the exact file they were taken from.
+    stat = os.stat(input_csv)
+    return {'input': os.path.basename(input_csv), 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'format': CHECKPOINT_FORMAT}
+
+def load_checkpoint(input_csv, cycle):
+    """ Return the saved state closest to, but not after, 'cycle', or None. """
+    path = checkpoint_path(input_csv)
+    if not os.path.exists(path):
+        return None
+
+    best = None
+    with open(path, 'r') as file:
+        if json.loads(file.readline()) != input_identity(input_csv):
+            print(f"Ignoring stale checkpoint file {path}")
+            return None
+        for line in file:
+            values = json.loads(line)
+            if values['n'] <= cycle and (best is None or values['n'] > best['n']):
+                best = values
+
+    return DecoderState.load(best) if best is not None else None
+
+def read_chunks(input_csv, chunk_size, start=0, progress=None):
+    """ Read the input CSV in chunks, beginning at data row 'start'. The bytes
+    read are reported to 'progress', if given.
+    """
+    with open(input_csv, 'rb') as file:
+        if progress is not None:
+            progress.follow(file)
+        if start == 0:
+            yield from pd.read_csv(file, comment=';', chunksize=chunk_size)
+            return
+
+        header = file.readline()
+        while header.startswith(b';'):
+            header = file.readline()
+        names = [name.strip() for name in header.decode().strip().split(',')]
+
+        skipped = 0
+        while skipped < start:
+            line = file.readline()
+            if not line:
+                return
+            if not line.startswith(b';'):
+                skipped += 1
+
+        yield from pd.read_csv(file, names=names, comment=';', chunksize=chunk_size)
+
+def split_chunk(chunk, n, next_stop=None):
+    """ Split a chunk beginning at cycle 'n' so that a piece ends at every cycle
+    returned by next_stop(). next_stop(n) returns the next stop after cycle n,
+    or None if there are no more.
+    """
+    pos = 0
+    while pos < len(chunk):
+        stop = next_stop(n + pos) if next_stop else None
+        size = len(chunk) - pos
+        if stop is not None:
+            size = min(size, stop - (n + pos))
+        yield chunk.iloc[pos:pos + size]
+        pos += size
+
+def every(interval):
+    """ Return a next_stop function for split_chunk() that stops every 'interval' cycles. """
+    return lambda n: (n // interval + 1) * interval
+
+def iter_decoded(input_csv, decoder, chunk_size=CHUNK_SIZE, start=0, end=None, next_stop=None, on_stop=None,
+                 progress=None):
+    """ Run 'decoder' over the input from its current cycle, yielding decoded
+    rows for cycles 'start' through 'end' (inclusive, None for end of file).
+
+    on_stop(state) is called whenever the decoder reaches a cycle returned by
+    next_stop(), with the complete state at that cycle. The bytes read are
+    reported to 'progress', if given.
+    """
+    def in_range(rows):
+        if rows is None:
+            return None
+        if start > 0 or end is not None:
+            keep = rows['N'] >= start
+            if end is not None:
+                keep &= rows['N'] <= end
+            rows = rows[keep]
+        return rows if len(rows) > 0 else None
+
+    for chunk in decoder.profiler.iterate('read', read_chunks(input_csv, chunk_size, decoder.state.n, progress)):
+        for piece in split_chunk(chunk, decoder.state.n, next_stop):
+            rows = in_range(decoder.decode_chunk(piece))
+            if rows is not None:
+                yield rows
+            if on_stop and next_stop and next_stop(decoder.state.n - 1) == decoder.state.n:
+                on_stop(decoder.state)
+
+        # Stop once every row up to 'end' has been completed.
+        if end is not None and decoder.base > end:
+            return
+
+    rows = in_range(decoder.finish())
+    if rows is not None:
+        yield rows
+
+def decode_csv(input_csv, output_csv, chunk_size=CHUNK_SIZE, checkpoint_interval=CHECKPOINT_INTERVAL, start=0, end=None,
+               columns=None, analyzers=None, flags=False, profiler=NULL_PROFILER):
+    """ Decode cycles 'start' through 'end' (inclusive) of the input file. The
+    output is CSV, Parquet or Arrow depending on its extension (see trace_io.py).
+
+    A full decode saves checkpoints every 'checkpoint_interval' cycles. A ranged
+    decode starts from the nearest checkpoint at or before 'start', if any.
+
+    If 'columns' is given, only the stages needed to produce those decoded
+    columns are run.
+
+    Each analyzer in 'analyzers' sees the events in the decoded range, and its
+    results are written next to the output file. So is a summary of the
+    anomalies found, which are flagged in an ANOM column if 'flags' is set.
+
+    Each stage of the decode is timed by 'profiler', if given.
+    """
+    stages = stages_for(columns) if columns else ALL_STAGES
+    events = Analyzers(analyzers or [], start, end)
+    stages = stages | events.stages()
+    state = load_checkpoint(input_csv, start) if start > 0 else None
+    if state is not None:
+        print(f"Resuming from checkpoint at cycle {state.n}")
+    cache = DisasmCache.load()
+    anomalies = Anomalies(start, end)
+    decoder = StreamDecoder(state, cache, stages, events, anomalies, flags, profiler)
+
+    # Checkpoints are only written when fully decoding the whole file.
+    ckpt_file = None
+    next_stop = None
+    if checkpoint_interval and start == 0 and end is None and stages == ALL_STAGES:
+        ckpt_file = open(checkpoint_path(input_csv), 'w')
+        ckpt_file.write(json.dumps(input_identity(input_csv)) + '\n')
+        next_stop = every(checkpoint_interval)
+
+    def save_checkpoint(state):
+        ckpt_file.write(json.dumps(state.save(), separators=(',', ':')) + '\n')
+
+    total = end + 1 if end is not None else None
+    progress = Progress('Decode', total, input_csv, 'cycles', decoder.state.n)
+    writer = trace_io.open_writer(output_csv)
+    try:
+        for rows in iter_decoded(input_csv, decoder, chunk_size, start, end, next_stop, save_checkpoint, progress):
+            with profiler.stage('write', len(rows), rows):
+                writer.write(rows)
+            progress.set(decoder.state.n if total is None else min(decoder.state.n, total))
+        progress.finish()
+    finally:
+        writer.close()
+
+    if ckpt_file:
+        ckpt_file.close()
+    with profiler.stage('results'):
+        events.write_results(output_csv)
+    anomalies.finish(output_csv)
+    cache.save()
+
+    return decoder.state
@@ -0,0 +1,341 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   decode_windows.py
+#
+#   Decodes only windows of a capture: the cycles around a list of markers (see
+#   markers.py), or short samples taken at regular intervals (see quick_look.py).
+#
+#   Each marker is placed on the first cycle at or after its time, and the
+#   cycles within RADIUS of it are decoded. Windows whose decodes would overlap
+#   are joined into one.
+#
+#   The bus and queue state machines resynchronize on their own once the first
+#   instruction after a queue flush begins (see decode_parallel.py). Each
+#   window is decoded with a fresh decoder state from WARMUP cycles before the
+#   flush of the last such resync point ahead of it, and continues past it
+#   until the queue status and disassembly of its last cycles are complete.
+#   Only the window itself is written. A window with no resync point within
+#   MAX_LEAD_IN cycles ahead of it is recorded as a 'no_resync' anomaly, since
+#   its queue and instruction columns may be wrong until the next flush. Clock
+#   timing and raster position never resynchronize, so they are tracked across
+#   the whole capture and seeded into each window's decoder.
+#
+#   All windows are extracted in a single forward pass. The raw rows a window
+#   might still need for its lead-in are kept until the pass is past them, and
+#   reading stops after the last window.
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import decode_stream
+import trace_io
+from bus_core import arrays
+from analyzers import Analyzers
+from anomalies import Anomalies
+from decode_parallel import find_resync_points
+from decode_stream import DecoderState, StreamDecoder
+from disasm_cache import DisasmCache
+from markers import Marker
+from profiling import NULL_PROFILER
+from progress import Progress
+from stages import ALL_STAGES, stages_for
+
+# Default number of cycles decoded on each side of a marker.
+RADIUS = 1000
+
+# Number of cycles decoded before the flush of a window's resync point, and at
+# least this many after the window.
+WARMUP = 256
+
+# A window's lead-in is never longer than this many cycles, even if there is no
+# resync point within it.
+MAX_LEAD_IN = 1000000
+
+class Window:
+    """ The cycles 'first' through 'last' around one or more markers, decoded
+    from cycle 'start' through cycle 'stop'.
+    """
+    def __init__(self, start, first, last, warmup, marker, synced=True):
+        self.start = start
+        # Whether the decode starts at the capture's start or before a resync point.
+        self.synced = synced
+        self.first = first
+        self.last = last
+        self.stop = last + warmup
+        self.warmup = warmup
+        self.markers = [marker]
+        self.anomalies = None
+        self.events = None
+
+    def extend(self, last, marker):
+        self.last = max(self.last, last)
+        self.stop = self.last + self.warmup
+        self.markers.append(marker)
+        if self.anomalies is not None:
+            self.anomalies.end = self.last
+            self.events.end = self.last
+
+    def select(self, rows):
+        """ Return the decoded rows inside the window, or None. """
+        if rows is None:
+            return None
+        rows = rows[(rows['N'] >= self.first) & (rows['N'] <= self.last)]
+        return rows if len(rows) > 0 else None
+
+class MarkerPlacer:
+    """ Places markers, sorted by time, on the first cycle at or after their time. """
+    def __init__(self, markers):
+        self.remaining = deque(markers)
+
+    def place(self, chunk, n, anchors):
+        """ Return (cycle, marker) for each marker placed in a chunk starting at
+        cycle 'n', given the chunk's resync points.
+        """
+        times = chunk['Time(s)'].to_numpy(dtype=np.float64)
+        placed = []
+        while self.remaining and self.remaining[0].time <= times[-1]:
+            marker = self.remaining.popleft()
+            placed.append((n + np.searchsorted(times, marker.time).item(), marker))
+        return placed
+
+    def done(self):
+        return not self.remaining
+
+class SamplePlacer:
+    """ Takes a sample every 'interval' cycles, the first half an interval in.
+    Each sample window starts at the first resync point at or after its sample
+    point, so it needs no lead-in beyond the flush and the warm-up. Sample
+    points with no resync point between them share a window. A sample's marker
+    is named after the cycle it's placed on, and has no time, since that cycle
+    may not have been read yet.
+    """
+    def __init__(self, interval, radius):
+        self.interval = interval
+        self.radius = radius
+        self.next_point = interval // 2
+        # Sample points still waiting for a resync point.
+        self.pending = deque()
+        self.last_placed = None
+
+    def place(self, chunk, n, anchors):
+        while self.next_point < n + len(chunk):
+            self.pending.append(self.next_point)
+            self.next_point += self.interval
+
+        placed = []
+        while self.pending:
+            k = np.searchsorted(anchors, self.pending[0])
+            if k == len(anchors):
+                break
+            self.pending.popleft()
+            cycle = anchors[k].item() + self.radius
+            if cycle != self.last_placed:
+                placed.append((cycle, Marker(None, f'sample at cycle {cycle}')))
+                self.last_placed = cycle
+        return placed
+
+    def done(self):
+        return False
+
+def track_rows(rows, state, stages, have_video):
+    """ Advance the clock timing and raster position in 'state' over raw rows,
+    without decoding them.
+    """
+    if 'timing' in stages:
+        arrays.timing_columns(rows['Time(s)'].to_numpy(dtype=np.float64), rows['CLK'].to_numpy(), state)
+    if 'raster' in stages and have_video:
+        arrays.raster_columns(rows['HS'].to_numpy(), rows['VS'].to_numpy(), state)
+    state.prev_b = arrays.bus_status(rows.iloc[-1:])[0].item()
+    state.prev_ready = rows['READY'].iloc[-1].item()
+    state.n += len(rows)
+
+def iter_windows(input_csv, placer, radius=RADIUS, warmup=WARMUP, chunk_size=decode_stream.CHUNK_SIZE,
+                 stages=ALL_STAGES, plugins=(), flags=False, cache=None, on_chunk=None, run_out=None,
+                 profiler=NULL_PROFILER, progress=None):
+    """ Decode the windows around the markers placed by 'placer' in a single pass.
+    If 'run_out' is given, no more than that many cycles past a window are
+    decoded, and its last instruction may be left without disassembly.
+
+    Yields (window, rows) for the decoded rows of each window, then (window, None)
+    once the window is finished. Each window's anomalies are in window.anomalies.
+    on_chunk(chunk, n) is called with every raw chunk read, starting at cycle n.
+    Each window's decoder is timed by 'profiler', if given. The cycles read
+    are reported to 'progress', which is created if not given.
+    """
+    if progress is None:
+        progress = Progress('Read', path=input_csv, unit='cycles')
+    have_video = None
+
+    # Raw rows kept for lead-ins, starting at cycle base.n. 'base' holds the clock
+    # timing and raster position at that cycle.
+    buffer = None
+    base = DecoderState()
+    # Resync points in the buffer, and the flush each one follows.
+    anchors = np.empty(0, dtype=np.int64)
+    flushes = np.empty(0, dtype=np.int64)
+    total = 0
+
+    windows = deque()
+    last_window = None
+    decoder = None
+
+    def lead_in(first):
+        """ Return the cycle to start decoding a window beginning at 'first' from,
+        and whether the decoder is resynchronized by then.
+        """
+        k = np.searchsorted(anchors, first, side='right')
+        flush = flushes[k - 1].item() if k > 0 else None
+        start = max(flush - warmup if k > 0 else base.n, first - MAX_LEAD_IN, base.n, 0)
+        return start, start == 0 or (flush is not None and start <= flush)
+
+    def add_window(m, marker):
+        nonlocal last_window
+        first, last = max(0, m - radius), m + radius
+        start, synced = lead_in(first)
+        if last_window is not None and start <= last_window.stop:
+            if windows and windows[-1] is last_window:
+                last_window.extend(last, marker)
+                return
+            # The previous window is already finished; don't decode its cycles twice.
+            first = max(first, last_window.last + 1)
+        last_window = Window(start, first, last, warmup, marker, synced)
+        windows.append(last_window)
+
+    def rows_between(start, stop):
+        return buffer.iloc[start - base.n:stop - base.n]
+
+    def decode_available(at_end=False):
+        """ Decode the buffered rows of the pending windows. At the end of the
+        input, windows are finished even if they extend past it.
+        """
+        nonlocal decoder
+        while windows and windows[0].start < total:
+            window = windows[0]
+            if decoder is None:
+                state = DecoderState.load(base.save())
+                if window.start > base.n:
+                    track_rows(rows_between(base.n, window.start), state, stages, have_video)
+                window.anomalies = Anomalies(window.first, window.last)
+                if not window.synced:
+                    window.anomalies.add('no_resync', window.first,
+                                         f"no queue flush in the {window.first - window.start} cycles decoded before it")
+                window.events = Analyzers(plugins, window.first, window.last)
+                decoder = StreamDecoder(state, cache, stages, window.events, window.anomalies, flags, profiler)
+
+            # Rows are held back until their instruction ends, which may be
+            # well past the window. Past the window, decode in doubling steps.
+            limit = total if run_out is None else min(total, window.last + run_out + 1)
+            while decoder.base <= window.last and decoder.state.n < limit:
+                n = decoder.state.n
+                stop = min(max(window.stop + 1, n + max(warmup, n - window.stop)), limit)
+                rows = window.select(decoder.decode_chunk(rows_between(n, stop)))
+                if rows is not None:
+                    yield window, rows
+            capped = run_out is not None and decoder.state.n > window.last + run_out
+            if decoder.base <= window.last and not (at_end or capped):
+                return
+
+            rows = window.select(decoder.finish())
+            if rows is not None:
+                yield window, rows
+            window.last = min(window.last, total - 1)
+            yield window, None
+            windows.popleft()
+            decoder = None
+
+    for chunk in profiler.iterate('read', decode_stream.read_chunks(input_csv, chunk_size, progress=progress)):
+        chunk.columns = chunk.columns.str.strip()
+        if have_video is None:
+            have_video = 'HS' in chunk.columns and 'VS' in chunk.columns
+        if on_chunk:
+            on_chunk(chunk, total)
+
+        chunk_flushes, chunk_anchors = find_resync_points(arrays.queue_ops(chunk))
+        chunk_flushes, chunk_anchors = total + chunk_flushes, total + chunk_anchors
+        anchors = np.concatenate((anchors, chunk_anchors))
+        flushes = np.concatenate((flushes, chunk_flushes))
+        buffer = chunk if buffer is None else pd.concat([buffer, chunk], ignore_index=True)
+
+        for m, marker in placer.place(chunk, total, chunk_anchors):
+            add_window(m, marker)
+        total += len(chunk)
+
+        yield from decode_available()
+
+        progress.set(total)
+
+        if not windows and placer.done():
+            break
+
+        # Later markers are at or after cycle 'total', so their lead-ins
+        # start no earlier than this.
+        keep_from = lead_in(max(0, total - radius))[0]
+        if windows:
+            keep_from = min(keep_from, windows[0].start)
+        if keep_from > base.n:
+            dropped = keep_from - base.n
+            track_rows(buffer.iloc[:dropped], base, stages, have_video)
+            buffer = buffer.iloc[dropped:]
+            kept = flushes >= keep_from
+            anchors, flushes = anchors[kept], flushes[kept]
+    else:
+        yield from decode_available(at_end=True)
+    progress.finish()
+
+def decode_windows(input_csv, output, markers, radius=RADIUS, warmup=WARMUP, chunk_size=decode_stream.CHUNK_SIZE,
+                   columns=None, analyzers=None, flags=False, profiler=NULL_PROFILER):
+    """ Decode the cycles within 'radius' of each of 'markers' (sorted by time)
+    into 'output'. The other arguments are as for decode_stream.decode_csv().
+    """
+    plugins = list(analyzers or [])
+    stages = stages_for(columns) if columns else ALL_STAGES
+    stages = stages | Analyzers(plugins).stages()
+    cache = DisasmCache.load()
+    anomalies = Anomalies()
+    placer = MarkerPlacer(markers)
+    written = 0
+    progress = Progress('Read', path=input_csv, unit='cycles')
+
+    writer = trace_io.open_writer(output)
+    try:
+        for window, rows in iter_windows(input_csv, placer, radius, warmup, chunk_size, stages, plugins, flags, cache,
+                                         profiler=profiler, progress=progress):
+            if rows is not None:
+                with profiler.stage('write', len(rows), rows):
+                    writer.write(rows)
+                written += len(rows)
+                continue
+            anomalies.merge(window.anomalies)
+            names = ', '.join(marker.name for marker in window.markers)
+            progress.print(f"Decoded cycles {window.first} to {window.last} around {names}")
+    finally:
+        writer.close()
+
+    for marker in placer.remaining:
+        print(f"Marker {marker.name} at {marker.time}s is after the end of the capture")
+
+    cache.save()
+    print(f"Wrote {written} cycles.")
+    Analyzers(plugins).write_results(output)
+    anomalies.finish(output)
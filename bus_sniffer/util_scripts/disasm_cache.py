@@ -0,0 +1,119 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   disasm_cache.py
+#
+#   Disassembly cache shared by the decoders.
+#
+#   A trace executes the same few hundred instructions over and over, so each
+#   unique instruction byte sequence is disassembled only once, with a single
+#   reused formatter. The results are saved to disasm_cache.json next to this
+#   script, or $MARTY_DISASM_CACHE, and loaded again by the next run. Runs
+#   saving at the same time, such as batch.py's workers, merge their entries.
+
+import json
+import os
+
+from iced_x86 import Decoder, Formatter, FormatterSyntax
+
+DEFAULT_CACHE = (os.environ.get('MARTY_DISASM_CACHE')
+                 or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'disasm_cache.json'))
+
+class DisasmCache:
+    """ Map of instruction hex strings to their NASM disassembly. """
+    def __init__(self, path=DEFAULT_CACHE):
+        self.path = path
+        self.entries = {}
+        self.new_entries = {}
+        # Why each instruction that couldn't be disassembled this run failed.
+        self.errors = {}
+        self.formatter = Formatter(FormatterSyntax.NASM)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CACHE):
+        cache = cls(path)
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    cache.entries = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable disassembly cache {path}: {e}")
+        return cache
+
+    def lookup(self, inst_hex):
+        """ Return the disassembly of an instruction hex string, or None if it can't be disassembled. """
+        inst_hex = inst_hex.upper()
+        if inst_hex in self.entries:
+            return self.entries[inst_hex]
+
+        disassembled = None
+        try:
+            for instr in Decoder(16, bytes.fromhex(inst_hex)):
+                disassembled = self.formatter.format(instr)
+        except Exception as e:
+            self.errors[inst_hex] = str(e)
+            disassembled = None
+
+        self.entries[inst_hex] = disassembled
+        self.new_entries[inst_hex] = disassembled
+        return disassembled
+
+    def merge(self, entries):
+        """ Add entries disassembled elsewhere, such as by a worker process. """
+        for inst_hex, disassembled in entries.items():
+            if inst_hex not in self.entries:
+                self.entries[inst_hex] = disassembled
+                self.new_entries[inst_hex] = disassembled
+
+    def save(self):
+        """ Write the cache back to disk if anything new was disassembled, with
+        what other runs have saved since. Each process writes its own temporary
+        file, so runs saving at once don't corrupt it. A failed save is only a
+        warning, since the cache can always be rebuilt.
+        """
+        if not self.path or not self.new_entries:
+            return
+
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'w') as file:
+                # Pick up anything another run saved in the meantime.
+                entries = self.read_saved()
+                entries.update(self.entries)
+                json.dump(entries, file, separators=(',', ':'), sort_keys=True)
+            os.replace(temp_path, self.path)
+            temp_path = None
+        except OSError as e:
+            print(f"Couldn't save disassembly cache {self.path}: {e}")
+            return
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.entries = entries
+        self.new_entries = {}
+
+    def read_saved(self):
+        """ Return the entries saved on disk, or none if it can't be read. """
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
@@ -26,10 +26,22 @@
 #   pretty.
 #
 #   Command Line Arguments:
-#   input_csv output_csv
+#   input_csv output_csv [--markers FILE [--window N]] [--no-cache]
+#
+#   With --markers, input_csv is a cycle CSV from export_cycles.py, and only the
+#   cycles within N of each marker in a PulseView session file (.pvs) or marker
+#   list are decoded (see decode_windows.py) and converted. The decoded windows
+#   are kept in <output>.windows.csv.
+#
+#   The decoded windows and the workbook are kept in the stage cache (see
+#   stage_cache.py), so converting the same input again with the same code only
+#   copies them back. --no-cache converts regardless.
+import argparse
 import csv
+import os
 import sys
 import json
+import pandas as pd
 from openpyxl import Workbook
 from openpyxl.styles import Border, Side, PatternFill, Font, NamedStyle
 from openpyxl.utils import get_column_letter
@@ -38,6 +50,13 @@ from openpyxl.chart.axis import NumericAxis
 
 from collections import deque
 
+import decode_windows
+import markers
+import stage_cache
+import trace_io
+from formatting import format_columns, strip_quote
+from progress import Progress
+
 PASTEL_PINK = 'FFD1DC'      # Pastel Pink
 PASTEL_ORANGE = 'FFC3A0'    # Pastel Orange
 PASTEL_YELLOW = 'FFF5A2'    # Pastel Yellow
@@ -160,30 +179,61 @@ def read_csv(csv_filename):
 
     return headers, data
 
-def csv_to_excel(csv_filename):
+def csv_rows(csv_filename):
+    with open(csv_filename, mode='r') as csv_file:
+        yield from csv.DictReader(csv_file)
+
+def read_rows(filename, keep_columns=None):
+    """ Return the headers of a decoded trace and an iterator over its rows, as
+    dicts of text as it appears in the CSV. Parquet and Arrow traces are read
+    with only the kept columns. 'filename' may also be a DataFrame of a trace.
+    """
+    if isinstance(filename, pd.DataFrame):
+        df = filename
+        if keep_columns is not None:
+            df = df[[col for col in df.columns if col in keep_columns]]
+        df = format_columns(df)
+    elif trace_io.trace_format(filename) == 'csv':
+        with open(filename, mode='r') as csv_file:
+            headers = next(csv.reader(csv_file))
+        return headers, csv_rows(filename)
+    else:
+        df = format_columns(trace_io.read_trace(filename, keep_columns))
+    headers = list(df.columns)
+    columns = [df[header].astype(object).where(df[header].notna(), '').map(str) for header in headers]
+    return headers, (dict(zip(headers, values)) for values in zip(*columns))
+
+def csv_to_excel(csv_filename, keep_columns=None, text_columns=()):
     
     wb = Workbook()
     ws = wb.active
     instructions = deque()
 
-    with open(csv_filename, mode='r') as csv_file:
-        csv_reader = csv.DictReader(csv_file)
+    headers, rows = read_rows(csv_filename, keep_columns)
+
+    print("Creating excel worksheet...")
 
-        print("Creating excel worksheet...")
+    # Only copy the columns we keep, rather than deleting the rest afterwards.
+    if keep_columns is not None:
+        headers = [header for header in headers if header in keep_columns]
 
-        for idx, header in enumerate(csv_reader.fieldnames, start=1):
-            ws.cell(row=1, column=idx, value=header)
+    for idx, header in enumerate(headers, start=1):
+        ws.cell(row=1, column=idx, value=header)
 
-        for i, row in enumerate(csv_reader):
-            if i % 1000 == 0:
-                sys.stdout.write(f'\rProcessed row: {i}')
-                sys.stdout.flush()
-            ws.append(list(row.values()))
+    total = len(csv_filename) if isinstance(csv_filename, pd.DataFrame) else None
+    progress = Progress('Worksheet', total, None if total is not None else csv_filename)
+    for i, row in enumerate(rows):
+        if i % 1000 == 0:
+            progress.set(i)
+        # Hex values are written to CSV with a leading ' to keep them as text.
+        ws.append([strip_quote(row[header]) if header in text_columns else row[header] for header in headers])
 
-            if row['DISASM']:
-                #print(f"Found instruction at: {i}")
-                instructions.append(i + 3)
+        if row['DISASM']:
+            #print(f"Found instruction at: {i}")
+            instructions.append(i + 3)
 
+    progress.set(ws.max_row - 1)
+    progress.finish()
     return wb, instructions
 
 def find_disasm_rows(headers, data):
@@ -245,11 +295,11 @@ def add_instruction_borders(wb, instructions):
     next_instr_idx = instructions.popleft()
 
     # Mark instructions with horizontal borders.
+    progress = Progress('Borders', ws.max_row)
     for i, row in enumerate(ws.iter_rows(), start=2): 
 
         if i % 1000 == 0:
-            sys.stdout.write(f'\rProcessed row: {i}')
-            sys.stdout.flush()
+            progress.set(i)
         
         if i == next_instr_idx:
             #print(f"\nMarking instruction: {i}")
@@ -258,7 +308,8 @@ def add_instruction_borders(wb, instructions):
             try:
                 next_instr_idx = instructions.popleft()
             except:
-                return
+                break
+    progress.finish()
                 
                 
 def draw_clocks(wb, columns):
@@ -362,29 +413,6 @@ def draw_clocks(wb, columns):
             col_num += 3
             color_index = (color_index + 1) % len(FILL_COLORS)
 
-def convert_columns_to_text(wb, col_headers):
-    """
-    Converts specified columns to text and removes any "`" character from the values.
-
-    :param ws: The worksheet object.
-    :param col_headers: List of column header names to be converted.
-    """
-
-    ws = wb.active
-    # First, identify the column numbers for the headers.
-    header_col_nums = {}
-    for col_num, cell in enumerate(ws[1], 1):  # assuming headers are in row 1
-        if cell.value in col_headers:
-            header_col_nums[cell.value] = col_num
-    
-    # Next, iterate over the cells in the specified columns.
-    for col_header, col_num in header_col_nums.items():
-        for row_num, row in enumerate(ws.iter_rows(min_row=2, min_col=col_num, max_col=col_num), start=2):  # starting from row 2
-            cell = ws.cell(row=row_num, column=col_num)
-            # If cell contains a value, convert it to text and remove any "`" character.
-            if cell.value is not None:
-                cell.value = str(cell.value).replace("'", "")
-
 def adjust_column_widths(ws, ignore_cols, padding=2):
     """
     Iterate through columns in the worksheet and set the column width based on the
@@ -784,7 +812,8 @@ def convert_columns_to_int(sheet, headers):
                     print(f"Error converting cell {cell.coordinate}, value: {cell.value} to integer. Keeping original value.")
 
                 
-def main():
+def write_workbook(source, output_xlsx):
+    """ Convert a decoded trace, a file or a DataFrame of one, to an Excel workbook. """
 
     clk_columns = ["READY", "CLK0", "INTR", "DR0", "VS", "HS", "DEN"]
     text_columns = ["AL", "INSTF", "D", "QB", "Q0", "Q1", "Q2", "Q3", "ADDR"]
@@ -796,20 +825,12 @@ def main():
         "FRAME", "R_X", "R_Y"
     ]
     
-    if len(sys.argv) != 3:
-        print("Usage: python excelify.py <input.csv> <output.xlsx>")
-        sys.exit(1)
-    
-    input_csv = sys.argv[1]
-    output_xlsx = sys.argv[2]
-    
     #headers, data = read_csv(input_csv)
 
-    wb, instructions = csv_to_excel(input_csv)
+    wb, instructions = csv_to_excel(source, keep_columns, text_columns)
 
     print(f"\nFound {len(instructions)} instructions...")
-    
-    keep_only_columns(wb, keep_columns)
+
     draw_clocks(wb, clk_columns)
 
     adjust_column_widths(wb.active, clk_columns, padding=4) 
@@ -817,10 +838,9 @@ def main():
         adjust_column_widths(wb.active, [], padding=4) 
 
     add_instruction_borders(wb, instructions)
-    
-    convert_columns_to_text(wb, text_columns)
+
     apply_fill(wb)
-    
+
     # Freeze the top row
     wb.active.freeze_panes = 'A2'
 
@@ -838,5 +858,31 @@ def main():
     #write_to_xlsx(headers, data, output_xlsx, disasm_rows)
     #wb.save(output_xlsx)
 
+def main():
+    parser = argparse.ArgumentParser(description="Convert a decoded cycle trace to an Excel workbook.")
+    parser.add_argument('input_csv')
+    parser.add_argument('output_xlsx')
+    parser.add_argument('--markers', default=None,
+                        help="Decode and convert only the cycles around the markers in a .pvs file or marker list.")
+    parser.add_argument('--window', type=int, default=decode_windows.RADIUS,
+                        help="Number of cycles to convert on each side of a marker.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Convert even if the stage cache has this workbook already.")
+    args = parser.parse_args()
+
+    input_csv = args.input_csv
+    output_xlsx = args.output_xlsx
+
+    cache = stage_cache.open_cache(not args.no_cache)
+    if args.markers:
+        windows_csv = os.path.splitext(output_xlsx)[0] + '.windows.csv'
+        cache.run('decode_windows', windows_csv,
+                  lambda: decode_windows.decode_windows(input_csv, windows_csv, markers.read_markers(args.markers), args.window),
+                  [input_csv, args.markers], {'window': args.window}, [decode_windows])
+        input_csv = windows_csv
+    
+    cache.run('excelify', output_xlsx, lambda: write_workbook(input_csv, output_xlsx), [input_csv],
+              modules=[sys.modules[__name__]])
+
 if __name__ == "__main__":
     main()
@@ -30,6 +30,8 @@
 import pandas as pd
 import sys
 
+from progress import Progress
+
 def process_chunk(chunk, prev_clk):
     chunk.columns = chunk.columns.str.strip()
     prev_clk_values = chunk['CLK'].shift(fill_value=prev_clk).astype(int)
@@ -39,9 +41,10 @@ def process_chunk(chunk, prev_clk):
 def process_csv(input_csv, output_csv):
     prev_clk = 0
     chunk_number = 0
+    progress = Progress('Export', path=input_csv)
     
-    with open(output_csv, 'w', newline='') as outfile:
-        for chunk in pd.read_csv(input_csv, chunksize=10000, comment=';'):
+    with open(input_csv, 'rb') as infile, open(output_csv, 'w', newline='') as outfile:
+        for chunk in pd.read_csv(progress.follow(infile), chunksize=10000, comment=';'):
             try:
                 chunk_number += 1
                 result_chunk, prev_clk = process_chunk(chunk, prev_clk)
@@ -49,14 +52,26 @@ def process_csv(input_csv, output_csv):
                 if chunk_number == 1:
                     result_chunk.to_csv(outfile, index=False)
                 else:
-                    result_chunk.to_csv(outfile, index=False, header=False, line_terminator='\n', mode='a')
+                    result_chunk.to_csv(outfile, index=False, header=False, lineterminator='\n', mode='a')
                 
-                sys.stdout.write(f'\rProcessing chunk number {chunk_number}...')
-                sys.stdout.flush()
+                progress.update(len(chunk))
             except Exception as e:
-                print(f"An error occurred while processing chunk number {chunk_number}: {e}")
+                progress.print(f"An error occurred while processing chunk number {chunk_number}: {e}")
         
-        print()
+        progress.finish()
+
+def read_cycles(input_csv, chunk_size=100000):
+    """ Return the rising CLK edges of a CSV exported from PulseView/DSView as one DataFrame. """
+    prev_clk = 0
+    chunks = []
+    progress = Progress('Export', path=input_csv)
+    with open(input_csv, 'rb') as infile:
+        for chunk in pd.read_csv(progress.follow(infile), chunksize=chunk_size, comment=';'):
+            result_chunk, prev_clk = process_chunk(chunk, prev_clk)
+            chunks.append(result_chunk)
+            progress.update(len(chunk))
+    progress.finish()
+    return pd.concat(chunks, ignore_index=True)
 
 if __name__ == '__main__':
     if len(sys.argv) != 3:
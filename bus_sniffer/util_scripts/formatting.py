@@ -0,0 +1,167 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   formatting.py
+#
+#   Conversion between decoded columns and their CSV text.
+#
+#   Inside the decoders, decoded columns hold numbers: addresses, data and
+#   queue bytes are integers, instructions are bytes, and named states (ALE,
+#   T-state, bus status, segment, queue op) are pandas categoricals over the
+#   names in bus_core.states. Only format_columns() turns them into text, when
+#   a trace is written to CSV. Hex values are written with a leading ' so that
+#   Excel keeps them as text.
+#
+#   Tools reading a decoded CSV back use read_csv() to get the numeric form
+#   again, so they see the same columns whether the CSV was decoded
+#   already or decoded on the fly.
+
+import numpy as np
+import pandas as pd
+
+from bus_core import BUS_STATES, QUEUE_STATES, SEG_STATES, T_STATES
+
+# Names of the ALE and instruction status codes
+ALE_STATES = ['.', 'A']
+INST_STATES = ['P', 'I']
+
+# Categorical columns and their categories. Missing values are written as ''.
+CATEGORIES = {
+    'ALE': ALE_STATES,
+    'SEG': SEG_STATES,
+    'BUSL': BUS_STATES,
+    'BUS': BUS_STATES,
+    'T': T_STATES,
+    'QOP': QUEUE_STATES,
+    'IS': INST_STATES,
+}
+
+# Hex columns, their digits and their integer type.
+HEX_COLUMNS = {
+    'ADDR': (5, 'Int32'),
+    'AL': (5, 'Int32'),
+    'D': (2, 'UInt8'),
+    'QB': (2, 'UInt8'),
+    'Q0': (2, 'UInt8'),
+    'Q1': (2, 'UInt8'),
+    'Q2': (2, 'UInt8'),
+    'Q3': (2, 'UInt8'),
+    'VECTOR': (2, 'UInt8'),
+}
+
+# Instruction byte columns. INST is the instruction so far, INSTF is set on the
+# last cycle of an instruction only.
+BYTES_COLUMNS = ['INST', 'INSTF']
+
+def categorical(codes, column):
+    """ Return the categorical column for an array of codes, -1 for missing. """
+    return pd.Categorical.from_codes(codes, categories=CATEGORIES[column])
+
+def codes(series, names):
+    """ Return the index in 'names' of each value of a categorical column, or -1. """
+    if isinstance(series.dtype, pd.CategoricalDtype) and list(series.cat.categories) == names:
+        return series.cat.codes.to_numpy(dtype=np.int64)
+    return pd.Categorical(series, categories=names).codes.astype(np.int64)
+
+def hex_text(value, digits):
+    return "'" + format(value, f'0{digits}X')
+
+def format_hex(values, digits):
+    """ Format an integer column as hex text, formatting each unique value once. """
+    values = pd.Series(values)
+    table = {value: hex_text(value, digits) for value in values.dropna().unique().tolist()}
+    return values.map(table).to_numpy()
+
+def format_bytes(values, column):
+    """ Format an instruction column. An empty INST is written as '', but an
+    empty INSTF as a lone '.
+    """
+    table = {}
+    out = []
+    for value in values:
+        text = table.get(value)
+        if text is None:
+            if value is None:
+                text = ''
+            elif not value and column == 'INST':
+                text = ''
+            else:
+                text = "'" + value.hex().upper()
+            table[value] = text
+        out.append(text)
+    return out
+
+def format_columns(df):
+    """ Return a copy of a decoded DataFrame with its numeric columns formatted
+    as CSV text. Categorical columns write their names as they are.
+    """
+    df = df.copy()
+    for col, (digits, _) in HEX_COLUMNS.items():
+        if col in df.columns and is_numeric(df[col]):
+            df[col] = format_hex(df[col], digits)
+    for col in BYTES_COLUMNS:
+        if col in df.columns and not is_text(df[col]):
+            df[col] = format_bytes(df[col].tolist(), col)
+    return df
+
+def is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series.dtype)
+
+def is_text(series):
+    values = series.dropna()
+    return len(values) == 0 or isinstance(values.iloc[0], str)
+
+def strip_quote(text):
+    """ Remove the leading ' from a hex value written to CSV. """
+    return text[1:] if text.startswith("'") else text
+
+def parse_hex(values, dtype):
+    """ Parse a column of hex text, with or without the leading ', to integers. """
+    values = pd.Series(values, dtype=object)
+    table = {text: int(strip_quote(text), 16) for text in values.dropna().unique().tolist()}
+    return pd.array(values.map(table), dtype=dtype)
+
+def parse_bytes(values, column):
+    """ Parse an instruction column read from CSV back to bytes. Missing and ''
+    values are empty, as format_bytes() writes them.
+    """
+    empty = b'' if column == 'INST' else None
+    return [bytes.fromhex(strip_quote(text)) if isinstance(text, str) and text else empty for text in values]
+
+def read_csv(csv_file, **kwargs):
+    """ Read a cycle CSV, converting any decoded columns to their numeric form. """
+    text = {col: str for col in list(HEX_COLUMNS) + BYTES_COLUMNS + list(CATEGORIES) + ['DISASM']}
+    df = pd.read_csv(csv_file, comment=';', dtype=text, **kwargs)
+    df.columns = df.columns.str.strip()
+    return parse_columns(df)
+
+def parse_columns(df):
+    """ Convert the decoded columns of a CSV read back in to their numeric form. """
+    for col, (_, dtype) in HEX_COLUMNS.items():
+        if col in df.columns and not is_numeric(df[col]):
+            df[col] = parse_hex(df[col], dtype)
+    for col in BYTES_COLUMNS:
+        if col in df.columns and is_text(df[col]):
+            df[col] = parse_bytes(df[col].tolist(), col)
+    for col, categories in CATEGORIES.items():
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = pd.Categorical(df[col], categories=categories)
+    return df
@@ -32,29 +32,22 @@
 
 import pandas as pd
 import sys
-import time
 
-def display_status(chunk_count, current_time, start_time, rows_processed):
-    elapsed_time = time.time() - start_time
-    rows_per_second = rows_processed / elapsed_time
-    sys.stdout.write(f"\rProcessing chunk: {chunk_count}, Time(s): {current_time}, Rows/sec: {rows_per_second:.2f}")
-    sys.stdout.flush()
+from progress import Progress
 
 def dump_rows(n, time_offset, source_file, destination_file):
     CHUNK_SIZE = 10000
-    chunk_count = 0
-    rows_processed = 0
-    start_time = time.time()
+    progress = Progress('Head', path=source_file)
+    infile = open(source_file, 'rb')
 
-    reader = pd.read_csv(source_file, sep=',', comment=';', chunksize=CHUNK_SIZE)
+    reader = pd.read_csv(progress.follow(infile), sep=',', comment=';', chunksize=CHUNK_SIZE)
 
     first_chunk = True
     dump_size = n
     rows_to_write = n
 
     for chunk in reader:
-        chunk_count += 1
-        rows_processed += len(chunk)
+        progress.update(len(chunk))
         
         # Not writing the last row of the chunk, as it might be incomplete
         chunk = chunk.iloc[:-1]
@@ -75,11 +68,12 @@ def dump_rows(n, time_offset, source_file, destination_file):
             if rows_to_write <= 0:
                 break
 
-        current_time = chunk['Time(s)'].max()
-        display_status(chunk_count, current_time, start_time, rows_processed)
+        progress.note = f"Time(s): {chunk['Time(s)'].max()}"
         
+    infile.close()
+    progress.finish()
     if rows_to_write > 0:
-        print(f"\nCould only extract {n - rows_to_write} rows after the time offset.")
+        print(f"Could only extract {n - rows_to_write} rows after the time offset.")
 
 if __name__ == '__main__':
     # Example usage: script_name.py 100 12.34 source.csv dest.csv
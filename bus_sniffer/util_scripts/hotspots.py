@@ -0,0 +1,197 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   hotspots.py
+#
+#   Find where a program spends its time, over a whole decoded trace.
+#
+#   Every instruction executed is grouped by the linear address of its first
+#   byte and, separately, by its opcode. For each group, the profile lists the
+#   number of executions, the total, minimum, maximum and mean cycles, the wait
+#   states, and the group's share of all cycles and of all bus cycles. The
+#   groups are sorted by total cycles, the hottest first.
+#
+#   An instruction's cycles run from the cycle its first byte is read from the
+#   queue to the cycle the next instruction's first byte is, as in the CYCLES
+#   column of excelify.py's Instructions sheet. The last instruction of the
+#   trace is incomplete and isn't counted.
+#
+#   The bus doesn't show the CS and IP registers, only the physical address of
+#   each code fetch. The queue is replayed from the code fetches, queue reads
+#   and flushes to find the address each instruction byte was fetched from.
+#   The queue's contents aren't known before the first flush, so instructions
+#   before it have no address and are only counted by opcode.
+#
+#   Either a decoded trace or a raw cycle CSV can be given; the columns needed
+#   are then decoded on the fly (see lazy_trace.py).
+#
+#   Command Line Arguments:
+#   trace [--top N] [--out PREFIX]
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from bus_core import BUS_STATES, INSTR_PREFIXES, QUEUE_STATES, T_STATES, BusStatus, QueueOp, TState
+from formatting import ALE_STATES, codes
+from lazy_trace import LazyTrace
+
+PROFILE_COLUMNS = ['N', 'ALE', 'AL', 'BUSL', 'T', 'D', 'QOP', 'QB', 'IDX', 'DISASM']
+
+# Number of groups printed from each table.
+TOP = 20
+
+def queue_addresses(df):
+    """ Return the address each byte read from the queue was fetched from, for
+    every cycle, or -1 where no byte was read or its address isn't known.
+    """
+    rows = len(df)
+    data = df['D'].notna().to_numpy()
+    code = codes(df['BUSL'], BUS_STATES) == BusStatus.CODE
+    fetched = np.flatnonzero(data & code)
+    addresses = df['AL'].to_numpy(dtype=np.int64, na_value=-1)[fetched]
+
+    # As in the bus core, a cycle's code fetch enters the queue before the queue
+    # is read or flushed on the queue status of the next cycle.
+    next_qop = np.full(rows, -1)
+    next_qop[:-1] = codes(df['QOP'], QUEUE_STATES)[1:]
+    reads = np.flatnonzero(df['QB'].notna().to_numpy())
+    flushes = np.flatnonzero(next_qop == QueueOp.Empty)
+
+    result = np.full(rows, -1, dtype=np.int64)
+    if len(flushes) == 0:
+        return result
+
+    # Bytes fetched up to and including each flush are discarded, so a read
+    # takes the byte fetched after the last flush, plus the reads since then.
+    last_flush = np.searchsorted(flushes, reads) - 1
+    known = last_flush >= 0
+    reads, last_flush = reads[known], flushes[last_flush[known]]
+    fetched_by_flush = np.searchsorted(fetched, last_flush, side='right')
+    read_number = np.arange(len(reads))
+    reads_by_flush = np.searchsorted(reads, last_flush, side='right')
+    fetch = fetched_by_flush + read_number - reads_by_flush
+
+    # A read past the last fetch is a queue underflow the decoder reported.
+    valid = fetch < len(fetched)
+    result[reads[valid]] = addresses[fetch[valid]]
+    return result
+
+def instructions(df):
+    """ Return a DataFrame with one row per complete instruction: its first cycle,
+    address, opcode, disassembly, cycles, wait states and bus cycles.
+    """
+    n = df['N'].to_numpy(dtype=np.int64)
+    idx = df['IDX'].to_numpy(dtype=np.int64)
+    qb = df['QB'].to_numpy(dtype=np.int64, na_value=-1)
+
+    # Each cycle's IDX is the first cycle of the instruction it belongs to.
+    starts = np.flatnonzero((n == idx) & (qb >= 0))
+    if len(starts) < 2:
+        return pd.DataFrame(columns=['N', 'ADDRESS', 'OPCODE', 'DISASM', 'CYCLES', 'WAITS', 'BUS'])
+    instruction = np.searchsorted(n[starts], idx)
+    counted = (instruction < len(starts) - 1) & (n[starts][np.minimum(instruction, len(starts) - 1)] == idx)
+    instruction = instruction[counted]
+    complete = len(starts) - 1
+
+    # The opcode is the first byte read that isn't a prefix.
+    reads = np.flatnonzero(counted & (qb >= 0))
+    opcode_reads = reads[~np.isin(qb[reads], list(INSTR_PREFIXES))]
+    first = np.unique(np.searchsorted(n[starts], idx[opcode_reads]), return_index=True)
+    opcode = np.full(complete, -1, dtype=np.int64)
+    keep = first[0] < complete
+    opcode[first[0][keep]] = qb[opcode_reads[first[1][keep]]]
+
+    ale = codes(df['ALE'], ALE_STATES)[counted] == 1
+    waits = codes(df['T'], T_STATES)[counted] == TState.TW
+    disasm = df['DISASM'].to_numpy(dtype=object)
+    # The disassembly is on the cycle after the first byte is read.
+    disasm_row = np.minimum(starts[:-1] + 1, len(df) - 1)
+    return pd.DataFrame({
+        'N': n[starts[:-1]],
+        'ADDRESS': queue_addresses(df)[starts[:-1]],
+        'OPCODE': opcode,
+        'DISASM': disasm[disasm_row],
+        'CYCLES': np.bincount(instruction, minlength=complete),
+        'WAITS': np.bincount(instruction, weights=waits, minlength=complete).astype(np.int64),
+        'BUS': np.bincount(instruction, weights=ale, minlength=complete).astype(np.int64),
+    })
+
+def hot_spots(inst, key):
+    """ Group instructions by 'key' and return the groups, hottest first. """
+    groups = inst[inst[key] >= 0].groupby(key).agg(
+        EXECUTIONS=('CYCLES', 'size'),
+        TOTAL=('CYCLES', 'sum'),
+        MIN=('CYCLES', 'min'),
+        MAX=('CYCLES', 'max'),
+        MEAN=('CYCLES', 'mean'),
+        WAITS=('WAITS', 'sum'),
+        BUS=('BUS', 'sum'),
+        DISASM=('DISASM', 'first'),
+    )
+    groups['CYCLE_SHARE'] = groups['TOTAL'] / max(inst['CYCLES'].sum(), 1)
+    groups['BUS_SHARE'] = groups['BUS'] / max(inst['BUS'].sum(), 1)
+    groups = groups.sort_values('TOTAL', ascending=False, kind='stable').reset_index()
+    groups = groups[[key, 'EXECUTIONS', 'TOTAL', 'CYCLE_SHARE', 'MIN', 'MAX', 'MEAN', 'WAITS', 'BUS', 'BUS_SHARE', 'DISASM']]
+    groups[key] = groups[key].map(('{:05X}' if key == 'ADDRESS' else '{:02X}').format)
+    return groups
+
+def print_table(title, groups, top):
+    print(f"\n{title}")
+    print(f"  {groups.columns[0]:<8} {'EXEC':>9} {'CYCLES':>11} {'SHARE':>7} {'MIN':>5} {'MAX':>5} {'MEAN':>7} "
+          f"{'WAITS':>9} {'BUS':>7}  DISASM")
+    for row in groups.head(top).itertuples(index=False):
+        print(f"  {row[0]:<8} {row.EXECUTIONS:>9} {row.TOTAL:>11} {row.CYCLE_SHARE:>7.2%} {row.MIN:>5} {row.MAX:>5} "
+              f"{row.MEAN:>7.2f} {row.WAITS:>9} {row.BUS_SHARE:>7.2%}  {row.DISASM}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile a decoded trace by instruction address and opcode.")
+    parser.add_argument('trace')
+    parser.add_argument('--top', type=int, default=TOP, help="Number of groups to print from each table.")
+    parser.add_argument('--out', default=None,
+                        help="Write the full tables to PREFIX.addresses.csv and PREFIX.opcodes.csv.")
+    args = parser.parse_args()
+
+    print(f"Reading {args.trace}...")
+    df = LazyTrace.read(args.trace, PROFILE_COLUMNS).select(PROFILE_COLUMNS)
+    inst = instructions(df)
+    if inst.empty:
+        sys.exit("No complete instructions in the trace")
+
+    unknown = (inst['ADDRESS'] < 0).sum()
+    print(f"{len(inst)} instructions over {inst['CYCLES'].sum()} cycles, {inst['BUS'].sum()} bus cycles and "
+          f"{inst['WAITS'].sum()} wait states.")
+    if unknown:
+        print(f"{unknown} instructions before the first queue flush have no address.")
+
+    by_address = hot_spots(inst, 'ADDRESS')
+    by_opcode = hot_spots(inst, 'OPCODE')
+    print_table("Hottest addresses:", by_address, args.top)
+    print_table("Hottest opcodes:", by_opcode, args.top)
+
+    if args.out:
+        by_address.to_csv(f'{args.out}.addresses.csv', index=False)
+        by_opcode.to_csv(f'{args.out}.opcodes.csv', index=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   lazy_trace.py
+#
+#   A cycle trace whose decoded columns are computed on first access.
+#
+#   LazyTrace wraps a cycle trace, either a raw CSV from export_cycles.py or a
+#   decoded CSV, Parquet or Arrow file. Asking it for a decoded column that
+#   isn't in the file runs only the decode stages that produce that column (see
+#   stages.py), and keeps the result for later accesses.
+#
+#   Decoded columns are held in their numeric form (see formatting.py), whether
+#   they were read from the file or decoded. If the trace was read with a stage
+#   cache (see stage_cache.py), the decoded columns are kept in it, keyed on the
+#   file's content and the stages run.
+
+import sys
+
+from decode_dag import decode_frame
+from disasm_cache import DisasmCache
+import stage_cache
+import trace_io
+from stages import STAGES_BY_NAME, producer, stage_outputs, stages_for
+
+class LazyTrace:
+    def __init__(self, df, path=None, cache=stage_cache.NO_CACHE):
+        df.columns = df.columns.str.strip()
+        self.df = df
+        self.path = path
+        self.cache = cache
+        # Columns a decode can be run from.
+        self.input_columns = [col for col in df.columns if producer(col) is None]
+
+    @classmethod
+    def read(cls, path, columns=None, cache=stage_cache.NO_CACHE):
+        """ Read a CSV, Parquet or Arrow trace. If 'columns' is given, only those
+        are read, plus the input columns if any of them have to be decoded.
+        Decoded columns are kept in 'cache' if given.
+        """
+        if columns is not None:
+            present = trace_io.trace_columns(path)
+            if any(col not in present for col in columns):
+                columns = list(columns) + [col for col in present if producer(col) is None and col not in columns]
+        return cls(trace_io.read_trace(path, columns), path, cache)
+
+    @property
+    def columns(self):
+        return list(self.df.columns)
+
+    def __len__(self):
+        return len(self.df)
+
+    def __getitem__(self, column):
+        self.materialize([column])
+        return self.df[column]
+
+    def select(self, columns):
+        """ Return a DataFrame of the given columns, decoding any that are missing. """
+        self.materialize(columns)
+        return self.df[columns]
+
+    def materialize(self, columns):
+        """ Decode any of 'columns' that aren't present yet. """
+        missing = [col for col in columns if col not in self.df.columns]
+        if not missing:
+            return
+
+        stages = stages_for(missing)
+        for name in stages:
+            for col in STAGES_BY_NAME[name].inputs:
+                if col not in self.input_columns:
+                    raise ValueError(f"Can't decode {', '.join(missing)}: input column {col} is missing")
+
+        def decode():
+            cache = DisasmCache.load() if 'disasm' in stages else None
+            decoded = decode_frame(self.df[self.input_columns].copy(), stages, cache=cache)
+            if cache is not None:
+                cache.save()
+            return decoded[[col for col in stage_outputs(stages) if col in decoded.columns]]
+
+        if self.path is not None:
+            params = {'stages': sorted(stages), 'inputs': self.input_columns}
+            decoded = self.cache.frame('lazy_decode', decode, [self.path], params, [sys.modules[__name__]])
+        else:
+            decoded = decode()
+
+        for col in stage_outputs(stages):
+            if col not in self.df.columns and col in decoded.columns:
+                self.df[col] = decoded[col].array
@@ -0,0 +1,104 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   markers.py
+#
+#   Markers for points of interest in a capture.
+#
+#   Markers are read from a PulseView session file (.pvs) or from a plain text
+#   list. PulseView saves each time marker as a [meta_objN] section:
+#
+#   [meta_obj0]
+#   type=time_marker
+#   time=22 serialization::archive 14 0 0 0 0 1234 56780000 0 0 0 0 -8 0 0 6
+#
+#   The time is a serialized boost cpp_dec_float: its base 10^8 digits, the
+#   decimal exponent of the first digit, the sign, the number class and the
+#   precision. The example above is 0.00001234 + 0.000000000056780000 seconds.
+#
+#   A marker list has one time in seconds per line, optionally followed by a
+#   name. Lines starting with '#' or ';' are comments:
+#
+#   0.0125 title screen
+#   0.0831 mode switch
+#
+#   Times are the capture's sample times, as in the Time(s) column of a cycle
+#   CSV and the range given to trim.py.
+
+import configparser
+from collections import namedtuple
+
+Marker = namedtuple('Marker', ['time', 'name'])
+
+# Decimal digits in each digit of a serialized cpp_dec_float.
+DIGIT_WIDTH = 8
+
+def parse_timestamp(value):
+    """ Return the time in seconds of a timestamp serialized by PulseView. """
+    tokens = value.split()
+    try:
+        # The archive signature and version are followed by two pairs of class
+        # tracking fields, then the number itself.
+        fields = [int(token) for token in tokens[tokens.index('serialization::archive') + 2:]]
+        digits, (exponent, negative, fpclass, _) = fields[4:-4], fields[-4:]
+    except ValueError:
+        raise ValueError(f"Unrecognized timestamp: {value}")
+    if fpclass != 0:
+        raise ValueError(f"Timestamp isn't a finite number: {value}")
+
+    time = sum(digit * 10.0 ** (exponent - DIGIT_WIDTH * k) for k, digit in enumerate(digits))
+    return -time if negative else time
+
+def read_pvs(path):
+    """ Return the time markers saved in a PulseView session file. """
+    config = configparser.ConfigParser(interpolation=None, strict=False)
+    config.read(path)
+
+    markers = []
+    for section in config.sections():
+        if not section.startswith('meta_obj') or config[section].get('type') != 'time_marker':
+            continue
+        name = config[section].get('name', section)
+        markers.append(Marker(parse_timestamp(config[section]['time']), name))
+    return markers
+
+def read_marker_list(path):
+    """ Return the markers in a text file with one time in seconds per line. """
+    markers = []
+    with open(path, 'r') as file:
+        for line_num, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line or line.startswith(('#', ';')):
+                continue
+            time, _, name = line.partition(' ')
+            try:
+                markers.append(Marker(float(time), name.strip() or f'line {line_num}'))
+            except ValueError:
+                raise ValueError(f"{path}:{line_num}: expected a time in seconds, got '{time}'")
+    return markers
+
+def read_markers(path):
+    """ Read markers from a .pvs session file or a marker list, sorted by time. """
+    if path.lower().endswith('.pvs'):
+        markers = read_pvs(path)
+    else:
+        markers = read_marker_list(path)
+    return sorted(markers, key=lambda marker: marker.time)
@@ -0,0 +1,173 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   marty_tools.py
+#
+#   A single entry point for the utility scripts, and a pipeline that runs
+#   several of them in one process.
+#
+#   Each subcommand runs one script with the rest of the command line, the same
+#   as running the script itself, e.g. 'marty_tools.py decode in.csv out.csv
+#   --jobs 4'. Only that script and what it imports are loaded, so a trim or a
+#   count doesn't pay for importing iced_x86, openpyxl or PIL.
+#
+#   'pipeline' chains the export, trim, decode, img and xlsx steps. Each step
+#   hands its table to the next in memory instead of writing a CSV and parsing
+#   it back, and only the decode stages the requested outputs need are run
+#   (see stages.py). Intermediate tables are written only if asked for with
+#   --cycles or --decoded. The whole capture is held in memory, so captures
+#   larger than memory still need the scripts run one at a time.
+#
+#   Command Line Arguments:
+#   COMMAND [ARGS...]
+#   pipeline input_csv [--export] [--trim MIN_TIME MAX_TIME] [--cycles CSV]
+#   [--decoded PATH [--columns COL,COL,...]] [--img PNG [--font FONT]]
+#   [--xlsx XLSX] [--jobs N]
+
+import argparse
+import os
+import runpy
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Subcommands that run a script: name -> (script, description).
+COMMANDS = {
+    'export': ('export_cycles.py', "Keep only the rising CPU clock edges of a PulseView/DSView CSV"),
+    'trim': ('trim.py', "Keep only the rows in a time range"),
+    'head': ('head.py', "Keep the first rows after a time offset"),
+    'fix-addr': ('fix_addr.py', "Restore address lines borrowed for other signals"),
+    'count': ('count_rows.py', "Count the rows of a CSV"),
+    'convert': ('convert_csv.py', "Convert a decoded trace to a CSV PulseView can import"),
+    'decode': ('decode.py', "Decode a cycle CSV into a cycle trace"),
+    'marty': ('decode_marty2.py', "Decode a MartyPC cycle log"),
+    'quick-look': ('quick_look.py', "Summarize a cycle CSV from sampled windows"),
+    'img': ('csv_to_img.py', "Draw the CGA raster of a trace"),
+    'xlsx': ('excelify.py', "Convert a decoded trace to an Excel workbook"),
+    'normalize': ('normalize_clock.py', "Normalize the timestamps of a capture for PulseView"),
+    'reclock': ('reclock.py', "Convert the CPU clock back to square waves for PulseView"),
+    'align': ('align_captures.py', "Find the offsets between captures of the same program"),
+    'hotspots': ('hotspots.py', "Profile a trace by instruction address and opcode"),
+    'diff': ('trace_diff.py', "Find where two decoded traces diverge"),
+    'synth': ('synth_trace.py', "Generate a synthetic cycle trace"),
+    'batch': ('batch.py', "Run the pipeline on many captures in parallel"),
+    'bench': ('bench.py', "Benchmark the decoders on synthetic traces"),
+    'cache': ('stage_cache.py', "Inspect or empty the stage cache"),
+}
+
+def run_script(script, args):
+    """ Run a script with 'args' as its command line arguments. """
+    path = os.path.join(SCRIPT_DIR, script)
+    sys.argv = [path] + args
+    runpy.run_path(path, run_name='__main__')
+
+def pipeline(args):
+    """ Run the pipeline steps on a capture held in memory. """
+    import pandas as pd
+
+    import decode
+    import trace_io
+    from stages import ALL_STAGES, stages_for
+
+    start_time = time.time()
+    if args.export:
+        import export_cycles
+        print(f"Exporting clock edges from {args.input_csv}...")
+        df = export_cycles.read_cycles(args.input_csv)
+    else:
+        print(f"Reading {args.input_csv}...")
+        df = pd.read_csv(args.input_csv, comment=';')
+        df.columns = df.columns.str.strip()
+
+    if args.trim:
+        import trim
+        df = trim.process_chunk(df, *args.trim).reset_index(drop=True)
+    print(f"Have {len(df)} cycles.")
+
+    if args.cycles:
+        df.to_csv(args.cycles, index=False)
+        print(f"Cycles saved to {args.cycles}")
+
+    # The workbook and a full decoded trace need every stage, the images only a few.
+    if args.xlsx or (args.decoded and not args.columns):
+        stages = ALL_STAGES
+    else:
+        columns = list(args.columns or [])
+        if args.img:
+            import csv_to_img
+            columns += csv_to_img.IMAGE_COLUMNS
+        stages = stages_for(columns)
+
+    if args.decoded or args.img or args.xlsx:
+        print("Decoding...")
+        decoded = decode.decode_frame(df, stages, args.jobs)
+
+        if args.decoded:
+            trace_io.write_trace(decoded, args.decoded)
+            print(f"Decoded trace saved to {args.decoded}")
+        if args.img:
+            import csv_to_img
+            from lazy_trace import LazyTrace
+            from PIL import ImageFont
+            font = ImageFont.load(args.font) if args.font else None
+            csv_to_img.write_images(LazyTrace(decoded), args.img, font)
+        if args.xlsx:
+            import excelify
+            excelify.write_workbook(decoded, args.xlsx)
+
+    print(f"Pipeline finished in {time.time() - start_time:.1f}s")
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        run_script(COMMANDS[sys.argv[1]][0], sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description="Run a marty_tools script, or a pipeline of them in one process.")
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='COMMAND')
+    for name, (script, description) in COMMANDS.items():
+        subparsers.add_parser(name, help=f"{description} ({script})", add_help=False)
+
+    pipe = subparsers.add_parser('pipeline', help="Export, trim, decode and draw or convert a capture in one process",
+                                 description="Export, trim, decode and draw or convert a capture in one process.")
+    pipe.add_argument('input_csv')
+    pipe.add_argument('--export', action='store_true',
+                      help="The input is a PulseView/DSView CSV: keep only its rising clock edges first.")
+    pipe.add_argument('--trim', type=float, nargs=2, metavar=('MIN_TIME', 'MAX_TIME'),
+                      help="Keep only the cycles in this time range. A MAX_TIME of 0 keeps everything after MIN_TIME.")
+    pipe.add_argument('--cycles', default=None, help="Write the exported and trimmed cycles to this CSV.")
+    pipe.add_argument('--decoded', default=None, help="Write the decoded trace to this CSV, Parquet or Arrow file.")
+    pipe.add_argument('--columns', type=lambda value: value.split(','), default=None,
+                      help="Comma-separated decoded columns to produce for --decoded.")
+    pipe.add_argument('--img', default=None, help="Draw the CGA raster to images named after this PNG.")
+    pipe.add_argument('--font', default=None, help="PIL pixel font for --img.")
+    pipe.add_argument('--xlsx', default=None, help="Convert the decoded trace to this Excel workbook.")
+    pipe.add_argument('--jobs', type=int, default=None, help="Number of workers for independent decode stages.")
+    args = parser.parse_args()
+
+    if args.trim and args.trim[1] < args.trim[0] and args.trim[1] != 0:
+        pipe.error("MAX_TIME must be greater than or equal to MIN_TIME, or 0")
+    if not (args.cycles or args.decoded or args.img or args.xlsx):
+        pipe.error("nothing to do: give at least one of --cycles, --decoded, --img or --xlsx")
+    pipeline(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   profiling.py
+#
+#   Opt-in instrumentation for the decoders.
+#
+#   A StageProfiler records, for each named stage of a decode, the number of
+#   calls and rows, the wall time and rows per second, the peak RSS of the
+#   process and how much it grew during the stage, and the memory of the
+#   DataFrame the stage works on before and after it. Stages are timed each
+#   time they run, chunk by chunk, and the totals are reported.
+#
+#   With trace_memory, tracemalloc also records the peak memory allocated
+#   during each stage, and the top allocation sites of the whole run. With a
+#   profile_dir, each stage is run under its own cProfile profiler, and its
+#   statistics are dumped to <profile_dir>/<stage>.prof.
+#
+#   The report is JSON, so it can be diffed across versions and attached to
+#   bug reports. Decoders take NULL_PROFILER by default, which does nothing.
+
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; RSS isn't reported there.
+    resource = None
+
+# Version of the report layout.
+REPORT_FORMAT = 1
+
+# Number of allocation sites listed with trace_memory.
+TOP_ALLOCATIONS = 20
+
+MB = 1024 * 1024
+
+def peak_rss():
+    """ Return the peak resident set size of this process in bytes, or None. """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def megabytes(value):
+    return None if value is None else round(value / MB, 3)
+
+class StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.peak_rss = None
+        self.rss_growth = 0
+        self.frame_before = 0
+        self.frame_after = 0
+        self.traced_peak = None
+
+    def report(self):
+        return {
+            'calls': self.calls,
+            'rows': self.rows,
+            'seconds': round(self.seconds, 6),
+            'rows_per_sec': round(self.rows / self.seconds) if self.seconds > 0 and self.rows else None,
+            'peak_rss_mb': megabytes(self.peak_rss),
+            'rss_growth_mb': megabytes(self.rss_growth) if self.peak_rss is not None else None,
+            'df_mb_before': megabytes(self.frame_before),
+            'df_mb_after': megabytes(self.frame_after),
+            'traced_peak_mb': megabytes(self.traced_peak),
+        }
+
+class StageProfiler:
+    """ Records time, throughput and memory for each stage of a decode. """
+    def __init__(self, trace_memory=False, profile_dir=None):
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.stats = {}
+        self.profiles = {}
+        self.started = time.perf_counter()
+        self.info = {}
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def __bool__(self):
+        return True
+
+    @contextmanager
+    def stage(self, name, rows=0, df=None):
+        """ Time the enclosed block as one call of stage 'name', which processes
+        'rows' rows of the DataFrame 'df', if given.
+        """
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = StageStats()
+        if df is not None:
+            stats.frame_before += frame_bytes(df)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        rss_before = peak_rss()
+
+        profile = None
+        if self.profile_dir:
+            profile = self.profiles.get(name)
+            if profile is None:
+                profile = self.profiles[name] = cProfile.Profile()
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds += time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+
+            stats.calls += 1
+            stats.rows += rows
+            rss = peak_rss()
+            if rss is not None:
+                stats.peak_rss = max(stats.peak_rss or 0, rss)
+                stats.rss_growth += rss - rss_before
+            if self.trace_memory:
+                traced = tracemalloc.get_traced_memory()[1]
+                stats.traced_peak = max(stats.traced_peak or 0, traced)
+            if df is not None:
+                stats.frame_after += frame_bytes(df)
+
+    def iterate(self, name, iterable, df_rows=True):
+        """ Yield the items of 'iterable', timing each step as a call of stage
+        'name'. Items are DataFrames whose rows are counted if 'df_rows' is set.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    self.stats[name].calls -= 1
+                    return
+            if df_rows:
+                self.stats[name].rows += len(item)
+            yield item
+
+    def report(self):
+        report = {
+            'format': REPORT_FORMAT,
+            'command': sys.argv,
+            'python': sys.version.split()[0],
+            'wall_seconds': round(time.perf_counter() - self.started, 6),
+            'peak_rss_mb': megabytes(peak_rss()),
+            **self.info,
+            'stages': {name: stats.report() for name, stats in self.stats.items()},
+        }
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            report['top_allocations'] = [
+                {'where': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                 'size_mb': megabytes(stat.size), 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]]
+        return report
+
+    def print_summary(self):
+        print(f"{'Stage':<24}{'Calls':>8}{'Rows':>12}{'Seconds':>10}{'Rows/s':>12}{'Peak RSS MB':>13}")
+        for name, stats in self.stats.items():
+            row = stats.report()
+            rate = row['rows_per_sec'] if row['rows_per_sec'] is not None else ''
+            rss = row['peak_rss_mb'] if row['peak_rss_mb'] is not None else ''
+            print(f"{name:<24}{row['calls']:>8}{row['rows']:>12}{row['seconds']:>10.2f}{rate:>12}{rss:>13}")
+
+    def write(self, path):
+        """ Write the JSON report to 'path', and the cProfile statistics of each
+        stage to the profile directory.
+        """
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+            file.write('\n')
+        print(f"Wrote profile report to {path}")
+
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            for name, profile in self.profiles.items():
+                profile.dump_stats(os.path.join(self.profile_dir, name.replace('+', '_') + '.prof'))
+            print(f"Wrote {len(self.profiles)} stage profiles to {self.profile_dir}")
+
+class NullProfiler:
+    """ A profiler that records nothing. """
+    def __bool__(self):
+        return False
+
+    def stage(self, name, rows=0, df=None):
+        return nullcontext()
+
+    def iterate(self, name, iterable, df_rows=True):
+        return iterable
+
+NULL_PROFILER = NullProfiler()
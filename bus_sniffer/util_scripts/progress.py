@@ -0,0 +1,196 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   progress.py
+#
+#   Progress reporting shared by the tools and decode stages.
+#
+#   A Progress follows one stage of work. It reports the rows done, rows per
+#   second, bytes of input read, the time left and the time elapsed. Tools
+#   call update() with the rows just processed as often as they like. A
+#   report is printed at most every half second, or every ten seconds when
+#   output goes to a log file instead of a terminal. Between reports, an
+#   update costs one clock read. When the stage finishes, a final line gives
+#   its elapsed time and average rate.
+#
+#   The time left comes from the stage's total rows, if known. Otherwise it
+#   comes from how far the stage has read through its input file. A known
+#   total is given by the caller, or read from a '<file>.rows' sidecar, which
+#   count_rows.py writes.
+#
+#   Reports are a line rewritten in place. With the environment variable
+#   MARTY_PROGRESS=json, each report is printed as a JSON object on its own
+#   line instead, for dashboards and batch logs. MARTY_PROGRESS=off turns
+#   reporting off.
+
+import json
+import os
+import sys
+import time
+
+INTERVAL = 0.5
+LOG_INTERVAL = 10.0
+MODE = os.environ.get('MARTY_PROGRESS', 'text')
+
+def row_count_path(path):
+    return path + '.rows'
+
+def file_identity(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def row_count(path):
+    """ Return the row count recorded for a file, or None if there is none or the file changed since. """
+    try:
+        with open(row_count_path(path), 'r') as file:
+            recorded = json.load(file)
+        if recorded['identity'] == file_identity(path):
+            return recorded['rows']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def save_row_count(path, rows):
+    """ Record the row count of a file in its sidecar, for later progress estimates. """
+    with open(row_count_path(path), 'w') as file:
+        json.dump({'identity': file_identity(path), 'rows': rows}, file)
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class Progress:
+    """ Progress of one stage. 'total' is the number of rows it will process if
+    known. 'path' is its input file, whose size and row count sidecar give the
+    time left. The stage starts at row 'initial', such as a checkpoint.
+    """
+    def __init__(self, stage, total=None, path=None, unit='rows', initial=0):
+        self.stage = stage
+        self.unit = unit
+        self.total = total if total is not None or path is None else row_count(path)
+        self.input_bytes = os.path.getsize(path) if path is not None and os.path.exists(path) else None
+        self.source = None
+        self.initial = initial
+        self.count = initial
+        self.note = None
+        self.interval = INTERVAL if sys.stdout.isatty() else LOG_INTERVAL
+        self.start = time.monotonic()
+        self.next_report = self.start + self.interval
+        self.width = 0
+
+    def follow(self, file):
+        """ Report the bytes read from the open binary 'file'. """
+        self.source = file
+        return file
+
+    def update(self, count=1, note=None):
+        """ Add 'count' rows done, reporting if it's time to. """
+        self.count += count
+        if note is not None:
+            self.note = note
+        now = time.monotonic()
+        if now >= self.next_report:
+            self.next_report = now + self.interval
+            self.report(now)
+
+    def set(self, count, note=None):
+        """ Set the rows done, reporting if it's time to. """
+        self.update(count - self.count, note)
+
+    def bytes_read(self):
+        if self.source is None:
+            return None
+        try:
+            return self.source.tell()
+        except (OSError, ValueError):
+            # Closed at the end of the stage.
+            return self.input_bytes
+
+    def status(self, now, done=False):
+        elapsed = now - self.start
+        rate = (self.count - self.initial) / elapsed if elapsed > 0 else 0.0
+        read = self.bytes_read()
+
+        fraction = None
+        if self.total:
+            fraction = min(1.0, self.count / self.total)
+        elif self.input_bytes and read:
+            fraction = min(1.0, read / self.input_bytes)
+        left = None
+        if not done and fraction and self.count > self.initial:
+            left = elapsed * (1 - fraction) / fraction
+
+        return {'stage': self.stage, 'unit': self.unit, 'count': self.count, 'total': self.total, 'rate': round(rate, 1),
+                'bytes': read, 'input_bytes': self.input_bytes, 'elapsed': round(elapsed, 3),
+                'left': None if left is None else round(left, 1), 'note': self.note, 'done': done}
+
+    def text(self, status):
+        if status['done']:
+            text = f"{self.stage}: {status['count']:,} {self.unit} in {format_duration(status['elapsed'])}"
+            if status['elapsed'] >= 1:
+                text += f", {status['rate']:,.0f} {self.unit}/s"
+            return text
+
+        text = f"{self.stage}: {status['count']:,}"
+        if status['total']:
+            text += f" of {status['total']:,}"
+        text += f" {self.unit}, {status['rate']:,.0f}/s"
+        if status['bytes'] is not None:
+            text += f", {status['bytes'] / 1024 ** 2:,.0f} MB read"
+        if status['left'] is not None:
+            text += f", {format_duration(status['left'])} left"
+        text += f", {format_duration(status['elapsed'])} elapsed"
+        if status['note']:
+            text += f" ({status['note']})"
+        return text
+
+    def report(self, now=None, done=False):
+        if MODE == 'off':
+            return
+        status = self.status(time.monotonic() if now is None else now, done)
+        if MODE == 'json':
+            print(json.dumps(status), flush=True)
+            return
+
+        line = self.text(status)
+        if self.interval == INTERVAL:
+            sys.stdout.write('\r' + line.ljust(self.width) + ('\n' if done else ''))
+            self.width = 0 if done else len(line)
+        else:
+            sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+    def print(self, message):
+        """ Print a message, clearing the progress line first. """
+        if self.width:
+            sys.stdout.write('\r' + ' ' * self.width + '\r')
+            self.width = 0
+        print(message)
+
+    def finish(self, note=None):
+        """ Report the stage done. """
+        if note is not None:
+            self.note = note
+        self.report(done=True)
@@ -0,0 +1,239 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   quick_look.py
+#
+#   Triage a large capture without decoding all of it.
+#
+#   A single pass over the cycle CSV counts, for every cycle:
+#   - bus cycles by type
+#   - code fetches, by 256-byte page of physical address, merged into ranges
+#   - INTR rising edges and VS falling edges (new frames), and the frames in
+#     which interrupts were acknowledged
+#
+#   Along the way, short windows sampled every N cycles are fully decoded (see
+#   decode_windows.py), and summarized by the instructions that ran in them.
+#   Each sample starts with the first instruction after a queue flush, where
+#   the decoder's queue state is known to be right, so the samples show the
+#   same queue and instruction columns as a full decode. A sample is labeled
+#   with the cycle and time it starts at.
+#
+#   The report is printed and written to a JSON file.
+#
+#   Command Line Arguments:
+#   input_csv report_json [--every N] [--window N]
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import decode_stream
+from anomalies import Anomalies
+from bus_core import BusStatus, BUS_STATES, arrays
+from decode_windows import SamplePlacer, iter_windows
+from disasm_cache import DisasmCache
+from stages import stages_for
+
+# Default number of cycles between samples, about a fifth of a second at 4.77MHz.
+SAMPLE_INTERVAL = 1000000
+
+# Default number of cycles decoded on each side of a sample point.
+SAMPLE_RADIUS = 1000
+
+# At most this many cycles are decoded past a sample to complete its last
+# instruction. An instruction still running then isn't disassembled.
+SAMPLE_RUN_OUT = 1000
+
+SAMPLE_COLUMNS = ['DISASM', 'BUSL', 'AL']
+
+# Code fetches are counted by page of 1 << PAGE_BITS bytes.
+PAGE_BITS = 8
+
+# Number of most frequent instructions listed for each sample.
+TOP_INSTRUCTIONS = 5
+
+def edges(values, prev, rising):
+    """ Return a mask of the rising or falling edges of a 0/1 column. """
+    before = np.empty(len(values), dtype=values.dtype)
+    before[1:] = values[:-1]
+    before[0] = values[0] if prev is None else prev
+    if rising:
+        return (before == 0) & (values == 1)
+    return (before == 1) & (values == 0)
+
+class Counters:
+    """ Counts kept over every cycle of the capture. """
+    def __init__(self):
+        self.cycles = 0
+        self.first_time = None
+        self.last_time = None
+        self.bus_cycles = np.zeros(len(BUS_STATES), dtype=np.int64)
+        self.code_fetches = np.zeros((1 << 20) >> PAGE_BITS, dtype=np.int64)
+        self.intr_edges = 0
+        self.frames = 0
+        # frame: [interrupts acknowledged, INTR rising edges]
+        self.frame_interrupts = {}
+
+        self.prev_b = None
+        self.prev_bus_status = None
+        self.prev_intr = None
+        self.prev_vs = None
+
+    def add(self, chunk, n):
+        times = chunk['Time(s)'].to_numpy(dtype=np.float64)
+        if self.first_time is None:
+            self.first_time = times[0].item()
+        self.last_time = times[-1].item()
+        self.cycles += len(chunk)
+
+        b = arrays.bus_status(chunk)
+        prev_b = np.empty_like(b)
+        prev_b[1:] = b[:-1]
+        prev_b[0] = b[0] if self.prev_b is None else self.prev_b
+        self.prev_b = b[-1].item()
+        ale = np.flatnonzero((prev_b == BusStatus.PASV) & (b != BusStatus.PASV))
+
+        status = b[ale]
+        self.bus_cycles += np.bincount(status, minlength=len(BUS_STATES))
+
+        code = ale[status == BusStatus.CODE]
+        if len(code):
+            pages = arrays.address_values(chunk.iloc[code]) >> PAGE_BITS
+            np.add.at(self.code_fetches, pages, 1)
+
+        # The CPU runs two INTA bus cycles for each interrupt; count the first.
+        prev_status = np.empty_like(status)
+        if len(status):
+            prev_status[1:] = status[:-1]
+            prev_status[0] = -1 if self.prev_bus_status is None else self.prev_bus_status
+            self.prev_bus_status = status[-1].item()
+        inta = ale[(status == BusStatus.INTA) & (prev_status != BusStatus.INTA)]
+
+        frame = np.zeros(len(chunk), dtype=np.int64)
+        if 'VS' in chunk.columns:
+            vs = chunk['VS'].to_numpy()
+            frame = self.frames + np.cumsum(edges(vs, self.prev_vs, rising=False))
+            self.frames = frame[-1].item()
+            self.prev_vs = vs[-1].item()
+
+        intr = np.empty(0, dtype=np.int64)
+        if 'INTR' in chunk.columns:
+            values = chunk['INTR'].to_numpy()
+            intr = np.flatnonzero(edges(values, self.prev_intr, rising=True))
+            self.prev_intr = values[-1].item()
+            self.intr_edges += len(intr)
+
+        for pos, index in ((inta, 0), (intr, 1)):
+            frames, counts = np.unique(frame[pos], return_counts=True)
+            for f, count in zip(frames.tolist(), counts.tolist()):
+                self.frame_interrupts.setdefault(f, [0, 0])[index] += count
+
+    def code_ranges(self):
+        """ Return [first address, last address, fetches] for each run of pages with code fetches. """
+        fetched = self.code_fetches > 0
+        bounds = np.flatnonzero(np.diff(np.concatenate(([False], fetched, [False]))))
+        return [[start << PAGE_BITS, (end << PAGE_BITS) - 1, self.code_fetches[start:end].sum().item()]
+                for start, end in zip(bounds[0::2].tolist(), bounds[1::2].tolist())]
+
+def summarize_sample(window, rows):
+    """ Summarize the decoded rows of a sample window. """
+    disasm = rows['DISASM'].dropna()
+    code = rows['AL'][rows['BUSL'] == 'CODE'].dropna()
+    counts = disasm.value_counts()
+    return {
+        'first': window.first,
+        'last': window.last,
+        'time': rows['Time(s)'].iloc[0].item(),
+        'instructions': len(disasm),
+        'code': [f'{int(code.min()):05X}', f'{int(code.max()):05X}'] if len(code) else None,
+        'top': [[inst, count] for inst, count in counts.head(TOP_INSTRUCTIONS).items()],
+    }
+
+def quick_look(input_csv, report_json, every=SAMPLE_INTERVAL, radius=SAMPLE_RADIUS, chunk_size=decode_stream.CHUNK_SIZE):
+    started = time.perf_counter()
+    counters = Counters()
+    cache = DisasmCache.load()
+    anomalies = Anomalies()
+    samples = []
+    sample_rows = {}
+
+    for window, rows in iter_windows(input_csv, SamplePlacer(every, radius), radius, chunk_size=chunk_size,
+                                     stages=stages_for(SAMPLE_COLUMNS), cache=cache, on_chunk=counters.add,
+                                     run_out=SAMPLE_RUN_OUT):
+        if rows is not None:
+            sample_rows.setdefault(window, []).append(rows)
+            continue
+        anomalies.merge(window.anomalies)
+        parts = sample_rows.pop(window, [])
+        if parts:
+            samples.append(summarize_sample(window, pd.concat(parts, ignore_index=True)))
+    cache.save()
+
+    report = {
+        'input': os.path.basename(input_csv),
+        'cycles': counters.cycles,
+        'seconds': counters.last_time - counters.first_time if counters.cycles else 0,
+        'bus_cycles': dict(zip(BUS_STATES, counters.bus_cycles.tolist())),
+        'code_ranges': [[f'{start:05X}', f'{end:05X}', fetches] for start, end, fetches in counters.code_ranges()],
+        'intr_edges': counters.intr_edges,
+        'frames': counters.frames,
+        'frames_with_interrupts': [{'frame': f, 'interrupts': inta, 'intr_edges': intr}
+                                   for f, (inta, intr) in sorted(counters.frame_interrupts.items())],
+        'samples': samples,
+        'anomalies': anomalies.summary(),
+    }
+    with open(report_json, 'w') as file:
+        json.dump(report, file, indent=2)
+        file.write('\n')
+
+    print_report(report)
+    print(f"Wrote report to {report_json} in {time.perf_counter() - started:.1f}s")
+    return report
+
+def print_report(report):
+    print(f"{report['cycles']} cycles, {report['seconds']:.3f}s, {report['frames']} frames")
+    print("Bus cycles: " + ', '.join(f'{name} {count}' for name, count in report['bus_cycles'].items() if count))
+    ranges = sorted(report['code_ranges'], key=lambda r: r[2], reverse=True)
+    print(f"Code fetched from {len(ranges)} ranges, busiest:")
+    for start, end, fetches in ranges[:10]:
+        print(f"  {start}-{end}: {fetches} fetches")
+    print(f"{report['intr_edges']} INTR edges, interrupts in {len(report['frames_with_interrupts'])} frames")
+    for sample in report['samples']:
+        top = ', '.join(inst for inst, _ in sample['top'])
+        code = '-'.join(sample['code']) if sample['code'] else 'no code fetches'
+        print(f"  cycle {sample['first']} ({sample['time']:.4f}s): {code}: {top}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize a cycle CSV from sampled windows and whole-capture counts.")
+    parser.add_argument('input_csv')
+    parser.add_argument('report_json')
+    parser.add_argument('--every', type=int, default=SAMPLE_INTERVAL, help="Number of cycles between samples.")
+    parser.add_argument('--window', type=int, default=SAMPLE_RADIUS,
+                        help="Number of cycles to decode on each side of a sample point.")
+    parser.add_argument('--chunk-size', type=int, default=decode_stream.CHUNK_SIZE,
+                        help="Number of cycles to read at a time.")
+    args = parser.parse_args()
+
+    quick_look(args.input_csv, args.report_json, args.every, args.window, args.chunk_size)
@@ -30,6 +30,8 @@
 import csv
 import sys
 
+from progress import Progress
+
 def insert_falling_edge(input_csv, offset, output_csv):
     with open(input_csv, 'r') as infile, open(output_csv, 'w', newline='') as outfile:
         reader = csv.DictReader(infile)
@@ -48,7 +50,9 @@ def insert_falling_edge(input_csv, offset, output_csv):
         writer = csv.DictWriter(outfile, fieldnames=fieldnames)
         writer.writeheader()
 
+        progress = Progress('Reclock', path=input_csv)
         for row in reader:
+            progress.update(1)
             # If 'CLK' column was missing, set its value to '1' for existing rows
             if add_clk_column:
                 row['CLK'] = '1'
@@ -60,6 +64,7 @@ def insert_falling_edge(input_csv, offset, output_csv):
             row['Time(s)'] = str(float(row['Time(s)']) + offset)
             row['CLK'] = '0'
             writer.writerow(row)
+        progress.finish()
 
 if __name__ == "__main__":
     if len(sys.argv) != 4:
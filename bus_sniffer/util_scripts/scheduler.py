@@ -0,0 +1,157 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   scheduler.py
+#
+#   Runs a set of tasks that depend on each other as soon as their
+#   dependencies are done, so independent tasks run concurrently. Tasks of
+#   kind 'thread' run on a thread pool, which suits numpy code that releases
+#   the GIL. Tasks of kind 'main' run in the calling thread while the thread
+#   tasks run alongside them. That suits a long pure Python pass, which holds
+#   the GIL anyway and, unlike in a worker process, needn't have its inputs and
+#   results pickled.
+#
+#   After a run, the critical path (the chain of dependent tasks that took the
+#   longest) can be reported, to show which tasks bound the wall-clock time.
+
+import os
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+class Task:
+    """ A unit of work. 'func' is called with a dict of the results of the
+    tasks named in 'after'.
+    """
+    def __init__(self, name, func, after=(), kind='thread'):
+        self.name = name
+        self.func = func
+        self.after = list(after)
+        self.kind = kind
+
+class Schedule:
+    """ The results and timings of a run. """
+    def __init__(self, tasks):
+        self.tasks = {task.name: task for task in tasks}
+        self.results = {}
+        self.times = {}
+        self.wall = 0.0
+
+    def duration(self, name):
+        start, end = self.times[name]
+        return end - start
+
+    def critical_path(self):
+        """ Return the names of the longest chain of dependent tasks, and its total duration. """
+        longest = {}
+        def chain(name):
+            if name not in longest:
+                best = ([], 0.0)
+                for dep in self.tasks[name].after:
+                    path, total = chain(dep)
+                    if total > best[1]:
+                        best = (path, total)
+                longest[name] = (best[0] + [name], best[1] + self.duration(name))
+            return longest[name]
+
+        return max((chain(name) for name in self.tasks), key=lambda item: item[1], default=([], 0.0))
+
+    def report(self):
+        path, total = self.critical_path()
+        steps = ' -> '.join(f"{name} ({self.duration(name):.2f}s)" for name in path)
+        print(f"Critical path: {steps} = {total:.2f}s of {self.wall:.2f}s wall time")
+
+def check_tasks(tasks):
+    names = {task.name for task in tasks}
+    for task in tasks:
+        for dep in task.after:
+            if dep not in names:
+                raise ValueError(f"Task {task.name} depends on unknown task {dep}")
+
+def cpu_count():
+    """ Return the number of CPUs this process may run on. """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def run_tasks(tasks, jobs=None, progress=None):
+    """ Run 'tasks' on up to 'jobs' threads (the CPU count by default). With
+    jobs=1 the tasks run one at a time in this thread.
+    Each finished task is reported to 'progress', if given. Returns a Schedule.
+    """
+    check_tasks(tasks)
+    jobs = jobs or cpu_count()
+    schedule = Schedule(tasks)
+    started = time.perf_counter()
+
+    if jobs == 1:
+        done = set()
+        while len(done) < len(tasks):
+            ready = [task for task in tasks if task.name not in done and all(dep in done for dep in task.after)]
+            if not ready:
+                raise ValueError("Task dependencies contain a cycle")
+            for task in ready:
+                start = time.perf_counter()
+                schedule.results[task.name] = task.func({dep: schedule.results[dep] for dep in task.after})
+                schedule.times[task.name] = (start, time.perf_counter())
+                done.add(task.name)
+                if progress is not None:
+                    progress.update(1, task.name)
+        schedule.wall = time.perf_counter() - started
+        return schedule
+
+    def finish(name, start, result):
+        schedule.results[name] = result
+        schedule.times[name] = (start, time.perf_counter())
+        if progress is not None:
+            progress.update(1, name)
+
+    with ThreadPoolExecutor(max_workers=jobs) as threads:
+        waiting = list(tasks)
+        running = {}
+        while waiting or running:
+            ready = [task for task in waiting if all(dep in schedule.results for dep in task.after)]
+            for task in ready:
+                waiting.remove(task)
+            # Start the thread tasks first, so they run alongside the main ones.
+            for task in ready:
+                if task.kind != 'main':
+                    inputs = {dep: schedule.results[dep] for dep in task.after}
+                    running[threads.submit(task.func, inputs)] = (task.name, time.perf_counter())
+            for task in ready:
+                if task.kind == 'main':
+                    start = time.perf_counter()
+                    finish(task.name, start, task.func({dep: schedule.results[dep] for dep in task.after}))
+
+            if any(task.kind == 'main' for task in ready):
+                # Collect what finished meanwhile, then look for newly ready tasks.
+                finished = [future for future in running if future.done()]
+            elif running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            else:
+                raise ValueError("Task dependencies contain a cycle")
+
+            for future in finished:
+                name, start = running.pop(future)
+                finish(name, start, future.result())
+
+    schedule.wall = time.perf_counter() - started
+    return schedule
@@ -0,0 +1,381 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   stage_cache.py
+#
+#   Content-addressed cache of pipeline stage outputs.
+#
+#   Each stage of the pipeline (decode.py, the marker window decode, the Excel
+#   workbook, the images, and the columns LazyTrace decodes on demand) stores
+#   its output files under a key: a hash of its input files' content, its
+#   parameters, the source of the scripts it runs, and the versions of pandas,
+#   iced_x86 and pyarrow. A stage's outputs are its output file, the files next
+#   to it named '<stem>.*', and any other side outputs it declares. When a
+#   stage runs again with the same inputs, parameters and code, its outputs are
+#   copied back instead of recomputed. After changing only excelify.py, for
+#   example, only the workbook is rebuilt.
+#
+#   Input files are hashed once and remembered by path, size and modification
+#   time. Outputs stored or restored are remembered the same way, so the next
+#   stage doesn't hash them again, and its entry records the entries that
+#   produced its inputs.
+#
+#   The cache lives in ~/.cache/marty_tools, or $MARTY_CACHE_DIR. When it grows
+#   past 10 GB ($MARTY_CACHE_MAX_GB), the least recently used entries are
+#   evicted. Each tool takes --no-cache to bypass it.
+#
+#   Command Line Arguments (to inspect or empty the cache):
+#   [--list] [--clear]
+
+import argparse
+import datetime
+import hashlib
+import importlib.metadata
+import json
+import os
+import shutil
+import sys
+import time
+import types
+
+import pandas as pd
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DIR = os.environ.get('MARTY_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'marty_tools')
+MAX_BYTES = int(float(os.environ.get('MARTY_CACHE_MAX_GB', 10)) * 1024 ** 3)
+
+# Version of the cache layout. Entries with another version are never matched.
+CACHE_FORMAT = 1
+
+BLOCK_SIZE = 4 * 1024 * 1024
+ENTRY_FILE = 'entry.json'
+FILE_INDEX = 'files.json'
+
+# Outputs older than the start of a stage by more than this aren't its own.
+MTIME_SLACK = 1.0
+
+def hash_file(path, copy_to=None):
+    """ Return the content hash of a file, copying it to 'copy_to' on the way if given. """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as src:
+        dst = open(copy_to, 'wb') if copy_to else None
+        try:
+            while True:
+                block = src.read(BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                if dst:
+                    dst.write(block)
+        finally:
+            if dst:
+                dst.close()
+    return digest.hexdigest()
+
+def file_identity(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def is_script(module):
+    path = getattr(module, '__file__', None)
+    return path is not None and os.path.abspath(path).startswith(SCRIPT_DIR + os.sep)
+
+def script_modules(roots):
+    """ Return the modules 'roots' run: the roots, and the modules from this
+    directory they refer to, transitively.
+    """
+    found = {}
+    stack = list(roots)
+    while stack:
+        module = stack.pop()
+        if module.__name__ in found:
+            continue
+        found[module.__name__] = module
+        for value in list(vars(module).values()):
+            if isinstance(value, types.ModuleType):
+                dep = value
+            else:
+                dep = sys.modules.get(getattr(value, '__module__', None) or '')
+            if dep is not None and dep.__name__ not in found and is_script(dep):
+                stack.append(dep)
+    return found
+
+def library_versions():
+    """ Return the versions of the libraries whose behavior shows in the outputs:
+    pandas, iced_x86 (the disassembly) and pyarrow (Parquet and Arrow files).
+    """
+    versions = [pd.__version__]
+    for name in ('iced_x86', 'pyarrow'):
+        try:
+            versions.append(importlib.metadata.version(name.replace('_', '-')))
+        except importlib.metadata.PackageNotFoundError:
+            versions.append(None)
+    return versions
+
+def code_version(roots):
+    """ Return a hash of the source of the modules 'roots' run, and the library versions. """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(repr(library_versions()).encode())
+    sources = sorted(os.path.abspath(module.__file__) for module in script_modules(roots).values()
+                     if getattr(module, '__file__', None))
+    for path in sources:
+        digest.update(os.path.relpath(path, SCRIPT_DIR).encode())
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+def output_files(output, since, inputs=(), side_outputs=()):
+    """ Return the files a stage wrote for 'output' as {tail: path}: the output
+    itself, the files next to it named '<stem>.*', and the side outputs the stage
+    declares as tails after the stem ('a.png' for '<stem>a.png'). Files named
+    after an input, such as its checkpoints, aren't outputs.
+    """
+    output = os.path.abspath(output)
+    directory, name = os.path.split(output)
+    stem = os.path.splitext(name)[0]
+    excluded = []
+    for path in map(os.path.abspath, inputs):
+        excluded.append(path)
+        if len(os.path.splitext(path)[0]) > len(os.path.splitext(output)[0]):
+            excluded.append(os.path.splitext(path)[0] + '.')
+
+    files = {}
+    for entry in os.scandir(directory):
+        if not entry.is_file() or not entry.name.startswith(stem):
+            continue
+        tail = entry.name[len(stem):]
+        if not (tail.startswith('.') or tail in side_outputs) or entry.stat().st_mtime < since - MTIME_SLACK:
+            continue
+        if entry.path == output or not any(entry.path.startswith(prefix) for prefix in excluded):
+            files[tail] = entry.path
+    return files
+
+class StageCache:
+    """ A directory of stage outputs, one subdirectory per key. """
+    def __init__(self, path=DEFAULT_DIR, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.index = None
+
+    def __bool__(self):
+        return True
+
+    def load_index(self):
+        if self.index is None:
+            self.index = {}
+            try:
+                with open(os.path.join(self.path, FILE_INDEX), 'r') as file:
+                    self.index = json.load(file)
+            except (OSError, ValueError):
+                pass
+        return self.index
+
+    def save_index(self):
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = os.path.join(self.path, f'{FILE_INDEX}.{os.getpid()}.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(self.index, file)
+        os.replace(temp_path, os.path.join(self.path, FILE_INDEX))
+
+    def remember(self, path, digest, producer=None):
+        """ Record the content hash of a file, and the entry that produced it. """
+        self.load_index()[os.path.abspath(path)] = {'identity': file_identity(path), 'hash': digest, 'producer': producer}
+        self.save_index()
+
+    def file_hash(self, path):
+        """ Return (hash, producer) of a file, hashing it only if it changed since last seen. """
+        known = self.load_index().get(os.path.abspath(path))
+        if known is not None and known['identity'] == file_identity(path):
+            return known['hash'], known['producer']
+        digest = hash_file(path)
+        self.remember(path, digest)
+        return digest, None
+
+    def key(self, stage, inputs, params, modules):
+        """ Return the key of a stage's outputs, and the entries that produced its inputs. """
+        hashes = []
+        deps = []
+        for path in inputs:
+            digest, producer = self.file_hash(path)
+            hashes.append(digest)
+            if producer is not None:
+                deps.append(producer)
+        record = {'format': CACHE_FORMAT, 'stage': stage, 'params': params, 'inputs': hashes,
+                  'code': code_version(modules)}
+        key = hashlib.blake2b(json.dumps(record, sort_keys=True, default=str).encode(), digest_size=20).hexdigest()
+        return key, deps
+
+    def entry(self, key):
+        """ Return the record of a cached entry, or None. """
+        try:
+            with open(os.path.join(self.path, key, ENTRY_FILE), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def entry_files(self, key):
+        """ Return the files of a cached entry as {tail: (path, hash)}, or None, marking it used. """
+        entry = self.entry(key)
+        if entry is None:
+            return None
+        os.utime(os.path.join(self.path, key, ENTRY_FILE))
+        return {output['tail']: (os.path.join(self.path, key, output['file']), entry['hashes'][output['tail']])
+                for output in entry['outputs']}
+
+    def restore(self, key, output):
+        """ Copy a cached entry's files to 'output' and the names next to it. Returns False if not cached. """
+        files = self.entry_files(key)
+        if files is None:
+            return False
+        base = os.path.splitext(output)[0]
+        for tail, (path, digest) in files.items():
+            shutil.copyfile(path, base + tail)
+            self.remember(base + tail, digest, key)
+        return True
+
+    def store(self, key, stage, files, deps=(), params=None):
+        """ Copy a stage's output files ({tail: path}) into a new entry, then evict
+        old entries if the cache is over its size limit.
+        """
+        size = sum(os.path.getsize(path) for path in files.values())
+        if size > self.max_bytes:
+            print(f"Not caching {stage} output: {size} bytes is over the cache limit")
+            return
+
+        temp_dir = os.path.join(self.path, f'{key}.{os.getpid()}.tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        outputs = []
+        hashes = {}
+        for i, (tail, path) in enumerate(sorted(files.items())):
+            name = f'out{i}'
+            hashes[tail] = hash_file(path, copy_to=os.path.join(temp_dir, name))
+            outputs.append({'tail': tail, 'file': name, 'size': os.path.getsize(path)})
+            self.remember(path, hashes[tail], key)
+
+        entry = {'stage': stage, 'params': params, 'deps': list(deps), 'outputs': outputs, 'hashes': hashes,
+                 'size': size, 'created': datetime.datetime.now().isoformat(timespec='seconds')}
+        with open(os.path.join(temp_dir, ENTRY_FILE), 'w') as file:
+            json.dump(entry, file, indent=2, default=str)
+
+        final_dir = os.path.join(self.path, key)
+        if os.path.exists(final_dir):
+            shutil.rmtree(temp_dir)
+        else:
+            os.replace(temp_dir, final_dir)
+        self.evict()
+
+    def entries(self):
+        """ Return (key, entry, last used) of every entry. """
+        found = []
+        if not os.path.isdir(self.path):
+            return found
+        for item in os.scandir(self.path):
+            if item.is_dir() and not item.name.endswith('.tmp'):
+                entry = self.entry(item.name)
+                if entry is not None:
+                    found.append((item.name, entry, os.path.getmtime(os.path.join(item.path, ENTRY_FILE))))
+        return found
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache fits its size limit. """
+        entries = sorted(self.entries(), key=lambda item: item[2])
+        total = sum(entry['size'] for _, entry, _ in entries)
+        for key, entry, _ in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            total -= entry['size']
+
+    def run(self, stage, output, func, inputs=(), params=None, modules=(), side_outputs=()):
+        """ Produce 'output', and the files written next to it, with func(), or
+        restore them from the cache. 'inputs' are the files the stage reads and
+        'modules' the modules it runs. 'side_outputs' are the tails of outputs not
+        named '<stem>.*' (see output_files()). Returns True if restored.
+        """
+        inputs = [path for path in inputs if path]
+        key, deps = self.key(stage, inputs, params, modules)
+        if self.restore(key, output):
+            print(f"Restored {stage} output {output} from the cache.")
+            return True
+        start = time.time()
+        func()
+        self.store(key, stage, output_files(output, start, inputs, side_outputs), deps, params)
+        return False
+
+    def frame(self, stage, func, inputs=(), params=None, modules=()):
+        """ Return the DataFrame func() builds, or its cached copy. """
+        key, deps = self.key(stage, list(inputs), params, modules)
+        files = self.entry_files(key)
+        if files is not None:
+            return pd.read_pickle(files['.pkl'][0])
+        df = func()
+        os.makedirs(self.path, exist_ok=True)
+        temp_path = os.path.join(self.path, f'{key}.{os.getpid()}.pkl')
+        df.to_pickle(temp_path)
+        try:
+            self.store(key, stage, {'.pkl': temp_path}, deps, params)
+        finally:
+            os.remove(temp_path)
+            self.index.pop(os.path.abspath(temp_path), None)
+            self.save_index()
+        return df
+
+class NullCache:
+    """ A cache that stores nothing, for --no-cache. """
+    def __bool__(self):
+        return False
+
+    def run(self, stage, output, func, inputs=(), params=None, modules=(), side_outputs=()):
+        func()
+        return False
+
+    def frame(self, stage, func, inputs=(), params=None, modules=()):
+        return func()
+
+NO_CACHE = NullCache()
+
+def open_cache(enabled=True):
+    """ Return the stage cache, or NO_CACHE if it's disabled. """
+    return StageCache() if enabled else NO_CACHE
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Inspect or empty the stage cache in {DEFAULT_DIR}.")
+    parser.add_argument('--list', action='store_true', help="List the cached entries, least recently used first")
+    parser.add_argument('--clear', action='store_true', help="Remove every cached entry")
+    args = parser.parse_args()
+
+    cache = StageCache()
+    entries = sorted(cache.entries(), key=lambda item: item[2])
+    if args.clear:
+        shutil.rmtree(cache.path, ignore_errors=True)
+        print(f"Removed {len(entries)} entries from {cache.path}")
+        return
+
+    total = sum(entry['size'] for _, entry, _ in entries)
+    if args.list:
+        for key, entry, used in entries:
+            last_used = datetime.datetime.fromtimestamp(used).isoformat(timespec='seconds')
+            deps = f" from {', '.join(dep[:10] for dep in entry['deps'])}" if entry['deps'] else ''
+            print(f"{key[:10]}  {entry['stage']:<16}{entry['size'] / 1024 ** 2:>10.1f} MB  used {last_used}{deps}")
+    print(f"{len(entries)} entries, {total / 1024 ** 3:.2f} of {cache.max_bytes / 1024 ** 3:.2f} GB in {cache.path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   stages.py
+#
+#   Registry of the decoder's stages and the columns they produce.
+#
+#   Each stage declares the input columns it reads, the decoded columns it
+#   writes and the stages it depends on. A caller that only needs a few
+#   decoded columns asks for them by name, and only the stages that produce
+#   them (and their dependencies) are run. For example, the raster image only
+#   needs AL, BUSL, D and QOP, so the prefetch queue, instruction fetch and
+#   disassembly stages are skipped.
+#
+#   A stage's kind says how it runs: 'array' stages are vectorized numpy code,
+#   and 'python' stages are per-cycle Python loops. The python stages all share
+#   the bus core's single pass over the trace, so they run together.
+
+from bus_core.arrays import ADDRESS_COLS
+
+class Stage:
+    def __init__(self, name, inputs, outputs, after=(), kind='array'):
+        self.name = name
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.kind = kind
+
+STAGES = [
+    Stage('address', ADDRESS_COLS, ['ADDR']),
+    Stage('timing', ['Time(s)', 'CLK'], ['ns_d', 'CLK_change', 'd_accum']),
+    Stage('raster', ['HS', 'VS'], ['FRAME', 'R_X', 'R_Y']),
+    Stage('status', ['S0', 'S1', 'S2', 'QS0', 'QS1'], ['B', 'BUS', 'QOP']),
+    Stage('bus', ADDRESS_COLS + ['READY'], ['ALE', 'AL', 'SEG', 'BUSL', 'T', 'D'], after=['status'], kind='python'),
+    Stage('queue', [], ['QL', 'Q0', 'Q1', 'Q2', 'Q3', 'QB'], after=['bus'], kind='python'),
+    Stage('fetch', [], ['IS', 'INST', 'INSTF', 'IDX'], after=['queue'], kind='python'),
+    Stage('disasm', [], ['DISASM'], after=['fetch'], kind='python'),
+]
+
+STAGES_BY_NAME = {stage.name: stage for stage in STAGES}
+ALL_STAGES = frozenset(STAGES_BY_NAME)
+
+# Cycle index, present in every decode.
+INDEX_COLUMN = 'N'
+
+def producer(column):
+    """ Return the stage that produces a decoded column, or None for input columns. """
+    for stage in STAGES:
+        if column in stage.outputs:
+            return stage
+    return None
+
+def stages_for(columns):
+    """ Return the names of the stages needed to produce 'columns'. Columns no
+    stage produces are assumed to be input columns.
+    """
+    return with_dependencies(stage.name for stage in map(producer, columns) if stage is not None)
+
+def with_dependencies(names):
+    """ Return the stages 'names' and every stage they depend on. """
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES_BY_NAME[name].after)
+    return frozenset(needed)
+
+def stage_outputs(stages):
+    """ Return the decoded columns produced by a set of stages. """
+    columns = [INDEX_COLUMN]
+    for stage in STAGES:
+        if stage.name in stages:
+            columns.extend(stage.outputs)
+    return columns
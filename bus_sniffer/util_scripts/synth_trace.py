@@ -0,0 +1,694 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   synth_trace.py
+#
+#   Generate a synthetic cycle trace from a scripted instruction stream.
+#
+#   Real captures are many GB and can't be shared, so the decoders are
+#   benchmarked and checked on traces generated here (see bench.py). A small
+#   model of the 8088 runs a script of instructions, cycle by cycle:
+#
+#   - Code bytes are prefetched into the 4 byte queue by CODE bus cycles while
+#     the bus is free, and read from it one per cycle (QS F and S).
+#   - Each bus cycle runs T1-T4, with status going passive once READY is high.
+#     I/O and CGA memory (B8000-BFFFF) add wait states, as does a DMA refresh
+#     (DR0) every 72 cycles.
+#   - Jumps wait for any code fetch to finish, then flush the queue (QS E).
+#   - INTR is raised once a frame at the start of VSYNC and acknowledged at the
+#     next instruction boundary with two INTA cycles, the vector fetch and the
+#     flags, CS and IP pushes. HLT waits for it with a HALT bus cycle.
+#   - HSYNC and VSYNC follow CGA raster timing, and CLK0 is the PIT clock.
+#
+#   The output is a cycle CSV like export_cycles.py produces. Give it a .sr
+#   extension to write a sigrok session as PulseView saves it, with two samples
+#   per clock, or pass --marty for a MartyPC cycle log for decode_marty2.py.
+#
+#   A script has one instruction per line: its bytes in hex, then what it does.
+#   Numbers are hex, except cycle counts and jump counts.
+#
+#       regs DS=2000 ES=B800 SS=0030 SP=0100    ; segment registers and SP
+#       org 1000:0100                           ; CS:IP of what follows
+#   loop:
+#       AC       cycles=8 read=DS:0000+1        ; lodsb
+#       E2 FD    cycles=13 jump=loop*63         ; loop loop
+#
+#   cycles=N      internal cycles after the instruction's bytes are read
+#   read=SEG:OFF  write=SEG:OFF  readw=  writew=
+#                 memory accesses (a byte, or a word as two bytes). +N after
+#                 the offset advances it by N on each execution.
+#   in=PORT  out=PORT  inw=  outw=
+#                 I/O accesses
+#   jump=LABEL    flush the queue and continue at LABEL. jump=LABEL*N is taken
+#                 N times, then falls through once.
+#   halt          wait for an interrupt (HLT)
+#   iret          return from the interrupt handler, which is at label 'irq:'
+#
+#   Execution continues at the first instruction after the last one, or after
+#   an 'org' gap.
+#
+#   Command Line Arguments:
+#   output [--cycles N] [--script FILE] [--seed N] [--irq-every N] [--marty]
+
+import argparse
+import random
+import re
+import zipfile
+from array import array
+from collections import deque
+
+import numpy as np
+
+from progress import Progress
+from bus_core.states import BusStatus, QueueOp, Segment, INSTR_PREFIXES, QUEUE_SIZE, SEG_STATES
+
+CYCLES = 1000000
+SEED = 5150
+
+# Each cycle is 210 ns, as sampled by the capture hardware.
+CYCLE_NS = 210
+
+# CGA raster timing, in CPU cycles (3 hdots each) and scanlines.
+LINE_CYCLES = 304
+FRAME_LINES = 262
+FRAME_CYCLES = LINE_CYCLES * FRAME_LINES
+HSYNC_START = 240
+HSYNC_CYCLES = 27
+VSYNC_LINE = 224
+VSYNC_LINES = 16
+
+# DMA channel 0 refreshes DRAM every 72 cycles, holding the bus for 8.
+REFRESH_PERIOD = 72
+REFRESH_CYCLES = 8
+
+# Wait states added to I/O cycles and CGA memory cycles.
+IO_WAITS = 1
+CGA_WAITS = (3, 8)
+CGA_MEMORY = (0xB8000, 0xC0000)
+
+# Interrupt acknowledge timing, and the vector and flags used.
+INTA_DELAY = 3
+INTA_GAP = 3
+INTERRUPT_CYCLES = 10
+VECTOR = 8
+FLAGS = 0x0202
+HANDLER = 'irq'
+
+# Bytes read from memory that isn't part of the program.
+NOP = 0x90
+
+# Rows rendered at once when writing a trace.
+BLOCK_ROWS = 250000
+
+# Columns of a cycle CSV, and the probes of a sigrok session, in order.
+COLUMNS = ([f'AD{i}' for i in range(8)] + [f'A{i}' for i in range(8, 20)] +
+           ['CLK', 'READY', 'QS0', 'QS1', 'S0', 'S1', 'S2', 'DEN', 'CLK0', 'INTR', 'DR0', 'VS', 'HS'])
+MARTY_COLUMNS = ['CLK', 'ADDR', 'S', 'QS', 'READY', 'DEN', 'INTR', 'VS', 'HS']
+UNIT_SIZE = (len(COLUMNS) + 7) // 8
+
+DEFAULT_SCRIPT = """
+; Copies a buffer to CGA memory in a loop, then waits for the next frame's
+; interrupt.
+regs DS=2000 ES=B800 SS=0030 SP=0100
+org 1000:0100
+start:
+    FC              cycles=2                        ; cld
+    BE 00 00        cycles=4                        ; mov si,0000h
+    BF 00 00        cycles=4                        ; mov di,0000h
+    B9 00 01        cycles=4                        ; mov cx,0100h
+copy:
+    AC              cycles=8 read=DS:0000+1         ; lodsb
+    AA              cycles=7 write=ES:0000+1        ; stosb
+    8B 04           cycles=8 readw=DS:0100+2        ; mov ax,[si]
+    26 89 05        cycles=9 writew=ES:1000+2       ; mov es:[di],ax
+    E4 60           cycles=6 in=60                  ; in al,60h
+    50              cycles=7 writew=SS:00FE         ; push ax
+    58              cycles=8 readw=SS:00FE          ; pop ax
+    F7 E3           cycles=118                      ; mul bx
+    E2 F1           cycles=13 jump=copy*255         ; loop copy
+    F4              halt                            ; hlt
+    EB E4           cycles=11 jump=start            ; jmp short start
+org 1000:0200
+irq:
+    50              cycles=7 writew=SS:00F8         ; push ax
+    B0 20           cycles=4                        ; mov al,20h
+    E6 20           cycles=6 out=20                 ; out 20h,al
+    58              cycles=8 readw=SS:00F8          ; pop ax
+    CF              cycles=24 iret                  ; iret
+"""
+
+OP_TYPES = {
+    'read': (BusStatus.MEMR, 1), 'readw': (BusStatus.MEMR, 2),
+    'write': (BusStatus.MEMW, 1), 'writew': (BusStatus.MEMW, 2),
+    'in': (BusStatus.IOR, 1), 'inw': (BusStatus.IOR, 2),
+    'out': (BusStatus.IOW, 1), 'outw': (BusStatus.IOW, 2),
+}
+
+MEMORY_OP = re.compile(r'(ES|SS|CS|DS):([0-9A-Fa-f]+)(?:\+([0-9A-Fa-f]+))?$')
+
+class Op:
+    """ A memory or I/O access made by an instruction. """
+    def __init__(self, bus, size, seg=None, offset=0, stride=0):
+        self.bus = bus
+        self.size = size
+        self.seg = seg
+        self.offset = offset
+        self.stride = stride
+
+    def addresses(self, regs, k):
+        """ Return the addresses accessed on the k'th execution. """
+        if self.seg is None:
+            return [(self.offset + i) & 0xFFFF for i in range(self.size)]
+        offset = self.offset + self.stride * k
+        base = regs[SEG_STATES[self.seg]] << 4
+        return [(base + ((offset + i) & 0xFFFF)) & 0xFFFFF for i in range(self.size)]
+
+class Instr:
+    def __init__(self, cs, ip, code):
+        self.cs = cs
+        self.ip = ip
+        self.code = code
+        self.cycles = 0
+        self.ops = []
+        self.jump = None
+        self.taken = 0
+        self.halt = False
+        self.iret = False
+
+    @property
+    def addr(self):
+        return ((self.cs << 4) + self.ip) & 0xFFFFF
+
+class Program:
+    """ A parsed script: its instructions, labels, registers and memory. """
+    def __init__(self):
+        self.instrs = []
+        self.labels = {}
+        self.regs = {'ES': 0, 'SS': 0, 'CS': 0, 'DS': 0, 'SP': 0}
+        self.memory = {}
+
+    @classmethod
+    def parse(cls, text):
+        program = cls()
+        cs, ip = 0, 0
+        jumps = []
+        for line_num, line in enumerate(text.splitlines(), 1):
+            line = line.split(';', 1)[0].strip()
+            label = re.match(r'(\w+):(\s|$)', line)
+            if label:
+                program.labels[label.group(1)] = len(program.instrs)
+                line = line[label.end():].strip()
+            if not line:
+                continue
+
+            tokens = line.split()
+            try:
+                if tokens[0] == 'regs':
+                    for token in tokens[1:]:
+                        name, value = token.split('=')
+                        if name not in program.regs:
+                            raise ValueError(f"unknown register '{name}'")
+                        program.regs[name] = int(value, 16)
+                    continue
+                if tokens[0] == 'org':
+                    cs, ip = (int(value, 16) for value in tokens[1].split(':'))
+                    continue
+
+                code = [int(token, 16) for token in tokens if re.fullmatch(r'[0-9A-Fa-f]{2}', token)]
+                instr = Instr(cs, ip, code)
+                for token in tokens[len(code):]:
+                    name, _, value = token.partition('=')
+                    if name == 'cycles':
+                        instr.cycles = int(value)
+                    elif name in OP_TYPES:
+                        bus, size = OP_TYPES[name]
+                        if bus in (BusStatus.IOR, BusStatus.IOW):
+                            instr.ops.append(Op(bus, size, offset=int(value, 16)))
+                        else:
+                            match = MEMORY_OP.match(value)
+                            if not match:
+                                raise ValueError(f"expected SEG:OFFSET, got '{value}'")
+                            seg, offset, stride = match.groups()
+                            instr.ops.append(Op(bus, size, getattr(Segment, seg), int(offset, 16), int(stride or '0', 16)))
+                    elif name == 'jump':
+                        target, _, taken = value.partition('*')
+                        jumps.append((line_num, instr, target))
+                        instr.taken = int(taken) if taken else 0
+                    elif name == 'halt':
+                        instr.halt = True
+                    elif name == 'iret':
+                        instr.iret = True
+                    else:
+                        raise ValueError(f"unknown operation '{token}'")
+            except (ValueError, IndexError) as e:
+                raise ValueError(f"script line {line_num}: {e}")
+            if not code:
+                raise ValueError(f"script line {line_num}: no instruction bytes")
+
+            for i, byte in enumerate(code):
+                program.memory[((cs << 4) + ((ip + i) & 0xFFFF)) & 0xFFFFF] = byte
+            ip = (ip + len(code)) & 0xFFFF
+            program.instrs.append(instr)
+
+        for line_num, instr, target in jumps:
+            if target not in program.labels:
+                raise ValueError(f"script line {line_num}: unknown label '{target}'")
+            instr.jump = program.labels[target]
+        if not program.instrs:
+            raise ValueError("script has no instructions")
+        return program
+
+    def following(self, index):
+        """ Return the index of the instruction after 'index', and whether it
+        directly follows it in memory.
+        """
+        instr = self.instrs[index]
+        following = (index + 1) % len(self.instrs)
+        next_instr = self.instrs[following]
+        return following, next_instr.cs == instr.cs and next_instr.ip == (instr.ip + len(instr.code)) & 0xFFFF
+
+class BusCycle:
+    """ The rows of one bus cycle, as (bus, status, ready, den) tuples. """
+    def __init__(self, rows, latch, data, code=False, requested=False):
+        self.rows = rows
+        self.latch = latch
+        self.data = data
+        self.code = code
+        self.requested = requested
+        self.pos = 0
+
+def refreshing(n):
+    """ Return True if DMA refresh holds the bus on cycle 'n'. """
+    return n % REFRESH_PERIOD < REFRESH_CYCLES
+
+class Cpu:
+    """ Runs a Program cycle by cycle, recording the bus signals of each cycle. """
+    def __init__(self, program, seed=SEED, irq_every=FRAME_CYCLES, vector=VECTOR):
+        self.program = program
+        self.rng = random.Random(seed)
+        self.memory = dict(program.memory)
+        self.executions = [0] * len(program.instrs)
+
+        self.irq_every = irq_every if HANDLER in program.labels else 0
+        if any(instr.halt for instr in program.instrs) and not self.irq_every:
+            raise ValueError(f"The script halts, but has no '{HANDLER}' handler or interrupts are disabled")
+        # Interrupts are raised at the start of VSYNC.
+        self.irq_phase = (VSYNC_LINE * LINE_CYCLES + HSYNC_START) % self.irq_every if self.irq_every else 0
+        self.vector = vector
+        if self.irq_every:
+            handler = program.instrs[program.labels[HANDLER]]
+            for i, byte in enumerate([handler.ip & 0xFF, handler.ip >> 8, handler.cs & 0xFF, handler.cs >> 8]):
+                self.memory[vector * 4 + i] = byte
+
+        self.queue = deque()
+        self.fetch_cs = 0
+        self.fetch_ip = 0
+        self.prefetch = False
+        self.bus = None
+        self.request = None
+        self.request_done = False
+        self.bus_value = 0
+        self.intr = False
+        self.masked = False
+        self.return_index = 0
+        self.sp = program.regs['SP']
+        self.interrupts = 0
+
+    def run(self, cycles, progress=True):
+        """ Run for 'cycles' cycles and return the Trace. """
+        progress = Progress('Generate', cycles, unit='cycles') if progress else None
+        bus_values = array('I')
+        status = bytearray()
+        qs = bytearray()
+        ready = bytearray()
+        den = bytearray()
+        intr = bytearray()
+
+        eu = self.execute()
+        for n in range(cycles):
+            if self.irq_every and n % self.irq_every == self.irq_phase:
+                self.intr = True
+            # The queue status of a cycle is what the queue did on the previous one.
+            qs.append(next(eu))
+            value, b, r, d = self.bus_step(n)
+            bus_values.append(value)
+            status.append(b)
+            ready.append(r)
+            den.append(d)
+            intr.append(self.intr)
+
+            if progress and n % 10000 == 0:
+                progress.set(n)
+        if progress:
+            progress.set(cycles)
+            progress.finish()
+
+        return Trace(np.frombuffer(bus_values, dtype=np.uint32), *(np.frombuffer(column, dtype=np.uint8)
+                                                                     for column in (status, qs, ready, den, intr)))
+
+    def bus_cycle(self, n, b, seg, addr, data, code=False):
+        """ Return the BusCycle of a bus cycle starting on cycle 'n'. """
+        waits = 0
+        if b in (BusStatus.IOR, BusStatus.IOW):
+            waits = IO_WAITS
+        elif CGA_MEMORY[0] <= addr < CGA_MEMORY[1] and b in (BusStatus.MEMR, BusStatus.MEMW):
+            waits = self.rng.randint(*CGA_WAITS)
+        phase = (n + 1) % REFRESH_PERIOD
+        if phase < REFRESH_CYCLES:
+            waits += REFRESH_CYCLES - phase
+
+        # S3-S4 (the segment) and S5 (the interrupt flag) are on A16-A18 after T1.
+        high = (addr & 0xFFFF) | ((seg | 4) << 16)
+        data_bus = (high & ~0xFF) | data
+        rows = [(addr, b, 1, 0), (high, b, 0 if waits else 1, 1)]
+        for r in [0] * waits + [1, 1]:
+            rows.append((data_bus, b if r == 0 else BusStatus.PASV, r, 1))
+        # Data is valid on T3, or on T4 after wait states.
+        return BusCycle(rows, 2 if waits == 0 else len(rows) - 1, data, code)
+
+    def bus_step(self, n):
+        """ Return the bus signals of cycle 'n': (bus, status, ready, den). """
+        bus = self.bus
+        if bus is None:
+            if self.request is not None:
+                b, seg, addr, data = self.request
+                self.request = None
+                if b == BusStatus.HALT:
+                    bus = BusCycle([(self.bus_value, b, 1, 0)] + [(self.bus_value, BusStatus.PASV, 1, 0)] * 3, None, 0)
+                else:
+                    bus = self.bus_cycle(n, b, seg, addr, data)
+                bus.requested = True
+            elif self.prefetch and len(self.queue) < QUEUE_SIZE:
+                addr = ((self.fetch_cs << 4) + self.fetch_ip) & 0xFFFFF
+                bus = self.bus_cycle(n, BusStatus.CODE, Segment.CS, addr, self.memory.get(addr, NOP), code=True)
+                self.fetch_ip = (self.fetch_ip + 1) & 0xFFFF
+            else:
+                return self.bus_value, BusStatus.PASV, 1, 0
+            self.bus = bus
+
+        row = bus.rows[bus.pos]
+        if bus.code and bus.pos == bus.latch:
+            self.queue.append(bus.data)
+        bus.pos += 1
+        if bus.pos == len(bus.rows):
+            self.bus = None
+            if bus.requested:
+                self.request_done = True
+        self.bus_value = row[0]
+        return row
+
+    def access(self, b, seg, addr, data=None):
+        """ Run a bus cycle for the EU, yielding until it completes. """
+        if data is None:
+            if b == BusStatus.MEMR:
+                data = self.memory.get(addr)
+            if data is None:
+                data = self.rng.randrange(256)
+        if b == BusStatus.MEMW:
+            self.memory[addr] = data
+        self.request = (b, seg, addr, data)
+        self.request_done = False
+        while not self.request_done:
+            yield QueueOp.Idle
+
+    def flush(self, instr):
+        """ Flush the queue and start fetching at 'instr'. """
+        self.prefetch = False
+        while self.bus is not None and self.bus.code:
+            yield QueueOp.Idle
+        self.queue.clear()
+        self.fetch_cs, self.fetch_ip = instr.cs, instr.ip
+        self.prefetch = True
+        yield QueueOp.Empty
+
+    def stack(self, b, words):
+        """ Push or pop words on the stack, yielding until done. """
+        ss = self.program.regs['SS'] << 4
+        for word in words:
+            if b == BusStatus.MEMW:
+                self.sp = (self.sp - 2) & 0xFFFF
+            for i, byte in enumerate([word & 0xFF, word >> 8]):
+                yield from self.access(b, Segment.SS, (ss + ((self.sp + i) & 0xFFFF)) & 0xFFFFF,
+                                       byte if b == BusStatus.MEMW else None)
+            if b == BusStatus.MEMR:
+                self.sp = (self.sp + 2) & 0xFFFF
+
+    def interrupt(self, return_index):
+        """ Acknowledge INTR and enter the handler. """
+        self.masked = True
+        self.interrupts += 1
+        for _ in range(INTA_DELAY):
+            yield QueueOp.Idle
+        yield from self.access(BusStatus.INTA, Segment.ES, 0, 0xFF)
+        for _ in range(INTA_GAP):
+            yield QueueOp.Idle
+        yield from self.access(BusStatus.INTA, Segment.ES, 0, self.vector)
+        self.intr = False
+        for _ in range(INTERRUPT_CYCLES):
+            yield QueueOp.Idle
+        for i in range(4):
+            yield from self.access(BusStatus.MEMR, Segment.ES, self.vector * 4 + i)
+
+        ret = self.program.instrs[return_index]
+        yield from self.stack(BusStatus.MEMW, [FLAGS, ret.cs, ret.ip])
+        self.return_index = return_index
+        yield from self.flush(self.program.instrs[self.program.labels[HANDLER]])
+
+    def execute(self):
+        """ Yield the queue status of each cycle as the program runs. """
+        program = self.program
+        yield QueueOp.Idle
+        yield from self.flush(program.instrs[0])
+        index = 0
+        while True:
+            if self.intr and not self.masked:
+                yield from self.interrupt(index)
+                index = program.labels[HANDLER]
+                continue
+
+            instr = program.instrs[index]
+            k = self.executions[index]
+            self.executions[index] += 1
+
+            # Prefixes are read as the first byte of an instruction, like the
+            # byte after them.
+            first = True
+            for byte in instr.code:
+                while not self.queue:
+                    yield QueueOp.Idle
+                self.queue.popleft()
+                yield QueueOp.First if first else QueueOp.Subs
+                first = first and byte in INSTR_PREFIXES
+
+            for _ in range(instr.cycles):
+                yield QueueOp.Idle
+            for op in instr.ops:
+                for addr in op.addresses(program.regs, k):
+                    yield from self.access(op.bus, op.seg if op.seg is not None else Segment.DS, addr)
+
+            if instr.iret:
+                yield from self.stack(BusStatus.MEMR, [0, 0, 0])
+                index = self.return_index
+                self.masked = False
+                yield from self.flush(program.instrs[index])
+                continue
+
+            if instr.halt:
+                yield from self.access(BusStatus.HALT, Segment.CS, 0)
+                while not self.intr:
+                    yield QueueOp.Idle
+
+            following, contiguous = program.following(index)
+            if instr.jump is not None and (not instr.taken or k % (instr.taken + 1) < instr.taken):
+                index = instr.jump
+                yield from self.flush(program.instrs[index])
+            else:
+                index = following
+                if not contiguous:
+                    yield from self.flush(program.instrs[index])
+
+class Trace:
+    """ The bus signals of a generated trace, one array element per cycle. """
+    def __init__(self, bus, status, qs, ready, den, intr):
+        self.bus = bus
+        self.status = status
+        self.qs = qs
+        self.ready = ready
+        self.den = den
+        self.intr = intr
+
+    def __len__(self):
+        return len(self.bus)
+
+    def columns(self, start, stop):
+        """ Return the cycle CSV columns of cycles 'start' to 'stop' as a dict of arrays. """
+        n = np.arange(start, stop)
+        bus = self.bus[start:stop]
+        columns = {name: (bus >> i) & 1 for i, name in enumerate(COLUMNS[:20])}
+        status = self.status[start:stop]
+        qs = self.qs[start:stop]
+        line_pos = n % LINE_CYCLES
+        line = (n // LINE_CYCLES) % FRAME_LINES
+        columns.update({
+            'CLK': np.ones(len(n), dtype=np.uint8),
+            'READY': self.ready[start:stop],
+            'QS0': qs & 1, 'QS1': qs >> 1,
+            'S0': status & 1, 'S1': (status >> 1) & 1, 'S2': status >> 2,
+            'DEN': self.den[start:stop],
+            'CLK0': (n >> 1) & 1,
+            'INTR': self.intr[start:stop],
+            'DR0': refreshing(n),
+            'VS': (line >= VSYNC_LINE) & (line < VSYNC_LINE + VSYNC_LINES),
+            'HS': (line_pos >= HSYNC_START) & (line_pos < HSYNC_START + HSYNC_CYCLES),
+        })
+        return columns
+
+DIGITS = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+
+def digits(values, width, base=10):
+    """ Return the text of 'values' as a (rows, width) array of ASCII codes. """
+    values = np.asarray(values, dtype=np.int64)
+    text = np.empty((len(values), width), dtype=np.uint8)
+    for i in range(width - 1, -1, -1):
+        text[:, i] = DIGITS[values % base]
+        values = values // base
+    return text
+
+def char_column(char, rows):
+    return np.full((rows, 1), ord(char), dtype=np.uint8)
+
+def time_text(ns, width):
+    """ Return times in nanoseconds as seconds with 9 decimals, padded to 'width' integer digits. """
+    return np.hstack([digits(ns // 1000000000, width), char_column('.', len(ns)), digits(ns % 1000000000, 9)])
+
+def csv_block(fields):
+    """ Join (rows, width) text arrays into CSV lines. """
+    rows = len(fields[0])
+    parts = []
+    for field in fields:
+        parts += [field, char_column(',', rows)]
+    parts[-1] = char_column('\n', rows)
+    return np.hstack(parts).tobytes()
+
+def seconds_width(ns):
+    return len(str(int(ns) // 1000000000))
+
+def write_csv(trace, path):
+    """ Write a cycle CSV, with the columns export_cycles.py produces. """
+    width = seconds_width(len(trace) * CYCLE_NS)
+    with open(path, 'wb') as file:
+        file.write((','.join(['Time(s)'] + COLUMNS) + '\n').encode())
+        for start in range(0, len(trace), BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, len(trace))
+            columns = trace.columns(start, stop)
+            ns = np.arange(start, stop, dtype=np.int64) * CYCLE_NS
+            file.write(csv_block([time_text(ns, width)] + [digits(columns[name], 1) for name in COLUMNS]))
+
+def write_marty(trace, path):
+    """ Write a MartyPC cycle log, with a row for each clock edge, for decode_marty2.py. """
+    width = seconds_width(len(trace) * CYCLE_NS)
+    with open(path, 'wb') as file:
+        file.write((','.join(['Time(s)'] + MARTY_COLUMNS) + '\n').encode())
+        for start in range(0, len(trace), BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, len(trace))
+            columns = trace.columns(start, stop)
+            columns['ADDR'] = trace.bus[start:stop]
+            columns['S'] = trace.status[start:stop]
+            columns['QS'] = trace.qs[start:stop]
+            fields = {name: digits(columns[name], 5 if name == 'ADDR' else 1, 16 if name == 'ADDR' else 10)
+                      for name in MARTY_COLUMNS}
+
+            # Each cycle's rising edge, then its falling edge half a cycle later.
+            ns = np.arange(start, stop, dtype=np.int64) * CYCLE_NS
+            rising = csv_block([time_text(ns, width)] + [fields[name] for name in MARTY_COLUMNS])
+            fields['CLK'] = digits(np.zeros(stop - start), 1)
+            falling = csv_block([time_text(ns + CYCLE_NS // 2, width)] + [fields[name] for name in MARTY_COLUMNS])
+            line = len(rising) // (stop - start)
+            lines = np.empty((stop - start, 2, line), dtype=np.uint8)
+            lines[:, 0] = np.frombuffer(rising, dtype=np.uint8).reshape(-1, line)
+            lines[:, 1] = np.frombuffer(falling, dtype=np.uint8).reshape(-1, line)
+            file.write(lines.tobytes())
+
+def sr_metadata():
+    samplerate = 2 * 1e9 / CYCLE_NS
+    lines = ['[global]', 'sigrok version=0.5.2', '', '[device 1]', 'capturefile=logic-1',
+             f'total probes={len(COLUMNS)}', f'samplerate={samplerate / 1e6:g} MHz', 'total analog=0']
+    lines += [f'probe{i + 1}={name}' for i, name in enumerate(COLUMNS)]
+    lines.append(f'unitsize={UNIT_SIZE}')
+    return '\n'.join(lines) + '\n'
+
+def write_sr(trace, path):
+    """ Write a sigrok session with two samples per clock, CLK low then high. """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as session:
+        session.writestr('version', '2')
+        session.writestr('metadata', sr_metadata())
+        for chunk, start in enumerate(range(0, len(trace), BLOCK_ROWS), 1):
+            stop = min(start + BLOCK_ROWS, len(trace))
+            columns = trace.columns(start, stop)
+            words = np.zeros(stop - start, dtype='<u8')
+            for bit, name in enumerate(COLUMNS):
+                words |= columns[name].astype('<u8') << np.uint64(bit)
+
+            clk = np.uint64(1 << COLUMNS.index('CLK'))
+            samples = np.empty(2 * (stop - start), dtype='<u8')
+            samples[0::2] = words & ~clk
+            samples[1::2] = words
+            data = samples.view(np.uint8).reshape(-1, 8)[:, :UNIT_SIZE]
+            session.writestr(f'logic-1-{chunk}', data.tobytes())
+
+def generate(cycles=CYCLES, script=DEFAULT_SCRIPT, seed=SEED, irq_every=FRAME_CYCLES, progress=True):
+    """ Run 'script' for 'cycles' cycles and return the Trace. """
+    cpu = Cpu(Program.parse(script), seed, irq_every)
+    trace = cpu.run(cycles, progress)
+    trace.interrupts = cpu.interrupts
+    return trace
+
+def write_trace(trace, path, marty=False):
+    """ Write a trace as a cycle CSV, a sigrok session (.sr) or a MartyPC log. """
+    if marty:
+        write_marty(trace, path)
+    elif path.lower().endswith('.sr'):
+        write_sr(trace, path)
+    else:
+        write_csv(trace, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic 8088 cycle trace from a scripted instruction stream.")
+    parser.add_argument('output', help="Output cycle CSV, or sigrok session if it ends in .sr")
+    parser.add_argument('--cycles', type=int, default=CYCLES, help=f"Number of cycles to generate (default {CYCLES})")
+    parser.add_argument('--script', default=None, help="Instruction script to run (default: a built-in CGA copy loop)")
+    parser.add_argument('--seed', type=int, default=SEED, help="Seed for wait states and data values")
+    parser.add_argument('--irq-every', type=int, default=FRAME_CYCLES,
+                        help=f"Cycles between interrupts, 0 for none (default {FRAME_CYCLES}, once a frame)")
+    parser.add_argument('--marty', action='store_true', help="Write a MartyPC cycle log for decode_marty2.py")
+    args = parser.parse_args()
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, 'r') as file:
+            script = file.read()
+
+    trace = generate(args.cycles, script, args.seed, args.irq_every)
+    write_trace(trace, args.output, args.marty)
+    print(f"Wrote {len(trace)} cycles with {trace.interrupts} interrupts to {args.output}")
+
+if __name__ == '__main__':
+    main()
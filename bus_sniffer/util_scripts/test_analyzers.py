@@ -0,0 +1,85 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_analyzers.py
+#
+#   Checks that every built-in analyzer writes its results for a synthetic
+#   trace decoded to CSV, Parquet and Arrow, and that they read back the same.
+#
+#   Run with 'python -m unittest discover' from this directory.
+
+import contextlib
+import filecmp
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+import analyzers
+import decode_stream
+import synth_trace
+import trace_io
+
+# Long enough for two interrupts, the second with a DELTA from the first.
+CYCLES = 150000
+
+HAVE_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+class TestAnalyzers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        cls.input_csv = os.path.join(cls.dir.name, 'synth.csv')
+        synth_trace.write_csv(synth_trace.generate(CYCLES, progress=False), cls.input_csv)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def decode(self, name):
+        """ Decode with every built-in analyzer, returning the paths of their results by name. """
+        output = os.path.join(self.dir.name, name)
+        plugins = [analyzers.load_analyzer(spec) for spec in analyzers.BUILTIN_ANALYZERS]
+        with contextlib.redirect_stdout(io.StringIO()):
+            decode_stream.decode_csv(self.input_csv, output, checkpoint_interval=0, analyzers=plugins)
+        base, ext = os.path.splitext(output)
+        return {spec: f'{base}.{spec}{ext}' for spec in analyzers.BUILTIN_ANALYZERS}
+
+    @unittest.skipUnless(HAVE_PYARROW, "pyarrow isn't installed")
+    def test_columnar(self):
+        csv_results = self.decode('trace.csv')
+        for name in ('trace.parquet', 'trace.arrow'):
+            for spec, path in self.decode(name).items():
+                # Written back to CSV, the Parquet or Arrow table is the CSV table.
+                copy_csv = os.path.join(self.dir.name, f'copy.{spec}.csv')
+                trace_io.write_trace(trace_io.read_trace(path), copy_csv)
+                self.assertTrue(filecmp.cmp(copy_csv, csv_results[spec], shallow=False), path)
+
+        interrupts = trace_io.read_trace(os.path.join(self.dir.name, 'trace.interrupts.parquet'))
+        self.assertEqual(len(interrupts), 2)
+        self.assertTrue(pd.isna(interrupts['DELTA'].iloc[0]))
+        self.assertEqual(interrupts['DELTA'].iloc[1], interrupts['N'].iloc[1] - interrupts['N'].iloc[0])
+
+if __name__ == "__main__":
+    unittest.main()
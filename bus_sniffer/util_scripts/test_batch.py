@@ -0,0 +1,77 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_batch.py
+#
+#   Checks that a batch of captures decoded on several workers all succeed,
+#   with every worker saving new entries to the same disassembly cache.
+#
+#   Run with 'python -m unittest discover' from this directory.
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import batch
+import synth_trace
+import trace_io
+from disasm_cache import DisasmCache
+
+CAPTURES = 4
+WORKERS = 4
+CYCLES = 20000
+
+class TestBatch(unittest.TestCase):
+    def test_workers(self):
+        with tempfile.TemporaryDirectory() as dir:
+            trace = synth_trace.generate(CYCLES, progress=False)
+            captures = []
+            for i in range(CAPTURES):
+                captures.append(os.path.join(dir, f'cap{i}.csv'))
+                synth_trace.write_csv(trace, captures[-1])
+            out_dir = os.path.join(dir, 'out')
+
+            # Start from an empty cache, so every worker has entries to save.
+            cache_path = os.path.join(dir, 'disasm_cache.json')
+            env = {'MARTY_DISASM_CACHE': cache_path, 'MARTY_CACHE_DIR': os.path.join(dir, 'cache'),
+                   'MARTY_PROGRESS': 'off'}
+            with mock.patch.dict(os.environ, env), contextlib.redirect_stdout(io.StringIO()):
+                failed = batch.run_batch(captures, batch.DEFAULT_PIPELINE, out_dir, WORKERS)
+            self.assertEqual(failed, 0)
+
+            records = batch.read_manifest(os.path.join(out_dir, batch.MANIFEST))
+            self.assertEqual(sorted(records), sorted(captures))
+            for capture, record in records.items():
+                self.assertEqual(record['status'], 'ok', capture)
+                with open(record['log'], 'r') as log:
+                    text = log.read()
+                self.assertNotIn("disassembly cache", text)
+                self.assertNotIn("Traceback", text)
+                decoded = os.path.join(out_dir, batch.capture_name(capture) + '.csv')
+                self.assertEqual(len(trace_io.read_trace(decoded, ['N'])), CYCLES)
+            self.assertGreater(len(DisasmCache.load(cache_path).entries), 0)
+
+if __name__ == "__main__":
+    unittest.main()
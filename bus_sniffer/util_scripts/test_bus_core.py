@@ -0,0 +1,93 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_bus_core.py
+#
+#   Checks the bus_core state machines, and that the copy of bus_core bundled
+#   with the i8088 sigrok decoder matches it.
+#
+#   Run with 'python -m unittest discover' from this directory, or on its own.
+
+import filecmp
+import os
+import unittest
+
+from bus_core import BusDecoder, BusStatus, InstructionQueue, QueueError, QueueOp, TState, next_t_state
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CORE_DIR = os.path.join(SCRIPT_DIR, 'bus_core')
+
+# The sigrok decoder bundles a copy of the pure Python modules.
+SIGROK_COPY = os.path.join(SCRIPT_DIR, '..', '..', 'sigrok_decoders', 'i8088', 'bus_core')
+SIGROK_MODULES = ['states.py', 'engine.py']
+
+class TestBusCore(unittest.TestCase):
+
+    def test_sigrok_copy(self):
+        for name in SIGROK_MODULES:
+            self.assertTrue(filecmp.cmp(os.path.join(CORE_DIR, name), os.path.join(SIGROK_COPY, name), shallow=False),
+                            f"sigrok_decoders/i8088/bus_core/{name} is out of date; copy it from bus_core")
+
+    def test_t_states(self):
+        # Bus cycle with one wait state
+        t_state = TState.TI
+        states = []
+        for ale, ready, prev_ready in [(True, 1, 1), (False, 1, 1), (False, 0, 1), (False, 0, 0), (False, 1, 0), (False, 1, 1)]:
+            t_state = next_t_state(t_state, ale, ready, prev_ready)
+            states.append(t_state)
+        self.assertEqual(states, [TState.T1, TState.T2, TState.T3, TState.TW, TState.TW, TState.T4])
+
+    def test_queue(self):
+        queue = InstructionQueue()
+        for byte in range(4):
+            queue.push(byte)
+        with self.assertRaises(QueueError):
+            queue.push(4)
+        self.assertEqual(queue.pop(), 0)
+        queue.clear()
+        with self.assertRaises(QueueError):
+            queue.pop()
+
+    def test_code_fetch(self):
+        decoder = BusDecoder()
+        s = decoder.state
+        n = 0
+        # PASV, then a code fetch of 0x90 (T1-T4).
+        for b, addr in [(BusStatus.PASV, 0), (BusStatus.CODE, 0x12345), (BusStatus.PASV, 0x90), (BusStatus.PASV, 0x90)]:
+            if n > 0:
+                decoder.complete(n - 1, QueueOp.Idle)
+            ale, t_state, d = decoder.cycle(b, addr, 1)
+            n += 1
+        self.assertEqual(s.al, 0x12345)
+        self.assertEqual(s.busl, BusStatus.CODE)
+        self.assertEqual(d, 0x90)
+
+        # The byte is read from the queue as the first byte of an instruction.
+        decoder.complete(n - 1, QueueOp.Idle)
+        decoder.cycle(BusStatus.PASV, 0, 1)
+        qb, finished, error = decoder.complete(n, QueueOp.First)
+        self.assertEqual(qb, 0x90)
+        self.assertEqual(finished, (0, []))
+        self.assertEqual(s.inst, [0x90])
+        self.assertIsNone(error)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_decode_parallel.py
+#
+#   Checks that a parallel decode of a synthetic trace splits it only where the
+#   decoder resynchronizes, and matches a single-process decode.
+#
+#   Run with 'python -m unittest discover' from this directory.
+
+import contextlib
+import filecmp
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import decode_parallel
+import decode_stream
+import synth_trace
+
+CYCLES = 200000
+
+class TestDecodeParallel(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        cls.input_csv = os.path.join(cls.dir.name, 'synth.csv')
+        synth_trace.write_csv(synth_trace.generate(CYCLES, progress=False), cls.input_csv)
+        cls.serial_csv = os.path.join(cls.dir.name, 'serial.csv')
+        with contextlib.redirect_stdout(io.StringIO()):
+            decode_stream.decode_csv(cls.input_csv, cls.serial_csv, checkpoint_interval=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def test_resync_points(self):
+        # . F E . . F S . E E . F
+        qop = np.array([0, 1, 2, 0, 0, 1, 3, 0, 2, 2, 0, 1])
+        flushes, resyncs = decode_parallel.find_resync_points(qop)
+        self.assertEqual(list(flushes), [2, 9])
+        self.assertEqual(list(resyncs), [6, 12])
+
+    def test_seams(self):
+        output_csv = os.path.join(self.dir.name, 'parallel.csv')
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            decode_parallel.decode_csv(self.input_csv, output_csv, 4, min_segment=CYCLES // 10)
+        self.assertIn("in 4 segments", log.getvalue())
+        # No segment started from a different state than the previous one ended with.
+        self.assertNotIn("State mismatch", log.getvalue())
+        self.assertTrue(filecmp.cmp(self.serial_csv, output_csv, shallow=False))
+
+if __name__ == "__main__":
+    unittest.main()
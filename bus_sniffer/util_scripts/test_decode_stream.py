@@ -0,0 +1,117 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_decode_stream.py
+#
+#   Checks that the streaming decode of a synthetic trace matches the in-memory
+#   decode of the whole trace, whatever the chunk size, and that ranged decodes
+#   resumed from a checkpoint match the same rows.
+#
+#   Run with 'python -m unittest discover' from this directory.
+
+import contextlib
+import filecmp
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+import decode
+import decode_stream
+import synth_trace
+import trace_io
+
+CYCLES = 60000
+
+# Chunk sizes that don't divide the trace, or each other, so chunks end at
+# every point of an instruction and bus cycle.
+CHUNK_SIZES = [997, 7919, CYCLES * 2]
+CHECKPOINT_INTERVAL = 10000
+
+class TestDecodeStream(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        cls.input_csv = cls.path('synth.csv')
+        synth_trace.write_csv(synth_trace.generate(CYCLES, progress=False), cls.input_csv)
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.baseline = decode.decode_frame(pd.read_csv(cls.input_csv, comment=';'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    @classmethod
+    def path(cls, name):
+        return os.path.join(cls.dir.name, name)
+
+    def decode(self, output_csv, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            decode_stream.decode_csv(self.input_csv, output_csv, **kwargs)
+        return log.getvalue()
+
+    def assertMatchesBaseline(self, rows):
+        expected = self.baseline.set_index('N', drop=False).loc[rows['N'].to_numpy()].reset_index(drop=True)
+        pd.testing.assert_frame_equal(rows.reset_index(drop=True), expected, check_dtype=False, check_categorical=False)
+
+    def test_chunk_sizes(self):
+        outputs = []
+        for chunk_size in CHUNK_SIZES:
+            output_csv = self.path(f'chunk{chunk_size}.csv')
+            self.assertIn("No anomalies", self.decode(output_csv, chunk_size=chunk_size, checkpoint_interval=0))
+            outputs.append(output_csv)
+        for output_csv in outputs[1:]:
+            self.assertTrue(filecmp.cmp(outputs[0], output_csv, shallow=False), output_csv)
+
+        rows = trace_io.read_trace(outputs[0])
+        self.assertEqual(len(rows), CYCLES)
+        self.assertMatchesBaseline(rows)
+    def test_resume(self):
+        log = self.decode(self.path('full.csv'), chunk_size=7919, checkpoint_interval=CHECKPOINT_INTERVAL)
+        self.assertIn("No anomalies", log)
+        self.assertTrue(os.path.exists(decode_stream.checkpoint_path(self.input_csv)))
+
+        for start, end in [(12345, 23456), (CHECKPOINT_INTERVAL * 4, None), (CYCLES - 10, CYCLES + 10)]:
+            output_csv = self.path(f'range{start}.csv')
+            log = self.decode(output_csv, chunk_size=997, start=start, end=end)
+            self.assertIn(f"Resuming from checkpoint at cycle {start // CHECKPOINT_INTERVAL * CHECKPOINT_INTERVAL}", log)
+            rows = trace_io.read_trace(output_csv)
+            last = CYCLES - 1 if end is None else min(end, CYCLES - 1)
+            self.assertEqual(list(rows['N']), list(range(start, last + 1)))
+            self.assertMatchesBaseline(rows)
+
+    def test_stale_checkpoint(self):
+        input_csv = self.path('copy.csv')
+        shutil.copyfile(self.input_csv, input_csv)
+        with contextlib.redirect_stdout(io.StringIO()):
+            decode_stream.decode_csv(input_csv, self.path('copy_full.csv'), checkpoint_interval=CHECKPOINT_INTERVAL)
+        with open(input_csv, 'a') as file:
+            file.write('; changed\n')
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            decode_stream.decode_csv(input_csv, self.path('copy_range.csv'), start=30000, end=30100)
+        self.assertIn("Ignoring stale checkpoint", log.getvalue())
+        self.assertMatchesBaseline(trace_io.read_trace(self.path('copy_range.csv')))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_decode_windows.py
+#
+#   Checks that windows decoded around markers, and quick-look samples, match
+#   the same cycles of a full decode of a synthetic trace.
+#
+#   Run with 'python -m unittest discover' from this directory.
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import decode_stream
+import decode_windows
+import quick_look
+import synth_trace
+import trace_io
+from decode_windows import SamplePlacer, iter_windows
+from markers import Marker
+
+CYCLES = 100000
+
+# The default script's 'mul bx' leaves the bus passive for over 100 cycles with
+# the queue full, so windows starting at a warm-up this short after one are
+# only right if they start from a queue flush.
+WARMUP = 64
+RADIUS = 300
+
+class TestDecodeWindows(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        cls.input_csv = os.path.join(cls.dir.name, 'synth.csv')
+        cls.trace = synth_trace.generate(CYCLES, progress=False)
+        synth_trace.write_csv(cls.trace, cls.input_csv)
+        full_csv = os.path.join(cls.dir.name, 'full.csv')
+        with contextlib.redirect_stdout(io.StringIO()):
+            decode_stream.decode_csv(cls.input_csv, full_csv, checkpoint_interval=0)
+        cls.full = trace_io.read_trace(full_csv).set_index('N', drop=False)
+        cls.times = pd.read_csv(cls.input_csv, usecols=['Time(s)'])['Time(s)'].to_numpy()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def assertMatchesFull(self, rows):
+        expected = self.full.loc[rows['N'].to_numpy(), rows.columns].reset_index(drop=True)
+        pd.testing.assert_frame_equal(rows.reset_index(drop=True), expected, check_dtype=False, check_categorical=False)
+
+    def test_marker_windows(self):
+        # Markers every 7919 cycles land at every point of the copy loop.
+        points = range(5000, CYCLES - RADIUS, 7919)
+        markers = [Marker(self.times[n].item(), f'm{n}') for n in points]
+        output_csv = os.path.join(self.dir.name, 'windows.csv')
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            decode_windows.decode_windows(self.input_csv, output_csv, markers, RADIUS, WARMUP)
+        self.assertIn("No anomalies", log.getvalue())
+
+        rows = trace_io.read_trace(output_csv)
+        decoded = set(rows['N'])
+        for n in points:
+            self.assertTrue(decoded.issuperset(range(n - RADIUS, n + RADIUS + 1)))
+        self.assertMatchesFull(rows)
+
+    def test_samples(self):
+        windows = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for window, rows in iter_windows(self.input_csv, SamplePlacer(10000, RADIUS), RADIUS, WARMUP):
+                if rows is None:
+                    self.assertEqual(len(window.anomalies), 0)
+                    self.assertEqual([marker.name for marker in window.markers],
+                                     [f'sample at cycle {window.first + RADIUS}'])
+                    windows += 1
+                else:
+                    self.assertMatchesFull(rows)
+        self.assertGreater(windows, 5)
+
+    def test_quick_look(self):
+        report_json = os.path.join(self.dir.name, 'quick_look.json')
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = quick_look.quick_look(self.input_csv, report_json, 10000, RADIUS)
+        self.assertEqual(report['anomalies']['total'], 0)
+        self.assertGreater(len(report['samples']), 5)
+        for sample in report['samples']:
+            self.assertEqual(sample['time'], self.times[sample['first']])
+            disasm = self.full['DISASM'].loc[sample['first']:sample['last']]
+            self.assertEqual(sample['instructions'], disasm.notna().sum())
+
+    def test_no_resync(self):
+        # With no room for a lead-in, windows don't reach back to a flush.
+        placer = decode_windows.MarkerPlacer([Marker(self.times[50000].item(), 'm')])
+        with mock.patch.object(decode_windows, 'MAX_LEAD_IN', 0), contextlib.redirect_stdout(io.StringIO()):
+            finished = [window for window, rows in iter_windows(self.input_csv, placer, RADIUS, WARMUP) if rows is None]
+        self.assertEqual(finished[0].anomalies.counts.get('no_resync'), 1)
+
+if __name__ == "__main__":
+    unittest.main()
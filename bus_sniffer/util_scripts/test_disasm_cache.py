@@ -0,0 +1,78 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_disasm_cache.py
+#
+#   Checks that decodes saving the shared disassembly cache at the same time
+#   don't corrupt it.
+#
+#   Run with 'python -m unittest discover' from this directory.
+
+import contextlib
+import io
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from disasm_cache import DisasmCache
+
+PROCESSES = 8
+SAVES = 20
+
+def save_entries(path, worker):
+    """ Save a new entry SAVES times, returning what was printed. """
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        for i in range(SAVES):
+            cache = DisasmCache.load(path)
+            cache.merge({f'{worker:02X}{i:02X}': f'entry {worker} {i}'})
+            cache.save()
+    return log.getvalue()
+
+class TestDisasmCache(unittest.TestCase):
+    def test_lookup(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'cache.json')
+            cache = DisasmCache.load(path)
+            self.assertEqual(cache.lookup('90'), 'nop')
+            cache.save()
+            self.assertEqual(DisasmCache.load(path).entries, {'90': 'nop'})
+
+    def test_concurrent_saves(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'cache.json')
+            with multiprocessing.Pool(PROCESSES) as pool:
+                logs = pool.starmap(save_entries, [(path, worker) for worker in range(PROCESSES)])
+            self.assertEqual(''.join(logs), '')
+            self.assertEqual(os.listdir(dir), ['cache.json'])
+            # The last save has every entry of the process that made it, at least.
+            self.assertGreaterEqual(len(DisasmCache.load(path).entries), SAVES)
+
+    def test_failed_save(self):
+        with tempfile.TemporaryDirectory() as dir:
+            cache = DisasmCache(os.path.join(dir, 'missing', 'cache.json'))
+            cache.lookup('90')
+            with contextlib.redirect_stdout(io.StringIO()) as log:
+                cache.save()
+            self.assertIn("Couldn't save disassembly cache", log.getvalue())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_stage_cache.py
+#
+#   Checks that the stage cache restores a stage's own outputs on a hit, and
+#   only those, and that its key changes with the inputs, parameters and
+#   library versions.
+#
+#   Run with 'python -m unittest discover' from this directory.
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import stage_cache
+
+class TestStageCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = stage_cache.StageCache(os.path.join(self.dir.name, 'cache'))
+        self.input = self.path('cap1.csv')
+        self.write(self.input, 'input')
+        self.calls = 0
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def write(self, path, text):
+        with open(path, 'w') as file:
+            file.write(text)
+
+    def read(self, name):
+        with open(self.path(name), 'r') as file:
+            return file.read()
+
+    def stage(self, output, text='out', params=None, side_outputs=()):
+        """ Run a stage writing 'output' and the files next to it, plus files that aren't its outputs. """
+        def func():
+            self.calls += 1
+            base = os.path.splitext(output)[0]
+            self.write(output, text)
+            self.write(base + '.anomalies.json', text + ' anomalies')
+            self.write(base + 'a.png', text + ' image')
+            self.write(self.path('other.csv'), 'other')
+            self.write(self.path('cap10.csv'), 'cap10')
+            self.write(self.input + '.ckpt', 'checkpoint')
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.cache.run('test', output, func, [self.input], params, [sys.modules[__name__]],
+                                  side_outputs=side_outputs)
+
+    def test_hit_and_miss(self):
+        output = self.path('o.csv')
+        self.assertFalse(self.stage(output))
+        self.assertFalse(self.stage(output, params={'x': 1}))
+        os.remove(output)
+        self.assertTrue(self.stage(output))
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.read('o.csv'), 'out')
+
+        self.write(self.input, 'changed')
+        self.assertFalse(self.stage(output))
+        self.assertEqual(self.calls, 3)
+
+    def test_outputs(self):
+        output = self.path('cap1.out.csv')
+        self.stage(output, side_outputs=['a.png'])
+        files = stage_cache.output_files(output, 0, [self.input], ['a.png'])
+        self.assertEqual(sorted(files), ['.anomalies.json', '.csv', 'a.png'])
+
+        # Only the stage's own files are restored over the others.
+        self.stage(self.path('o.csv'), side_outputs=['a.png'])
+        for name in ('other.csv', 'cap10.csv', 'oa.png'):
+            self.write(self.path(name), 'edited')
+        self.assertTrue(self.stage(self.path('o.csv'), side_outputs=['a.png']))
+        self.assertEqual(self.read('other.csv'), 'edited')
+        self.assertEqual(self.read('cap10.csv'), 'edited')
+        self.assertEqual(self.read('oa.png'), 'out image')
+
+    def test_library_versions(self):
+        key = self.cache.key('test', [self.input], None, [sys.modules[__name__]])
+        versions = stage_cache.library_versions()
+        for i in range(len(versions)):
+            changed = list(versions)
+            changed[i] = 'other'
+            with mock.patch.object(stage_cache, 'library_versions', return_value=changed):
+                self.assertNotEqual(self.cache.key('test', [self.input], None, [sys.modules[__name__]]), key)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_trace_diff.py
+#
+#   Checks trace_diff.py's alignment on a decoded synthetic trace: identical
+#   traces match from their first bus cycle, and traces that differ from the
+#   start report a divergence there.
+#
+#   Run with 'python -m unittest discover' from this directory.
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import decode
+import synth_trace
+import trace_diff
+import trace_io
+
+CYCLES = 20000
+
+class TestTraceDiff(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        input_csv = cls.path('synth.csv')
+        synth_trace.write_csv(synth_trace.generate(CYCLES, progress=False), input_csv)
+        with contextlib.redirect_stdout(io.StringIO()):
+            trace = decode.decode_frame(pd.read_csv(input_csv, comment=';'))
+        trace_io.write_trace(trace, cls.path('a.csv'))
+        cls.records = trace_diff.bus_records(trace)
+
+        # Every address is off by one, so no run of records appears in both.
+        trace['AL'] = trace['AL'] + 1
+        trace_io.write_trace(trace, cls.path('b.csv'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    @classmethod
+    def path(cls, name):
+        return os.path.join(cls.dir.name, name)
+
+    def diff(self, *args):
+        """ Run trace_diff.py, returning its exit status and output. """
+        argv = ['trace_diff.py'] + [self.path(arg) if arg.endswith('.csv') else arg for arg in args]
+        with mock.patch.object(sys, 'argv', argv), contextlib.redirect_stdout(io.StringIO()) as log:
+            with self.assertRaises(SystemExit) as exit:
+                trace_diff.main()
+        return exit.exception.code, log.getvalue()
+
+    def test_identical(self):
+        total = len(self.records.n)
+        first = f'{self.records.address[0]:05X}'
+        for args in [(), ('--anchor', first)]:
+            status, log = self.diff('a.csv', 'a.csv', *args)
+            self.assertEqual(status, 0)
+            self.assertIn(f"Aligned at cycle {self.records.n[0]} of A", log)
+            self.assertIn(f"{total} bus cycles match, 0 divergence(s)", log)
+
+    def test_differ_from_start(self):
+        status, log = self.diff('a.csv', 'b.csv')
+        self.assertEqual(status, 1)
+        self.assertNotIn("Couldn't align", log)
+        self.assertIn(f"Divergence 1 at cycle {self.records.n[0]} of A and {self.records.n[0]} of B", log)
+
+if __name__ == "__main__":
+    unittest.main()
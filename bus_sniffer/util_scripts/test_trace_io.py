@@ -0,0 +1,115 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   test_trace_io.py
+#
+#   Checks that a decoded trace reads back from CSV, Parquet and Arrow with the
+#   same numeric columns it was written with.
+#
+#   Run with 'python -m unittest discover' from this directory.
+
+import contextlib
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+import warnings
+
+import pandas as pd
+
+import decode
+import formatting
+import synth_trace
+import trace_io
+
+# Long enough for the trace to span video frames, each its own row group.
+CYCLES = synth_trace.FRAME_CYCLES + 10000
+
+# The decode writes a trace in chunks, so Parquet and Arrow files are written in
+# pieces that split frames and bring new DISASM text in later batches.
+PIECE_SIZE = 997
+
+HAVE_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+class TestTraceIo(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.TemporaryDirectory()
+        input_csv = os.path.join(cls.dir.name, 'synth.csv')
+        synth_trace.write_csv(synth_trace.generate(CYCLES, progress=False), input_csv)
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.trace = decode.decode_frame(pd.read_csv(input_csv, comment=';'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def assertSameTrace(self, df, expected):
+        # Parquet and Arrow give DISASM back as the categorical it's stored as.
+        if 'DISASM' in df.columns:
+            df = df.assign(DISASM=df['DISASM'].astype(expected['DISASM'].dtype))
+        # Compare named states by their codes, which is much faster.
+        for col in formatting.CATEGORIES:
+            if col in expected.columns:
+                self.assertEqual(list(df[col].cat.categories), list(expected[col].cat.categories))
+                df = df.assign(**{col: df[col].cat.codes})
+                expected = expected.assign(**{col: expected[col].cat.codes})
+        pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+    def test_format_columns(self):
+        text = formatting.format_columns(self.trace)
+        self.assertTrue(text['ADDR'].str.startswith("'").all())
+        self.assertSameTrace(formatting.parse_columns(text), self.trace)
+
+    def test_csv(self):
+        path = os.path.join(self.dir.name, 'trace.csv')
+        trace_io.write_trace(self.trace, path)
+        # Every decoded column is read as text, so pandas doesn't guess at types.
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            df = trace_io.read_trace(path)
+        self.assertSameTrace(df, self.trace)
+
+        columns = ['N', 'BUSL', 'Q0', 'INST', 'DISASM', 'MISSING']
+        self.assertSameTrace(trace_io.read_trace(path, columns), self.trace[columns[:-1]])
+    def write_pieces(self, path):
+        writer = trace_io.open_writer(path)
+        for start in range(0, len(self.trace), PIECE_SIZE):
+            writer.write(self.trace.iloc[start:start + PIECE_SIZE])
+        writer.close()
+
+    @unittest.skipUnless(HAVE_PYARROW, "pyarrow isn't installed")
+    def test_columnar(self):
+        for name in ('trace.parquet', 'trace.arrow'):
+            path = os.path.join(self.dir.name, name)
+            self.write_pieces(path)
+            self.assertEqual(trace_io.trace_columns(path), list(self.trace.columns))
+            if name.endswith('.parquet'):
+                groups = trace_io.import_pyarrow().parquet.ParquetFile(path).num_row_groups
+                self.assertEqual(groups, self.trace['FRAME'].nunique())
+            self.assertSameTrace(trace_io.read_trace(path), self.trace)
+
+            columns = ['N', 'BUSL', 'Q0', 'INST', 'DISASM', 'MISSING']
+            self.assertSameTrace(trace_io.read_trace(path, columns), self.trace[columns[:-1]])
+
+if __name__ == "__main__":
+    unittest.main()
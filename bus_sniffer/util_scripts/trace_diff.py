@@ -0,0 +1,394 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   trace_diff.py
+#
+#   Find where two decoded traces diverge, such as a real bus capture and a
+#   MartyPC trace of the same program (see decode_marty2.py).
+#
+#   Both traces are reduced to one record per bus cycle: its type, address,
+#   segment, data, wait states and the number of clocks until the next bus
+#   cycle. The traces are first aligned. With --anchor, alignment is on the
+#   first code fetch from an address, given as SEG:OFF or a physical address
+#   in hex. Otherwise the engine looks for the first run of --match records
+#   after the first instruction boundary of one trace that appears in the
+#   other, or compares from the first records if there is none. Records
+#   before the aligned start that match in both traces are compared too.
+#
+#   From the aligned start, the records are compared until they differ. That
+#   is a divergence, reported with the fields that differ and a window of
+#   records around it from both traces. To resynchronize, each run of
+#   --match records is reduced to a rolling polynomial hash, and the engine
+#   looks for the first run that appears in both traces again. Comparing and
+#   searching are whole-array numpy operations, so traces of tens of millions
+#   of cycles diff in about the time it takes to read them.
+#
+#   With --ignore-timing, wait states and clocks between bus cycles aren't
+#   compared, and only the cycle type, address, segment and data are.
+#
+#   Instructions are aligned the same way, using their disassembly. Each
+#   instruction paired between the traces gets a cycle delta: its length in
+#   trace B minus its length in trace A. The instructions with the largest
+#   deltas are summarized, and --instructions writes every pair to a CSV.
+#
+#   Either trace may also be a raw cycle CSV. The columns needed are then
+#   decoded on the fly (see lazy_trace.py).
+#
+#   Command Line Arguments:
+#   trace_a trace_b [--anchor ADDR] [--ignore-timing] [--match N] [--context N]
+#   [--max-divergences N] [--search N] [--report JSON] [--instructions CSV]
+
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+from collections import namedtuple
+
+from bus_core import BUS_STATES, SEG_STATES, T_STATES, BusStatus, TState
+from formatting import ALE_STATES, codes
+from lazy_trace import LazyTrace
+
+DIFF_COLUMNS = ['N', 'ALE', 'AL', 'SEG', 'BUSL', 'T', 'D', 'DISASM']
+
+# Number of consecutive records that must match to align or resynchronize.
+MATCH = 16
+CONTEXT = 5
+MAX_DIVERGENCES = 20
+# How many records ahead a resynchronization is searched for.
+SEARCH = 1000000
+
+HASH_BASE = 0x100000001B3
+HASH_MIX = 0x9E3779B97F4A7C15
+
+# Record fields compared, and whether each is timing.
+FIELDS = [('status', False), ('address', False), ('segment', False), ('data', False), ('waits', True), ('gap', True)]
+
+# One record per bus cycle, as arrays. 'n' is its ALE cycle and 'gap' the clocks
+# until the next ALE. Missing values are -1.
+BusRecords = namedtuple('BusRecords', ['n'] + [name for name, _ in FIELDS])
+
+# One record per instruction: the cycle its first byte was read, its length in
+# cycles and its disassembly.
+Instructions = namedtuple('Instructions', ['n', 'cycles', 'disasm'])
+
+# A divergence at record 'a' of trace A and 'b' of trace B. The traces agree
+# again at 'resync_a' and 'resync_b', or never do if those are None.
+Divergence = namedtuple('Divergence', ['a', 'b', 'resync_a', 'resync_b'])
+
+def read_trace(path):
+    """ Read the columns the diff needs, decoding them if 'path' is a raw cycle CSV. """
+    return LazyTrace.read(path, DIFF_COLUMNS).select(DIFF_COLUMNS)
+
+def bus_records(df):
+    """ Reduce a decoded trace to one record per bus cycle. """
+    rows = len(df)
+    ale = np.flatnonzero(codes(df['ALE'], ALE_STATES) == 1)
+    if len(ale) == 0:
+        return BusRecords(*[np.empty(0, dtype=np.int64)] * len(BusRecords._fields))
+
+    t_state = codes(df['T'], T_STATES)
+    data = df['D'].to_numpy(dtype=np.int64, na_value=-1)
+    row = np.arange(rows)
+
+    # The last row with data in each bus cycle, and the number of wait states.
+    data_row = np.maximum.reduceat(np.where(data >= 0, row, -1), ale)
+    waits = np.add.reduceat((t_state == TState.TW).astype(np.int64), ale)
+    # The segment status is valid from T2, the cycle after ALE.
+    t2 = np.minimum(ale + 1, rows - 1)
+    segment = np.where(t2 > ale, codes(df['SEG'], SEG_STATES)[t2], -1)
+
+    n = df['N'].to_numpy(dtype=np.int64)
+    return BusRecords(
+        n=n[ale],
+        status=codes(df['BUSL'], BUS_STATES)[ale],
+        address=df['AL'].to_numpy(dtype=np.int64, na_value=-1)[ale],
+        segment=segment,
+        data=np.where(data_row >= 0, data[np.maximum(data_row, 0)], -1),
+        waits=waits,
+        gap=np.diff(ale, append=rows),
+    )
+
+def instructions(df):
+    """ Return the instructions of a decoded trace. """
+    rows = np.flatnonzero(df['DISASM'].notna().to_numpy())
+    n = df['N'].to_numpy(dtype=np.int64)
+    return Instructions(n[rows], np.diff(rows, append=len(df)), df['DISASM'].to_numpy(dtype=object)[rows])
+
+def record_keys(records, timing=True):
+    """ Pack each bus record into one integer. Values are offset by one so that -1 packs as 0. """
+    keys = (records.status + 1).astype(np.uint64)
+    keys = (keys << np.uint64(21)) | (records.address + 1).astype(np.uint64)
+    keys = (keys << np.uint64(3)) | (records.segment + 1).astype(np.uint64)
+    keys = (keys << np.uint64(9)) | (records.data + 1).astype(np.uint64)
+    if timing:
+        keys = (keys << np.uint64(8)) | np.minimum(records.waits, 255).astype(np.uint64)
+        keys = (keys << np.uint64(16)) | np.minimum(records.gap, 65535).astype(np.uint64)
+    return keys
+
+def run_hashes(keys, k):
+    """ Return the polynomial hash of every run of 'k' consecutive keys, mod 2**64. """
+    count = len(keys) - k + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.uint64)
+    mixed = keys * np.uint64(HASH_MIX)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(k):
+        hashes = hashes * np.uint64(HASH_BASE) + mixed[offset:offset + count]
+    return hashes
+
+def find_run(keys_a, keys_b, hashes_a, hashes_b, i, j, k, search):
+    """ Return the first (p, q), with p >= i and q >= j, where 'k' keys match in
+    both traces, searching up to 'search' runs ahead in each. Returns None if
+    there is none.
+    """
+    window_a = hashes_a[i:i + search]
+    window_b = hashes_b[j:j + search]
+    if len(window_a) == 0 or len(window_b) == 0:
+        return None
+
+    # A stable sort keeps equal hashes in trace order, so the first of them is
+    # the earliest run in trace B.
+    order = np.argsort(window_b, kind='stable')
+    sorted_b = window_b[order]
+    found = np.minimum(np.searchsorted(sorted_b, window_a), len(sorted_b) - 1)
+    for p in np.flatnonzero(sorted_b[found] == window_a):
+        start = found[p]
+        # Check the keys themselves, in case of a hash collision.
+        while start < len(sorted_b) and sorted_b[start] == window_a[p]:
+            q = j + order[start]
+            if np.array_equal(keys_a[i + p:i + p + k], keys_b[q:q + k]):
+                return i + p, q
+            start += 1
+    return None
+
+def first_difference(keys_a, keys_b, i, j):
+    """ Return the offset of the first difference after records i and j, or None
+    if they agree until one trace ends.
+    """
+    count = min(len(keys_a) - i, len(keys_b) - j)
+    differ = np.flatnonzero(keys_a[i:i + count] != keys_b[j:j + count])
+    return differ[0] if len(differ) else None
+
+def compare(keys_a, keys_b, i, j, k=MATCH, search=SEARCH, max_divergences=MAX_DIVERGENCES):
+    """ Compare two key sequences from records i and j. Returns the divergences
+    found, and the (a, b, length) runs of matching records.
+    """
+    hashes_a = run_hashes(keys_a, k)
+    hashes_b = run_hashes(keys_b, k)
+    divergences = []
+    runs = []
+    while i is not None:
+        offset = first_difference(keys_a, keys_b, i, j)
+        if offset is None:
+            runs.append((i, j, min(len(keys_a) - i, len(keys_b) - j)))
+            break
+        runs.append((i, j, offset))
+        i, j = i + offset, j + offset
+        if len(divergences) == max_divergences:
+            break
+        resync = find_run(keys_a, keys_b, hashes_a, hashes_b, i, j, k, search)
+        divergences.append(Divergence(i, j, *(resync or (None, None))))
+        i, j = resync or (None, None)
+    return divergences, runs
+
+def parse_anchor(text):
+    """ Return the physical address of 'SEG:OFF' or a hex address. """
+    if ':' in text:
+        seg, off = text.split(':', 1)
+        return (int(seg, 16) * 16 + int(off, 16)) & 0xFFFFF
+    return int(text, 16)
+
+def anchor_record(records, address):
+    found = np.flatnonzero((records.status == BusStatus.CODE) & (records.address == address))
+    return found[0] if len(found) else None
+
+def extend_back(keys_a, keys_b, i, j):
+    """ Return the aligned records (i, j) moved back over the records before them
+    that match in both traces.
+    """
+    count = min(i, j)
+    differ = np.flatnonzero(keys_a[i - count:i][::-1] != keys_b[j - count:j][::-1])
+    back = differ[0] if len(differ) else count
+    return i - back, j - back
+
+def align(records_a, records_b, keys_a, keys_b, inst_a, inst_b, k=MATCH, search=SEARCH):
+    """ Return the records (i, j) the traces align at, or None. Alignment starts
+    from the first instruction boundary of each trace.
+    """
+    start_a = np.searchsorted(records_a.n, inst_a.n[0]) if len(inst_a.n) else 0
+    start_b = np.searchsorted(records_b.n, inst_b.n[0]) if len(inst_b.n) else 0
+    hashes_a = run_hashes(keys_a, k)
+    hashes_b = run_hashes(keys_b, k)
+    # The trace that starts later has its first run somewhere in the other.
+    found = find_run(keys_a, keys_b, hashes_a, hashes_b, start_a, start_b, k, 1)
+    if found is None:
+        found = find_run(keys_a, keys_b, hashes_a, hashes_b, start_a, start_b, k, search)
+    return found
+
+def field_differences(records_a, records_b, a, b, timing):
+    return [name for name, is_timing in FIELDS
+            if (timing or not is_timing) and getattr(records_a, name)[a] != getattr(records_b, name)[b]]
+
+def format_record(records, i):
+    if i is None or i < 0 or i >= len(records.n):
+        return ''
+    status = BUS_STATES[records.status[i]] if records.status[i] >= 0 else '?'
+    address = f'{records.address[i]:05X}' if records.address[i] >= 0 else '-----'
+    segment = SEG_STATES[records.segment[i]] if records.segment[i] >= 0 else '--'
+    data = f'{records.data[i]:02X}' if records.data[i] >= 0 else '--'
+    return f"{records.n[i]:>10} {status:<4} {address} {segment} {data} w{records.waits[i]} +{records.gap[i]}"
+
+def instruction_at(inst, n):
+    """ Return the disassembly of the instruction executing at cycle 'n'. """
+    i = np.searchsorted(inst.n, n, side='right') - 1
+    return inst.disasm[i] if i >= 0 else None
+
+def print_divergence(number, divergence, records_a, records_b, inst_a, inst_b, timing, context):
+    a, b = divergence.a, divergence.b
+    fields = field_differences(records_a, records_b, a, b, timing) if a < len(records_a.n) and b < len(records_b.n) else []
+    print(f"\nDivergence {number} at cycle {records_a.n[a]} of A and {records_b.n[b]} of B: "
+          f"{', '.join(fields) or 'trace ended'}")
+    print(f"  A is running '{instruction_at(inst_a, records_a.n[a])}', B '{instruction_at(inst_b, records_b.n[b])}'")
+    for offset in range(-context, context + 1):
+        marker = '>' if offset == 0 else ' '
+        print(f"{marker} {format_record(records_a, a + offset):<40}| {format_record(records_b, b + offset)}")
+    if divergence.resync_a is None:
+        print("  The traces don't agree again.")
+    else:
+        print(f"  Agree again after {divergence.resync_a - a} records of A and {divergence.resync_b - b} of B.")
+
+def instruction_deltas(inst_a, inst_b, runs):
+    """ Return a DataFrame of the paired instructions and their cycle deltas. """
+    pairs = [(np.arange(i, i + length), np.arange(j, j + length)) for i, j, length in runs]
+    a = np.concatenate([pair[0] for pair in pairs]) if pairs else np.empty(0, dtype=np.int64)
+    b = np.concatenate([pair[1] for pair in pairs]) if pairs else np.empty(0, dtype=np.int64)
+    df = pd.DataFrame({
+        'N_A': inst_a.n[a],
+        'N_B': inst_b.n[b],
+        'DISASM': inst_a.disasm[a],
+        'CYCLES_A': inst_a.cycles[a],
+        'CYCLES_B': inst_b.cycles[b],
+    })
+    df['DELTA'] = df['CYCLES_B'] - df['CYCLES_A']
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Find where two decoded traces diverge.")
+    parser.add_argument('trace_a')
+    parser.add_argument('trace_b')
+    parser.add_argument('--anchor', default=None,
+                        help="Align on the first code fetch from this address (SEG:OFF or physical, in hex).")
+    parser.add_argument('--ignore-timing', action='store_true',
+                        help="Don't compare wait states or the clocks between bus cycles.")
+    parser.add_argument('--match', type=int, default=MATCH,
+                        help="Number of records that must match to align or resynchronize.")
+    parser.add_argument('--context', type=int, default=CONTEXT, help="Records to show around a divergence.")
+    parser.add_argument('--max-divergences', type=int, default=MAX_DIVERGENCES,
+                        help="Stop after this many divergences.")
+    parser.add_argument('--search', type=int, default=SEARCH,
+                        help="Number of records ahead to search for a resynchronization.")
+    parser.add_argument('--report', default=None, help="Write the divergences to this JSON file.")
+    parser.add_argument('--instructions', default=None,
+                        help="Write every paired instruction and its cycle delta to this CSV.")
+    args = parser.parse_args()
+    timing = not args.ignore_timing
+
+    traces = []
+    for path in (args.trace_a, args.trace_b):
+        print(f"Reading {path}...")
+        df = read_trace(path)
+        traces.append((bus_records(df), instructions(df)))
+    (records_a, inst_a), (records_b, inst_b) = traces
+    print(f"A has {len(records_a.n)} bus cycles and {len(inst_a.n)} instructions, "
+          f"B has {len(records_b.n)} bus cycles and {len(inst_b.n)} instructions.")
+
+    if len(records_a.n) == 0 or len(records_b.n) == 0:
+        sys.exit(f"No bus cycles in {'A' if len(records_a.n) == 0 else 'B'}")
+
+    keys_a = record_keys(records_a, timing)
+    keys_b = record_keys(records_b, timing)
+    if args.anchor:
+        address = parse_anchor(args.anchor)
+        start = anchor_record(records_a, address), anchor_record(records_b, address)
+        if None in start:
+            sys.exit(f"No code fetch from {address:05X} in {'A' if start[0] is None else 'B'}")
+    else:
+        start = align(records_a, records_b, keys_a, keys_b, inst_a, inst_b, args.match, args.search)
+        if start is None:
+            # The traces differ from the start, so that's the first divergence.
+            print(f"No run of {args.match} bus cycles appears in both traces. Comparing from the first.")
+            start = 0, 0
+    i, j = extend_back(keys_a, keys_b, *start)
+    print(f"Aligned at cycle {records_a.n[i]} of A and {records_b.n[j]} of B.")
+
+    divergences, runs = compare(keys_a, keys_b, i, j, args.match, args.search, args.max_divergences)
+    matched = sum(length for _, _, length in runs)
+    print(f"{matched} bus cycles match, {len(divergences)} divergence(s)"
+          f"{' (stopped at the limit)' if len(divergences) == args.max_divergences else ''}.")
+    for number, divergence in enumerate(divergences, start=1):
+        print_divergence(number, divergence, records_a, records_b, inst_a, inst_b, timing, args.context)
+
+    # Pair the instructions from the aligned start by their disassembly.
+    inst_keys_a = pd.util.hash_array(inst_a.disasm)
+    inst_keys_b = pd.util.hash_array(inst_b.disasm)
+    first_a = np.searchsorted(inst_a.n, records_a.n[i])
+    first_b = np.searchsorted(inst_b.n, records_b.n[j])
+    _, inst_runs = compare(inst_keys_a, inst_keys_b, first_a, first_b, args.match, args.search, max_divergences=None)
+    deltas = instruction_deltas(inst_a, inst_b, inst_runs)
+    changed = deltas[deltas['DELTA'] != 0]
+    print(f"\n{len(deltas)} instructions paired, {len(changed)} with a different length.")
+    if len(changed):
+        summary = changed.groupby('DISASM')['DELTA'].agg(['count', 'sum', 'mean'])
+        summary = summary.reindex(summary['sum'].abs().sort_values(ascending=False).index).head(10)
+        print("Largest total cycle deltas (B - A):")
+        for disasm, count, total, mean in summary.itertuples():
+            print(f"  {disasm:<32} {count:>8} times, {total:>+8} cycles ({mean:+.2f} each)")
+    if args.instructions:
+        deltas.to_csv(args.instructions, index=False)
+
+    if args.report:
+        report = {
+            'trace_a': args.trace_a,
+            'trace_b': args.trace_b,
+            'aligned': [int(records_a.n[i]), int(records_b.n[j])],
+            'matched': int(matched),
+            'timing': timing,
+            'divergences': [{
+                'cycle_a': int(records_a.n[d.a]) if d.a < len(records_a.n) else None,
+                'cycle_b': int(records_b.n[d.b]) if d.b < len(records_b.n) else None,
+                'fields': field_differences(records_a, records_b, d.a, d.b, timing)
+                          if d.a < len(records_a.n) and d.b < len(records_b.n) else [],
+                'resync_a': None if d.resync_a is None else int(records_a.n[d.resync_a]),
+                'resync_b': None if d.resync_b is None else int(records_b.n[d.resync_b]),
+            } for d in divergences],
+            'instructions_paired': len(deltas),
+            'instructions_changed': len(changed),
+        }
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    sys.exit(1 if divergences else 0)
+
+if __name__ == '__main__':
+    main()
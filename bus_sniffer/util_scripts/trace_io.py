@@ -0,0 +1,239 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   trace_io.py
+#
+#   Reading and writing decoded traces as CSV, Parquet or Arrow.
+#
+#   The format is chosen by file extension: .parquet or .pq for Parquet, and
+#   .arrow, .feather or .ipc for Arrow IPC. Anything else is CSV.
+#
+#   CSV is wide text that every reader has to parse again. In the columnar
+#   formats, named states (BUSL, T, QOP, SEG, IS, DISASM...) are dictionary
+#   encoded and integer columns are stored at their narrowest type. Each frame
+#   of video becomes its own row group, or record batch. A reader can then
+#   load only the columns it needs, and a frame at a time.
+#
+#   The columnar formats need pyarrow, which is optional.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import formatting
+from formatting import CATEGORIES, HEX_COLUMNS, format_columns
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+# Rows per row group when the trace has no FRAME column, and the most rows in
+# one row group when a frame is very long.
+ROW_GROUP_SIZE = 100000
+MAX_ROW_GROUP_SIZE = 1000000
+
+def trace_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in PARQUET_EXTENSIONS:
+        return 'parquet'
+    if ext in ARROW_EXTENSIONS:
+        return 'arrow'
+    return 'csv'
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet and Arrow traces require pyarrow. Install it with 'pip install pyarrow'.")
+    return pyarrow
+
+def column_type(pa, col, values):
+    """ Return the narrowest Arrow type for a column, given its first chunk. """
+    if col in CATEGORIES or col == 'DISASM':
+        return pa.dictionary(pa.int8() if col != 'DISASM' else pa.int32(), pa.string())
+    if col in HEX_COLUMNS:
+        return pa.uint8() if HEX_COLUMNS[col][1] == 'UInt8' else pa.uint32()
+    if col in formatting.BYTES_COLUMNS:
+        return pa.binary()
+    if col in ('N', 'IDX', 'd_accum'):
+        return pa.int64()
+    if col in ('B', 'QL'):
+        return pa.uint8()
+    if col == 'ns_d':
+        return pa.int32()
+    if col == 'FRAME':
+        return pa.uint32()
+    if col in ('R_X', 'R_Y'):
+        return pa.uint16()
+    if col == 'WAITS':
+        return pa.uint16()
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return pa.bool_()
+    if pd.api.types.is_integer_dtype(values.dtype):
+        # Input signal columns are 0 or 1.
+        if len(values) and values.min() >= 0 and values.max() <= 1:
+            return pa.uint8()
+        return pa.int64()
+    if pd.api.types.is_float_dtype(values.dtype):
+        return pa.float64()
+    return pa.string()
+
+class CsvWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.header = True
+
+    def write(self, rows):
+        format_columns(rows).to_csv(self.file, index=False, header=self.header)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+class ColumnarWriter:
+    """ Writes a decoded trace to Parquet or Arrow, one row group per frame. """
+    def __init__(self, path, kind):
+        self.pa = import_pyarrow()
+        self.path = path
+        self.kind = kind
+        self.schema = None
+        self.writer = None
+        self.pending = []
+        self.pending_rows = 0
+        # DISASM categories seen so far. New ones are only ever appended, so a
+        # batch's dictionary extends the previous one.
+        self.disasm = {}
+
+    def write(self, rows):
+        if self.schema is None:
+            pa = self.pa
+            self.schema = pa.schema([(col, column_type(pa, col, rows[col])) for col in rows.columns])
+            if self.kind == 'parquet':
+                self.writer = pa.parquet.ParquetWriter(self.path, self.schema)
+            else:
+                options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+                self.writer = pa.ipc.new_file(self.path, self.schema, options=options)
+
+        self.pending.append(rows)
+        self.pending_rows += len(rows)
+
+        if 'FRAME' in rows.columns:
+            # Write every frame that has ended.
+            frames = pd.concat(self.pending, ignore_index=True)
+            frame = frames['FRAME'].to_numpy()
+            starts = np.flatnonzero(frame[1:] != frame[:-1]) + 1
+            start = 0
+            for end in starts.tolist():
+                self.write_group(frames.iloc[start:end])
+                start = end
+            self.pending = [frames.iloc[start:]]
+            self.pending_rows = len(frames) - start
+            if self.pending_rows >= MAX_ROW_GROUP_SIZE:
+                self.flush()
+        elif self.pending_rows >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending_rows:
+            self.write_group(pd.concat(self.pending, ignore_index=True))
+        self.pending = []
+        self.pending_rows = 0
+
+    def write_group(self, rows):
+        if 'DISASM' in rows.columns:
+            for text in rows['DISASM'].dropna().unique().tolist():
+                self.disasm.setdefault(text, len(self.disasm))
+            rows = rows.assign(DISASM=pd.Categorical(rows['DISASM'], categories=list(self.disasm)))
+
+        table = self.pa.Table.from_pandas(rows, schema=self.schema, preserve_index=False)
+        if self.kind == 'parquet':
+            self.writer.write_table(table, row_group_size=len(table))
+        else:
+            for batch in table.to_batches(max_chunksize=len(table)):
+                self.writer.write_batch(batch)
+
+    def close(self):
+        if self.schema is None:
+            return
+        self.flush()
+        self.writer.close()
+
+def open_writer(path):
+    """ Return a writer for a decoded trace, with write(rows) and close(). """
+    kind = trace_format(path)
+    if kind == 'csv':
+        return CsvWriter(path)
+    return ColumnarWriter(path, kind)
+
+def write_trace(df, path):
+    writer = open_writer(path)
+    writer.write(df)
+    writer.close()
+
+def trace_columns(path):
+    """ Return the column names of a trace file without reading its rows. """
+    kind = trace_format(path)
+    if kind == 'csv':
+        return list(pd.read_csv(path, comment=';', nrows=0).columns.str.strip())
+    pa = import_pyarrow()
+    if kind == 'parquet':
+        return pa.parquet.read_schema(path).names
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).schema.names
+
+def read_trace(path, columns=None):
+    """ Read a trace into a DataFrame with decoded columns in their numeric form
+    (see formatting.py). If 'columns' is given, only those that exist are read.
+    """
+    kind = trace_format(path)
+    if columns is not None:
+        present = trace_columns(path)
+        columns = [col for col in columns if col in present]
+
+    if kind == 'csv':
+        if columns is None:
+            return formatting.read_csv(path)
+        wanted = set(columns)
+        return formatting.read_csv(path, usecols=lambda col: col.strip() in wanted)[columns]
+
+    pa = import_pyarrow()
+    if kind == 'parquet':
+        table = pa.parquet.read_table(path, columns=columns)
+    else:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+
+    df = table.to_pandas()
+    # Integer columns with missing values come back as floats.
+    for field in table.schema:
+        if pa.types.is_integer(field.type) and field.name not in HEX_COLUMNS and table.column(field.name).null_count:
+            df[field.name] = df[field.name].astype(str(field.type).capitalize().replace('Uint', 'UInt'))
+    for col, (_, dtype) in HEX_COLUMNS.items():
+        if col in df.columns:
+            df[col] = df[col].astype(dtype)
+    for col, categories in CATEGORIES.items():
+        if col in df.columns:
+            df[col] = pd.Categorical(df[col], categories=categories)
+    return df
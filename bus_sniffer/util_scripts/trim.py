@@ -31,6 +31,8 @@ import pandas as pd
 import sys
 import pandas as pd
 
+from progress import Progress
+
 def process_chunk(chunk, min_time, max_time):
     if max_time > 0:  # If max_time is given, filter rows based on the range
         filtered_chunk = chunk[(chunk['Time(s)'] >= min_time) & (chunk['Time(s)'] <= max_time)]
@@ -39,12 +41,16 @@ def process_chunk(chunk, min_time, max_time):
     return filtered_chunk
 
 def filter_csv(input_file, output_path, min_time, max_time, chunk_size=10000):
-    chunk_iter = pd.read_csv(input_file, chunksize=chunk_size)
-    first_chunk = True
-    for chunk in chunk_iter:
-        filtered_chunk = process_chunk(chunk, min_time, max_time)
-        filtered_chunk.to_csv(output_path, mode='a', index=False, header=first_chunk)
-        first_chunk = False
+    progress = Progress('Trim', path=input_file)
+    with open(input_file, 'rb') as infile:
+        chunk_iter = pd.read_csv(progress.follow(infile), chunksize=chunk_size)
+        first_chunk = True
+        for chunk in chunk_iter:
+            filtered_chunk = process_chunk(chunk, min_time, max_time)
+            filtered_chunk.to_csv(output_path, mode='a', index=False, header=first_chunk)
+            first_chunk = False
+            progress.update(len(chunk))
+    progress.finish()
 
 def main():
     if len(sys.argv) != 5:
@@ -0,0 +1,222 @@
+#    Copyright 2022-2023 Daniel Balsom
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#    Permission is hereby granted, free of charge, to any person obtaining a
+#    copy of this software and associated documentation files (the “Software”),
+#    to deal in the Software without restriction, including without limitation
+#    the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#    and/or sell copies of the Software, and to permit persons to whom the
+#    Software is furnished to do so, subject to the following conditions:
+#
+#    The above copyright notice and this permission notice shall be included in
+#    all copies or substantial portions of the Software.
+#
+#    THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#    DEALINGS IN THE SOFTWARE.
+#    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+#   engine.py
+#
+#   Per-cycle streaming engine for the 8088 bus.
+#
+#   BusDecoder is fed one CPU cycle at a time. cycle() decodes the bus side of
+#   a cycle: ALE, the address latch, the T-state and the data bus. The queue
+#   status of a cycle describes what the queue did during the previous cycle,
+#   so the queue and instruction fetch side of a cycle is completed by
+#   complete() once the queue status of the following cycle is known.
+#
+#   All state lives in a CoreState object, which can be saved and restored to
+#   continue decoding elsewhere in a trace.
+
+from .states import BusStatus, QueueOp, TState, INSTR_PREFIXES, QUEUE_SIZE
+
+class QueueError(Exception):
+    pass
+
+class InstructionQueue:
+    """ The 8088's prefetch queue. Items are usually bytes, but may be any value
+    such as (ip, byte) tuples.
+    """
+    def __init__(self, items=None):
+        self.items = list(items) if items is not None else []
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def push(self, item):
+        if len(self.items) >= QUEUE_SIZE:
+            raise QueueError("queue overflow")
+        self.items.append(item)
+
+    def pop(self):
+        if not self.items:
+            raise QueueError("queue underflow")
+        return self.items.pop(0)
+
+    def clear(self):
+        self.items.clear()
+
+def next_t_state(t_state, ale, ready, prev_ready):
+    """ Return the T-state of a cycle given the T-state of the previous cycle. 'ale'
+    is True on the first cycle of a bus cycle.
+    """
+    if ale:
+        return TState.T1
+    if t_state == TState.T1:
+        return TState.T2
+    if t_state == TState.T2:
+        return TState.T3
+    if t_state == TState.T3:
+        if prev_ready == 0 or ready == 0:
+            return TState.TW
+        return TState.T4
+    if t_state == TState.TW:
+        if prev_ready == 1:
+            return TState.T4
+        return TState.TW
+    if t_state == TState.T4:
+        return TState.TI
+    return t_state
+
+class CoreState:
+    """ Complete state of the bus decoder between two cycles. """
+    def __init__(self):
+        # Bus status and address latch
+        self.prev_b = None
+        self.al = None
+        self.busl = None
+
+        # T-state
+        self.t_state = TState.TI
+        self.prev_ready = None
+
+        # Prefetch queue
+        self.queue = InstructionQueue()
+
+        # Instruction assembly. 'idx' is the cycle the current instruction's
+        # first byte was read from the queue.
+        self.inst_status = ''
+        self.inst = []
+        self.idx = 0
+
+        # The data bus value and bus status latch of the last cycle, kept until
+        # complete() is called for it.
+        self.last_d = None
+        self.last_busl = None
+
+    def save(self):
+        """ Return the state as a dict of plain values, suitable for JSON. """
+        values = dict(self.__dict__)
+        values['queue'] = list(self.queue.items)
+        values['inst'] = list(self.inst)
+        return values
+
+    @classmethod
+    def load(cls, values):
+        state = cls()
+        for key, value in values.items():
+            setattr(state, key, value)
+        state.queue = InstructionQueue(values['queue'])
+        state.inst = list(values['inst'])
+        return state
+
+class BusDecoder:
+    """ Decodes the 8088 bus one cycle at a time. """
+    def __init__(self, state=None):
+        self.state = state if state is not None else CoreState()
+
+    def cycle(self, b, addr, ready):
+        """ Decode the bus side of the next cycle from its bus status, address bus
+        and READY line. Returns (ale, t_state, d), where d is the data bus byte if
+        data is valid this cycle, or None.
+        """
+        s = self.state
+
+        # ALE is active when the bus status changes from PASV to any other state.
+        ale = s.prev_b == BusStatus.PASV and b != BusStatus.PASV
+        s.prev_b = b
+        if ale:
+            s.al = addr
+
+        prev_t_state = s.t_state
+        t_state = next_t_state(prev_t_state, ale, ready, s.prev_ready)
+        s.t_state = t_state
+        s.prev_ready = ready
+
+        # Data is valid on T3 if the bus was ready, or on the T4 after wait states.
+        d = None
+        if not ale and ((prev_t_state == TState.T2 and ready == 1) or
+                        (prev_t_state == TState.TW and t_state == TState.T4)):
+            d = addr & 0xFF
+
+        # Latch the bus status for the rest of the bus cycle.
+        if ale:
+            s.busl = b
+        elif t_state == TState.TI:
+            s.busl = BusStatus.PASV
+
+        s.last_d = d
+        s.last_busl = s.busl
+        return ale, t_state, d
+
+    def complete(self, n, next_qop):
+        """ Run the queue and instruction fetch step for cycle 'n', the last cycle
+        passed to cycle(), given the queue status of the following cycle (None at
+        the end of a trace).
+
+        Returns (qb, finished, error). 'qb' is the byte read from the queue, or
+        None. 'finished' is (idx, bytes) for the instruction ended by reading the
+        first byte of a new one, or None. 'error' is a QueueError, or None.
+        """
+        s = self.state
+        queue = s.queue
+        error = None
+
+        # A code fetch completed on this cycle goes into the queue.
+        if s.last_d is not None and s.last_busl == BusStatus.CODE:
+            try:
+                queue.push(s.last_d)
+            except QueueError as e:
+                error = e
+
+        qb = None
+        if next_qop == QueueOp.First or next_qop == QueueOp.Subs:
+            try:
+                qb = queue.pop()
+            except QueueError as e:
+                error = e
+        elif next_qop == QueueOp.Empty:
+            queue.clear()
+
+        finished = None
+        if qb is not None:
+            new_inst = False
+            if next_qop == QueueOp.First:
+                if qb in INSTR_PREFIXES:
+                    s.inst_status = 'P'
+                    new_inst = True
+                elif s.inst_status == 'P':
+                    # The prefix already started this instruction.
+                    s.inst_status = 'I'
+                else:
+                    s.inst_status = 'I'
+                    new_inst = True
+
+            if new_inst:
+                finished = (s.idx, s.inst)
+                s.inst = []
+                s.idx = n
+
+            s.inst.append(qb)
+
+        return qb, finished, error
@@ -23,21 +23,12 @@ from common.srdhelper import bitpack
 from collections import deque
 from .disasm import Disassembler
 from .emulator import Emulator
+from .bus_core.states import BusStatus, QueueOp, Segment, TState, BUS_STATES, QUEUE_STATES, SEG_STATES, INSTR_PREFIXES
+from .bus_core.engine import InstructionQueue, next_t_state
 
 class ChannelError(Exception):
     pass
 
-PREFIXES = [
-    0x26,
-    0x2E,
-    0x36,
-    0x3E,
-    0xF0,
-    0xF1,
-    0xF2,
-    0xF3,
-]
-
 ADDRESS_LINES = [
     "ad0",
     "ad1",
@@ -122,9 +113,6 @@ class Addr:
 class Status:
     S0, S1, S2 = 20, 21, 22
 
-class TState:
-    TI, T1, T2, T3, TW, T4 = range(6)
-
 class Annot:
     (
         ALE,
@@ -163,19 +151,6 @@ class Annot:
         Err,
     ) = range(34)
 
-class BusStatus:
-    INTA,IOR,IOW,HALT,CODE,MEMR,MEMW,PASV = range(8)
-
-class QueueOp:
-    Idle, First, Empty, Subs = range(4)
-
-QUEUE_STATES = [
-    '.',
-    'F',
-    'E',
-    'S',
-]
-
 QUEUE_ANNOTS = [
     Annot.QsF,
     Annot.QsF,
@@ -183,17 +158,6 @@ QUEUE_ANNOTS = [
     Annot.QsS,
 ]
 
-BUS_STATES = [
-    'INTA',
-    'IOR',
-    'IOW',
-    'HALT',
-    'CODE',
-    'MEMR',
-    'MEMW',
-    'PASV',
-]
-
 BUS_ANNOTS = [
     Annot.INTA,
     Annot.IOR,
@@ -225,13 +189,6 @@ T_ANNOTS = [
     Annot.T1
 ]
 
-SEG_STATES = [
-    'ES',
-    'SS',
-    'CS',
-    'DS',
-]
-
 SEG_ANNOTS = [
     Annot.ES,
     Annot.SS,
@@ -239,9 +196,6 @@ SEG_ANNOTS = [
     Annot.DS
 ]
 
-class Segment:
-    ES, SS, CS, DS = range(4)
-
 def reduce_bus(bus):
     if 0xFF in bus:
         return None # unassigned bus channels
@@ -447,7 +401,7 @@ class Decoder(srd.Decoder):
         self.data_valid = False
         self.data_bus = 0
 
-        self.queue = deque()
+        self.queue = InstructionQueue()
         self.opcode = TrackedValue(0)
         self.instr_ss = TrackedValue()
         self.instr = deque()
@@ -608,13 +562,10 @@ class Decoder(srd.Decoder):
             return None
 
     def queue_push(self, ip, byte):
-        if len(self.queue) > 3:
-            raise IndexError("queue overflow")
-        else:
-            self.queue.append((ip, byte))
+        self.queue.push((ip, byte))
 
     def queue_pop(self):
-        return self.queue.popleft()
+        return self.queue.pop()
 
     def instr_push(self, ip, byte):
         if len(self.instr) < 8:
@@ -647,7 +598,7 @@ class Decoder(srd.Decoder):
                 pc, qb = self.queue_pop()
                 
                 if self.queue_status.prev == QueueOp.First:
-                    if qb in PREFIXES:
+                    if qb in INSTR_PREFIXES:
                         self.prefix_ct += 1                    
                     self.ip = pc
 
@@ -711,7 +662,7 @@ class Decoder(srd.Decoder):
                 # We adjust IP by the number of prefixes fetched, since prefixes count as part 
                 # of the previous instruction, and to align with disassembly addresses.
                 adj = 0
-                if self.opcode.prev not in PREFIXES:
+                if self.opcode.prev not in INSTR_PREFIXES:
                     adj = self.prefix_ct
 
                 self.put(
@@ -739,7 +690,7 @@ class Decoder(srd.Decoder):
         self.ip = None
         self.inta = 0
 
-        if self.opcode.cur not in PREFIXES:
+        if self.opcode.cur not in INSTR_PREFIXES:
             self.prefix_ct = 0
 
         self.instr.clear()
@@ -747,37 +698,25 @@ class Decoder(srd.Decoder):
         self.instr_writes.clear()
 
     def advance_t_state(self, pins):
-        # Check if we should transition to T1.
-        if self.ale == True and self.t_state != TState.T1:
-            self.t_state = TState.T1
-        else:
+        rdy = pins[Pin.RDY]
+        last_rdy = self.last_pins[Pin.RDY]
+
+        # ALE starts a new bus cycle on the first cycle it is seen.
+        new_cycle = self.ale == True and self.t_state != TState.T1
+
+        if not new_cycle:
             if self.t_state == TState.T1:
                 # Clear the ALE state - it should only be active for one cycle.
                 self.ale = False
                 self.cycle_annot(Annot.ALE, "ALE")
-                self.t_state = TState.T2
             elif self.t_state == TState.T2:
-                self.t_state = TState.T3
-                if pins[Pin.RDY] == 1:
+                if rdy == 1:
                     self.data_valid = True
-            elif self.t_state == TState.T3:
-                if self.last_pins[Pin.RDY] == 0:
-                    if pins[Pin.RDY] == 1:
-                        self.data_valid = True
-                    self.t_state = TState.TW
-                else:
-                    if pins[Pin.RDY] == 1:
-                        self.t_state = TState.T4
-                    else:
-                        self.t_state = TState.TW
-            elif self.t_state == TState.TW:
-                if self.last_pins[Pin.RDY] == 0:
-                    if pins[Pin.RDY] == 1:
-                        self.data_valid = True
-                else:
-                    self.t_state = TState.T4
-            elif self.t_state == TState.T4:
-                self.t_state = TState.TI
+            elif self.t_state == TState.T3 or self.t_state == TState.TW:
+                if last_rdy == 0 and rdy == 1:
+                    self.data_valid = True
+
+        self.t_state = next_t_state(self.t_state, new_cycle, rdy, last_rdy)
 
     def seg_valid(self):
         if self.bus_status_latch.prev in [BusStatus.CODE, BusStatus.MEMR, BusStatus.MEMW]: